@@ -46,11 +46,22 @@
 #    This produces the html or pdf (according to --docformat) documents of
 #    interest + stuff we don't care about, e.g. intermediate latex sources for
 #    rest->pdf,
+#
+#    The builds of the various documents in the various formats run
+#    concurrently (see --jobs), each logging to a build.log file in a
+#    build-jobs/<part>-<format> subdir of the work dir. Builds whose inputs
+#    did not change since their last success in the work dir are skipped,
+#    unless --rebuild is passed.
 #    
 # 3) Move or copy the final documents in a subdir named after their format
 #    (PDF|HTML subdir), then maybe build an archive of the set of available
 #    items for each format.
 #
+#    Archives are produced incrementally: a manifest of member hashes is
+#    kept next to each, and members which didn't change are copied as-is
+#    from the previous archive while the others are compressed concurrently
+#    (see kitpack.py).
+#
 # Everything takes place in a "root" or "work" directory, specified with
 # --work-dir. The designated dir is created if it doesn't exist, and is reused
 # as-is otherwise. Care must be taken when reusing a work-dir and producing
@@ -184,6 +195,9 @@ from gnatpython.fileutils import cp, mv, rm, mkdir, ls, find
 from datetime import date
 
 import optparse, sys, os.path, shutil, re, hashlib
+import fnmatch, json, multiprocessing, Queue, subprocess, threading
+
+from multiprocessing.pool import ThreadPool
 
 # This lets us access modules that the testuite
 # code features:
@@ -194,18 +208,19 @@ from SUITE.qdata import CTXDATA_FILE, treeref_at
 from SUITE.cutils import contents_of, output_of
 from SUITE.dutils import jload_from
 
+from kitpack import FilterRules, mirror_tree, package_tree
+
 # =======================================================================
 # ==                         MISC UTILITY FUNCTIONS                    ==
 # =======================================================================
 
 class Error (Exception):
-    def __init__(self):
-        pass
+    pass
 
 def fail_if (p, msg):
     if p:
         print msg
-        raise Error
+        raise Error (msg)
 
 def exit_if (p, msg):
     if p:
@@ -242,13 +257,30 @@ def run_list (cmd, dir=None):
 def run (s, dir=None):
     run_list (s.split(), dir)
 
+def run_logged (s, dir, log):
+    """Execute the S command string from the DIR directory, appending the
+    command output to the LOG file. Unlike run, this doesn't switch the
+    current directory, so is usable from concurrent build jobs."""
+
+    with open (log, 'a') as f:
+        f.write ("from : %s\nrun  : %s\n" % (dir, s))
+        f.flush ()
+        status = subprocess.call (
+            s.split(), cwd=dir, stdout=f, stderr=subprocess.STDOUT)
+
+    fail_if (
+        status != 0, "execution of '%s' failed, log is %s" % (s, log))
+
 def announce (s):
     print "=========== " + s
 
-def remove (path):
-    """Delete the file or directory subtree designated by PATH"""
+def remove (path, wdir=None):
+    """Delete the file or directory subtree designated by PATH, going through
+    WDIR, or the current directory if None."""
+
+    wdir = wdir if wdir else os.getcwd()
 
-    print "from : %s" % os.getcwd()
+    print "from : %s" % wdir
     print "remove : %s" % path
 
     # To prevent big damage if the input PATH argument happens to have been
@@ -258,7 +290,7 @@ def remove (path):
     # obviously bogus arguments such as anything leading to a parent of the
     # current dir (e.g. "/", or ...).
 
-    local_name = "./old_stuff_to_be_removed"
+    local_name = os.path.join (wdir, "old_stuff_to_be_removed")
 
     # Note that what we have to remove maybe be a regular filee or an entire
     # directory subtree and that rm("recursive=True") is not guaranteed to
@@ -287,6 +319,27 @@ def rdir_in (path):
     components = path.split(':')
     return components[1] if len(components) > 1 else None
 
+# Filter rules for the localization of testsuite dirs. The first rule to hit
+# wins, so the idea is to exclude patterns we know we want out, then include
+# every file with a '.' (.out, .adb, ...), then every directory, then exclude
+# everything. Preserve the STR subdir contents entirely. There's no binary
+# there, and artifacts we all need to produce the STR after the copy (e.g.
+# Makefile).
+
+LOCALIZE_RULES = FilterRules ((
+    ('-', "/tests"),
+    ('-', "/output"),
+    ('-', "/rep_gnatcov*"),
+    ('-', "*.o"),
+    ('-', "*.obj"),
+    ('-', "*.exe"),
+    ('-', "*.trace"),
+    ('-', "*.dmap"),
+    ('+', "*.*"),
+    ('+', "*/"),
+    ('+', "/STR/**"),
+    ('-', "*")))
+
 # current git branch name, used as kit identifier:
 
 def current_gitbranch_at (dirname):
@@ -303,6 +356,194 @@ def current_gitbranch_at (dirname):
 
     return this_branch
 
+# =======================================================================
+# ==                        DOCUMENT BUILD GRAPH                       ==
+# =======================================================================
+
+# Once the QM model is generated and the testsuite dir is localized, the
+# builds of the various parts in the various formats are independent from
+# each other, except for a few sharing a build directory. We arrange to run
+# them concurrently, as jobs in a graph with explicit dependencies, each
+# logging to a file of its own.
+
+# Jobs record a digest of the trees they take their inputs from in a
+# manifest, and are skipped when nothing changed since they last succeeded
+# and their result is still there.
+
+BUILD_MANIFEST = "build_manifest.json"
+
+# Patterns of file or directory names not to consider as job inputs: build
+# outputs and byproducts.
+
+INPUT_EXCLUDES = (
+    "build", ".git", "*.pyc", "__pycache__", "missing_tr_log.txt")
+
+def excluded_input (name):
+    return any (fnmatch.fnmatch (name, pattern) for pattern in INPUT_EXCLUDES)
+
+def tree_digest (roots):
+    """Digest of the names and contents of the files in the ROOTS list of
+    directory trees."""
+
+    digest = hashlib.sha1()
+
+    for root in roots:
+        digest.update (root + '\0')
+        for (dirpath, dirnames, filenames) in os.walk (root):
+            dirnames[:] = sorted (
+                d for d in dirnames if not excluded_input (d))
+
+            for f in sorted (filenames):
+                if excluded_input (f):
+                    continue
+                path = os.path.join (dirpath, f)
+                digest.update (os.path.relpath (path, root) + '\0')
+                with open (path, 'rb') as fd:
+                    digest.update (fd.read())
+
+    return digest.hexdigest()
+
+class BuildJob:
+    """Production of document PART in DOCFORMAT, through a call to BUILD
+    with the job as argument. The build takes its inputs from the INPUTS
+    list of directories and produces OUTPUT. It may only start when all the
+    jobs in DEPS have completed successfully. WDIR is a private directory for
+    the job, where its log file is also located."""
+
+    def __init__ (self, part, docformat, build, inputs, output, wdir,
+                  deps=()):
+        self.name = "%s-%s" % (part, docformat)
+        self.part = part
+        self.docformat = docformat
+        self.build = build
+        self.inputs = inputs
+        self.output = output
+        self.deps = deps
+
+        self.wdir = os.path.join (wdir, self.name)
+        self.log = os.path.join (self.wdir, "build.log")
+
+        # OK, UP-TO-DATE, FAILED or NOT-RUN once done, with the reason
+        # for failures:
+
+        self.status = None
+        self.error = None
+
+class BuildGraph:
+    """Graph of BuildJobs, run with at most JOBS of them at once. The input
+    digests of successful jobs are recorded in the MANIFEST file, and jobs
+    whose inputs did not change are skipped unless FORCE."""
+
+    def __init__ (self, manifest, jobs, force=False):
+        self.manifest = manifest
+        self.jobs = jobs
+        self.force = force
+
+        self.nodes = []
+        self.lock = threading.Lock()
+
+        self.digests = {}
+        if os.path.exists (manifest):
+            with open (manifest) as f:
+                self.digests = json.load (f)
+
+    def add (self, job):
+        self.nodes.append (job)
+        return job
+
+    def __save_manifest (self):
+        with open (self.manifest, 'w') as f:
+            json.dump (self.digests, f, indent=1, sort_keys=True,
+                       separators=(',', ': '))
+
+    def __execute (self, job):
+        """Run JOB, setting its status. Return the job in any case, as run
+        waits for the completion callback of each job it starts."""
+
+        try:
+            mkdir (job.wdir)
+            open (job.log, 'w').close ()
+
+            digest = tree_digest (job.inputs)
+            if (not self.force and self.digests.get (job.name) == digest
+                and os.path.exists (job.output)):
+                job.status = 'UP-TO-DATE'
+                return job
+
+            job.build (job)
+
+            with self.lock:
+                self.digests[job.name] = digest
+                self.__save_manifest ()
+            job.status = 'OK'
+
+        except Exception as e:
+            job.status = 'FAILED'
+            job.error = str(e) or e.__class__.__name__
+
+            # Record the reason in the job log as well, next to the output
+            # of the commands that led to it.
+
+            try:
+                with open (job.log, 'a') as f:
+                    f.write ("!!! %s\n" % job.error)
+            except (IOError, OSError):
+                pass
+
+        return job
+
+    def run (self):
+        """Run all the jobs, dependencies first. Return the list of jobs
+        which failed or could not run."""
+
+        pool = ThreadPool (self.jobs)
+        done = Queue.Queue()
+
+        pending = list (self.nodes)
+        running = 0
+
+        while pending or running:
+            for job in list (pending):
+                dep_status = [dep.status for dep in job.deps]
+
+                if any (st in ('FAILED', 'NOT-RUN') for st in dep_status):
+                    job.status = 'NOT-RUN'
+                    job.error = "dependency failed"
+                    pending.remove (job)
+
+                elif all (st in ('OK', 'UP-TO-DATE') for st in dep_status):
+                    pending.remove (job)
+                    pool.apply_async (
+                        self.__execute, (job,), callback=done.put)
+                    running += 1
+
+            if running:
+                done.get ()
+                running -= 1
+
+            elif pending:
+                # Nothing can run any more: dependency cycle
+
+                for job in pending:
+                    job.status = 'NOT-RUN'
+                    job.error = "dependency cycle"
+                pending = []
+
+        pool.close ()
+        pool.join ()
+
+        return [job for job in self.nodes
+                if job.status not in ('OK', 'UP-TO-DATE')]
+
+    def summary (self):
+        """Text summary of the job statuses."""
+
+        return '\n'.join (
+            ["%-12s %-10s %s%s" % (
+                job.name, job.status, job.log,
+                " (%s)" % job.error if job.error else "")
+             for job in self.nodes])
+
 # =======================================================================
 # ==              QUALIF MATERIAL GENERATION HELPER CLASS              ==
 # =======================================================================
@@ -320,8 +561,10 @@ GIT_CLONE_SUBDIR = "gnatcoverage-git-clone"
 
 class QMAT:
 
-    def itemsdir (self):
-        return os.path.join (self.workdir, "%s" % self.this_docformat.upper())
+    def itemsdir (self, docformat=None):
+        return os.path.join (
+            self.workdir,
+            "%s" % (docformat if docformat else self.this_docformat).upper())
 
     def __init__(self, options):
 
@@ -339,14 +582,10 @@ class QMAT:
 
         self.local_testsuite_dir = None
 
-        # To be set prior to build_as_needed():
+        # The format of the kit we are building, if any:
 
         self.this_docformat = None
 
-        # Sequence number of doc build pass we are processing:
-
-        self.passno = 0
-
     # --------------------
     # -- setup_workdir --
     # --------------------
@@ -415,17 +654,19 @@ class QMAT:
     # -- kititem_for --
     # -----------------
 
-    def kititem_for (self, part):
+    def kititem_for (self, part, docformat=None):
         """The name of the filesystem entity which materializes PART in a kit
         distribution.  This will be a subdirectory name for treeish formats
         a-la html (e.g. TOR, which will contain content.html etc), or a
         specific filename (e.g. PLANS.pdf) for other formats. This is what
         latch_into sets up eventually."""
-        
-        this_item_is_tree = (self.this_docformat == 'html')
+
+        docformat = docformat if docformat else self.this_docformat
+
+        this_item_is_tree = (docformat == 'html')
 
         this_item_suffix = (
-            '' if this_item_is_tree else '.%s' % self.this_docformat)
+            '' if this_item_is_tree else '.%s' % docformat)
 
         return "%(part)s%(suffix)s" % {
             "part": part.upper(),
@@ -467,16 +708,23 @@ class QMAT:
     #
     # for the html versions.
 
-    def __latch_into (self, dir, part, toplevel, copy_from=None):
+    # The sphinx output is looked for in BUILD_DIR, relative to the current
+    # directory by default. Build jobs pass absolute names, together with a
+    # private WDIR for the removal of old results.
+
+    def __latch_into (self, dir, part, toplevel, copy_from=None,
+                      docformat=None, build_dir="build", wdir=None):
+
+        docformat = docformat if docformat else self.this_docformat
 
-        this_target_is_tree = (self.this_docformat == 'html')
+        this_target_is_tree = (docformat == 'html')
 
         # Compute the target dir or file name for our copy:
 
         this_target = (
             dir if toplevel and this_target_is_tree
             else os.path.join (
-                dir, self.kititem_for(part=part))
+                dir, self.kititem_for(part=part, docformat=docformat))
             )
 
         # Compute the source dir or file name for our copy:
@@ -487,21 +735,21 @@ class QMAT:
         # produce PART.<docformat>, e.g. TOR.pdf:
 
         this_build_subdir = os.path.join (
-            copy_from if copy_from is not None else "build",
-            sphinx_target_for[self.this_docformat]
+            copy_from if copy_from is not None else build_dir,
+            sphinx_target_for[docformat]
             )
 
         this_source = (
             this_build_subdir if this_target_is_tree
             else os.path.join(this_build_subdir,
-            part.upper() + ".%s" % self.this_docformat)
+            part.upper() + ".%s" % docformat)
             )
 
 
         # Delete an old version of latched results that might
         # already be there if we're running with --work-dir.
 
-        remove (this_target)
+        remove (this_target, wdir)
 
         # Now proceed with the latch operation per se:
 
@@ -515,7 +763,7 @@ class QMAT:
             mv (this_build_subdir, this_target)
 
         print "%s %s available in %s %s" % (
-            self.this_docformat, part.upper(),
+            docformat, part.upper(),
             this_target, "(toplevel)" if toplevel else ""
             )
 
@@ -540,50 +788,72 @@ class QMAT:
     # -- __qm_build --
     # ----------------
 
-    def __qm_build (self, part):
-        """Build one PART of using the Qualifying Machine."""
+    def __qm_dir (self):
+        return os.path.join (self.repodir, "qualification", "qm")
 
-        announce ("building %s %s" % (self.this_docformat, part.upper()))
+    def __qm_build (self, job):
+        """Build one part of using the Qualifying Machine, for the build
+        JOB."""
+
+        announce ("building %s %s" % (job.docformat, job.part.upper()))
+
+        # All the builds would use the same "build" directory in the qm dir,
+        # so each works in a private copy of it. The copy is a sibling of
+        # the qm dir, so relative references to the repository artifacts
+        # from the model still hold.
+
+        qm_dir = self.__qm_dir()
+        sandbox = os.path.join (
+            os.path.dirname (qm_dir), "qm-%s" % job.name)
+
+        remove (sandbox, job.wdir)
+        shutil.copytree (
+            qm_dir, sandbox, ignore=shutil.ignore_patterns ("build"))
 
-        os.chdir (
-            os.path.join (self.repodir, "qualification", "qm")
-            )
-        
         # The qmachine model might use the "build" directory as
         # a repository, and it has to preexist:
 
-        mkdir ("build")
-        run ("qmachine model.xml -l scripts/generate_%s_%s.py" \
-                 % (part, self.this_docformat))
+        mkdir (os.path.join (sandbox, "build"))
+        run_logged (
+            "qmachine model.xml -l scripts/generate_%s_%s.py" \
+                % (job.part, job.docformat),
+            dir=sandbox, log=job.log)
 
         self.__latch_into (
-                dir=self.itemsdir(), part=part, toplevel=False)
+                dir=self.itemsdir(job.docformat), part=job.part,
+                toplevel=False, docformat=job.docformat,
+                build_dir=os.path.join (sandbox, "build"), wdir=job.wdir)
+
+        # The consistency log expects the TOR/TR consistency data from the
+        # QM in the qm dir:
+
+        tr_log = os.path.join (sandbox, "missing_tr_log.txt")
+        if os.path.exists (tr_log):
+            cp (tr_log, qm_dir)
 
     # ---------------
     # -- build_tor --
     # ---------------
 
-    def build_tor (self):
-
-        # If we have a local testsuite dir at hand and we haven't done so
-        # already, fetch the testsresults that the QM needs to check TOR/TC
-        # consistency:
+    def __sync_test_results (self):
+        """Fetch the test results that the QM needs to check TOR/TC
+        consistency from our local testsuite dir."""
 
-        if self.local_testsuite_dir and self.passno == 1:
-            os.chdir (self.local_testsuite_dir)
+        os.chdir (self.local_testsuite_dir)
 
-            def sync(relative):
-                target_dir = os.path.join (
-                    self.repodir, "testsuite", os.path.dirname (tr)
-                    )
-                if os.path.exists(target_dir):
-                    cp (relative, target_dir)
-                else:
-                    print ("ERRRR !! inexistant target dir for %s" % relative)
+        def sync(relative):
+            target_dir = os.path.join (
+                self.repodir, "testsuite", os.path.dirname (tr)
+                )
+            if os.path.exists(target_dir):
+                cp (relative, target_dir)
+            else:
+                print ("ERRRR !! inexistant target dir for %s" % relative)
 
-            [sync(tr) for tr in find (root=".", pattern="tc.dump")]
+        [sync(tr) for tr in find (root=".", pattern="tc.dump")]
 
-        self.__qm_build (part="tor")
+    def build_tor (self, job):
+        self.__qm_build (job)
 
     # ------------------------------
     # -- dump_kit_consistency_log --
@@ -745,27 +1015,16 @@ class QMAT:
         # Exclude non qualification tests and internal reports aimed at our
         # intranet from the transfer. All useless and potentially confusing.
         # Also get rid of binaries, including executables without extensions.
+        # See LOCALIZE_RULES.
 
-        # First rsync rule to hit wins, so the idea is to exclude patterns we
-        # know we want out, then include every file with a '.' (.out, .adb,
-        # ...), then every directory, then exclude everything. Preserve the
-        # STR subdir contents entirely. There's no binary there, and artifacts
-        # we all need to produce the STR after the copy (e.g. Makefile).
-
-        run ("rsync -arz --delete --delete-excluded %s/ %s %s" % (
+        if raccess_in (self.o.testsuite_dir):
+            run ("rsync -arz --delete --delete-excluded %s/ %s %s" % (
+                    self.o.testsuite_dir, self.local_testsuite_dir,
+                    ' '.join (LOCALIZE_RULES.rsync_args())))
+        else:
+            mirror_tree (
                 self.o.testsuite_dir, self.local_testsuite_dir,
-                ' '.join (("--exclude=/tests", 
-                           "--exclude=/output",
-                           "--exclude=/rep_gnatcov*",
-                           "--exclude=*.o",
-                           "--exclude=*.obj",
-                           "--exclude=*.exe",
-                           "--exclude=*.trace",
-                           "--exclude=*.dmap",
-                           "--include=*.*",
-                           "--include=*/",
-                           "--include=/STR/**",
-                           "--exclude=*"))))
+                LOCALIZE_RULES)
 
         self.log (
             "testsuite-dir %s fetched as %s" % (
@@ -806,22 +1065,26 @@ class QMAT:
     # -- build_str --
     # ---------------
 
-    def build_str (self):
-        announce ("building %s STR" % self.this_docformat)
+    def build_str (self, job):
+        announce ("building %s STR" % job.docformat)
 
-        os.chdir (os.path.join (self.local_testsuite_dir, "STR"))
+        str_dir = os.path.join (self.local_testsuite_dir, "STR")
 
-        run ("make %s" % sphinx_target_for[self.this_docformat])
+        run_logged (
+            "make %s" % sphinx_target_for[job.docformat],
+            dir=str_dir, log=job.log)
 
         self.__latch_into (
-            dir=self.itemsdir(), part='str', toplevel=False)
+            dir=self.itemsdir(job.docformat), part='str', toplevel=False,
+            docformat=job.docformat,
+            build_dir=os.path.join (str_dir, "build"), wdir=job.wdir)
 
     # -----------------
     # -- build_plans --
     # -----------------
 
-    def build_plans (self):
-        self.__qm_build (part="plans")
+    def build_plans (self, job):
+        self.__qm_build (job)
 
     # ---------------
     # -- build_kit --
@@ -881,7 +1144,7 @@ class QMAT:
 
         [self.__relocate_into (dir=kitdir, part=part) for part in self.o.parts]
 
-        run ("zip -q -r %(kitdir)s.zip %(kitdir)s" % {"kitdir": kitdir})
+        self.__package (kitdir)
 
     # -----------------------
     # -- zip_testsuite_dir --
@@ -893,10 +1156,21 @@ class QMAT:
 
         relative_testsuite_dir = os.path.basename (self.local_testsuite_dir)
 
-        zipname = "%s.zip" % relative_testsuite_dir
+        self.__package (relative_testsuite_dir)
 
-        remove (zipname)
-        run ("zip -q -r %s %s" % (zipname, relative_testsuite_dir))
+    # -------------
+    # -- package --
+    # -------------
+
+    def __package (self, dir):
+        """Produce DIR.zip out of DIR, relative to the current directory,
+        reusing what we can from a previous archive there."""
+
+        (reused, compressed) = package_tree (
+            root=dir, zipname="%s.zip" % dir, jobs=self.o.jobs)
+
+        print "%s.zip: %d members reused, %d compressed" % (
+            dir, reused, compressed)
 
     # ---------------------
     # -- build_as_needed --
@@ -914,40 +1188,81 @@ class QMAT:
     def do_kit (self):
         return self.o.kitp
 
-    def build_as_needed (self, docformat):
-
-        self.passno += 1
-        self.this_docformat = docformat
+    def build_as_needed (self, docformats):
 
-        mkdir (self.itemsdir())
-
-        if self.do_str() and self.passno == 1:
+        if self.do_str():
             self.__prepare_str_dir()
         
         if self.o.testsuite_dir and not self.local_testsuite_dir:
             self.__localize_testsuite_dir ()
 
-        # Build the STR as needed, using the REST generated
-        # by prepare_str_dir above:
+        # The TOR build might look into testsuite results to match TC
+        # artifacts against presence of test data dumps:
 
-        if self.do_str():
-            self.build_str()
+        if self.do_tor() and self.local_testsuite_dir:
+            self.__sync_test_results ()
+
+        # Setup the graph of builds for all the formats. The STR builds in
+        # the various formats share the sphinx build dir in the STR subdir
+        # generated by prepare_str_dir above, so need to be serialized:
 
-        # Build the TOR as needed, which might look into testsuite results to
-        # match TC artifacts against presence of test data dumps:
+        graph = BuildGraph (
+            manifest=os.path.join (self.workdir, BUILD_MANIFEST),
+            jobs=self.o.jobs, force=self.o.rebuild)
 
-        if self.do_tor():
-            self.build_tor()
+        jobs_dir = os.path.join (self.workdir, "build-jobs")
 
-        # Build the PLANS as needed:
+        qm_inputs = [self.__qm_dir()]
+        tor_inputs = qm_inputs + [
+            os.path.join (self.repodir, "testsuite", "Qualif")]
 
-        if self.do_plans():
-            self.build_plans()
+        str_job = None
+
+        for docformat in docformats:
+            mkdir (self.itemsdir(docformat))
+
+            def output_for(part):
+                return os.path.join (
+                    self.itemsdir(docformat),
+                    self.kititem_for(part=part, docformat=docformat))
+
+            if self.do_str():
+                str_job = graph.add (BuildJob (
+                    part='str', docformat=docformat, build=self.build_str,
+                    inputs=[os.path.join (self.local_testsuite_dir, "STR")],
+                    output=output_for('str'), wdir=jobs_dir,
+                    deps=[str_job] if str_job else []))
+
+            if self.do_tor():
+                graph.add (BuildJob (
+                    part='tor', docformat=docformat, build=self.build_tor,
+                    inputs=tor_inputs, output=output_for('tor'),
+                    wdir=jobs_dir))
+
+            if self.do_plans():
+                graph.add (BuildJob (
+                    part='plans', docformat=docformat,
+                    build=self.build_plans, inputs=qm_inputs,
+                    output=output_for('plans'), wdir=jobs_dir))
+
+        announce ("building %s with %d jobs" % (
+            ', '.join (job.name for job in graph.nodes), self.o.jobs))
+
+        failures = graph.run ()
+
+        announce ("build summary")
+        print graph.summary ()
+
+        fail_if (
+            failures, "%d build(s) failed: %s" % (
+                len(failures), ', '.join (job.name for job in failures)))
 
         # Build a kit package as queried:
 
         if self.do_kit():
-            qmat.build_kit()
+            for docformat in docformats:
+                self.this_docformat = docformat
+                self.build_kit()
 
 # =======================================================================
 # ==                          MAIN SCRIPT BODY                         ==
@@ -1012,6 +1327,21 @@ def commandline():
             "are to be generated, subset of %s." % valid_parts.__str__())
         )
 
+    op.add_option (
+        "--jobs", "-j", dest="jobs", type='int',
+        default=multiprocessing.cpu_count(),
+        help = (
+            "Maximum number of document builds to run concurrently, also "
+            "used as the number of processes compressing archive members. "
+            "Defaults to the number of CPUs.")
+        )
+    op.add_option (
+        "--rebuild", dest="rebuild", action="store_true", default=False,
+        help = (
+            "Rebuild all the requested parts, even those whose inputs "
+            "did not change since their last build in the work dir.")
+        )
+
     op.add_option (
         "--dolevel", dest="dolevel", default=None,
         type='choice', choices=valid_dolevels,
@@ -1180,7 +1510,7 @@ if __name__ == "__main__":
 
     # Build the various parts and maybe the kit for each requested format:
 
-    [qmat.build_as_needed (docformat=f) for f in options.docformat.split(',')]
+    qmat.build_as_needed (docformats=options.docformat.split(','))
 
     if options.kitp:
         qmat.zip_testsuite_dir()
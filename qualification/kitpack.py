@@ -0,0 +1,450 @@
+"""Packaging helpers for genbundle.py.
+
+This module provides the two packaging steps of qualification kits:
+
+* mirroring a testsuite directory locally through a list of rsync-like
+  include/exclude rules, without the need for rsync;
+
+* writing zip archives of directory trees incrementally. A manifest of the
+  members of the last archive written, with their contents hashes, is kept
+  next to it. Members whose contents did not change are copied from the
+  previous archive as-is, already compressed, and the others are compressed
+  by a pool of worker processes. The archive is written in a single pass.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import struct
+import time
+import zlib
+
+
+# ===================
+# == Tree filtering ==
+# ===================
+
+class FilterRules:
+    """Sequence of rsync-like filter rules, as a list of ('+'|'-', PATTERN)
+    pairs to include or exclude the files matching PATTERN. As with rsync,
+    the first matching rule wins, files matching no rule are included, and
+    the contents of excluded directories are not considered at all.
+
+    Patterns follow the rsync conventions: a leading '/' anchors the pattern
+    at the root of the tree, a trailing '/' restricts it to directories, '*'
+    matches anything but '/' and '**' matches anything. Patterns without a
+    '/' other than a trailing one are matched against the last component of
+    names, other patterns against the full name relative to the root."""
+
+    def __init__(self, rules):
+        self.rules = [(kind, pattern) + self.__compile(pattern)
+                      for (kind, pattern) in rules]
+
+    @staticmethod
+    def __compile(pattern):
+        """Return a (regexp, dir_only, full_path) tuple for PATTERN."""
+
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+
+        full_path = '/' in pattern
+        pattern = pattern.lstrip('/')
+
+        regexp = ''
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith('**', i):
+                regexp += '.*'
+                i += 2
+            elif pattern[i] == '*':
+                regexp += '[^/]*'
+                i += 1
+            elif pattern[i] == '?':
+                regexp += '[^/]'
+                i += 1
+            else:
+                regexp += re.escape(pattern[i])
+                i += 1
+
+        return (re.compile(regexp + '$'), dir_only, full_path)
+
+    def included(self, name, is_dir):
+        """Whether NAME, relative to the root of the tree and with '/'
+        separators, is to be included. IS_DIR tells whether this designates
+        a directory."""
+
+        basename = name.rsplit('/', 1)[-1]
+        for (kind, _, regexp, dir_only, full_path) in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regexp.match(name if full_path else basename):
+                return kind == '+'
+        return True
+
+    def rsync_args(self):
+        """Command line arguments for rsync to apply the same rules."""
+        return ['--%s=%s' % ('include' if kind == '+' else 'exclude',
+                             pattern)
+                for (kind, pattern, _, _, _) in self.rules]
+
+    def walk(self, root):
+        """Yield the (name, is_dir) pairs for all the entries under ROOT
+        which pass the rules, parents first, with NAME relative to ROOT."""
+
+        for (dirpath, dirnames, filenames) in os.walk(root):
+            reldir = os.path.relpath(dirpath, root).replace(os.sep, '/')
+            prefix = '' if reldir == '.' else reldir + '/'
+
+            dirnames[:] = sorted(
+                d for d in dirnames if self.included(prefix + d, True))
+            for d in dirnames:
+                yield (prefix + d, True)
+
+            for f in sorted(filenames):
+                if self.included(prefix + f, False):
+                    yield (prefix + f, False)
+
+
+def mirror_tree(src, dst, rules):
+    """Make DST a mirror of the entries of SRC which pass the RULES
+    FilterRules, deleting anything else from DST, as rsync --delete
+    --delete-excluded would do. Files are only copied when their size or
+    modification time differ."""
+
+    if not os.path.isdir(dst):
+        os.makedirs(dst)
+
+    wanted = set()
+    for (name, is_dir) in rules.walk(src):
+        wanted.add(name)
+        (s, d) = (os.path.join(src, name), os.path.join(dst, name))
+
+        if is_dir:
+            if not os.path.isdir(d):
+                if os.path.lexists(d):
+                    os.remove(d)
+                os.makedirs(d)
+            continue
+
+        sst = os.stat(s)
+        if os.path.lexists(d):
+            dst_stat = os.lstat(d)
+            if (os.path.isfile(d) and not os.path.islink(d)
+                    and dst_stat.st_size == sst.st_size
+                    and int(dst_stat.st_mtime) == int(sst.st_mtime)):
+                continue
+            if os.path.isdir(d) and not os.path.islink(d):
+                shutil.rmtree(d)
+            else:
+                os.remove(d)
+        shutil.copy2(s, d)
+
+    # Delete what we don't want any more, deepest entries first
+
+    for (dirpath, dirnames, filenames) in os.walk(dst, topdown=False):
+        reldir = os.path.relpath(dirpath, dst).replace(os.sep, '/')
+        prefix = '' if reldir == '.' else reldir + '/'
+        for f in filenames:
+            if prefix + f not in wanted:
+                os.remove(os.path.join(dirpath, f))
+        for d in dirnames:
+            path = os.path.join(dirpath, d)
+            if prefix + d not in wanted:
+                if os.path.islink(path):
+                    os.remove(path)
+                else:
+                    shutil.rmtree(path)
+
+
+# ============================
+# == Incremental zip archives ==
+# ============================
+
+# Suffix of the manifest file for an archive
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+# Zip format constants
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIG = 0x04034b50
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+CENTRAL_HEADER_SIG = 0x02014b50
+END_RECORD = struct.Struct('<IHHHHIIH')
+END_RECORD_SIG = 0x06054b50
+ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+ZIP64_END_RECORD_SIG = 0x06064b50
+ZIP64_LOCATOR = struct.Struct('<IIQI')
+ZIP64_LOCATOR_SIG = 0x07064b50
+
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+UNIX_HOST = 3
+
+# Members larger than this would need zip64 local headers, which we don't
+# write.
+
+MAX_MEMBER_SIZE = 0xffffffff
+
+
+def dos_datetime(mtime):
+    """Return the (date, time) pair of DOS timestamps for MTIME."""
+
+    t = time.localtime(mtime)
+    year = max(t.tm_year, 1980)
+    return (((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+            (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2))
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compress_member(args):
+    """Compress the file at PATH, for a worker process. Return a (sha1, crc,
+    size, method, data) tuple."""
+
+    (path, level) = args
+    with open(path, 'rb') as f:
+        contents = f.read()
+
+    if len(contents) > MAX_MEMBER_SIZE:
+        raise ValueError('%s: too large for a zip member' % path)
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(contents) + compressor.flush()
+
+    (method, data) = ((ZIP_DEFLATED, data) if len(data) < len(contents)
+                      else (ZIP_STORED, contents))
+
+    return (hashlib.sha1(contents).hexdigest(),
+            zlib.crc32(contents) & 0xffffffff, len(contents), method, data)
+
+
+class ArchiveWriter:
+    """Streaming writer of zip archives to the F file object, from members
+    with precomputed compressed data."""
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = 0
+        self.central = []
+
+    def __write(self, data):
+        self.f.write(data)
+        self.offset += len(data)
+
+    def add(self, name, mode, mtime, crc, size, method, data):
+        """Add a member NAME, with unix MODE and modification time MTIME,
+        from its DATA compressed according to METHOD. CRC and SIZE are those
+        of the uncompressed contents. Return the offset of DATA in the
+        archive."""
+
+        name = name.encode('utf-8') if not isinstance(name, bytes) else name
+        (date, tim) = dos_datetime(mtime)
+        header_offset = self.offset
+
+        self.__write(LOCAL_HEADER.pack(
+            LOCAL_HEADER_SIG, ZIP_VERSION, 0, method, tim, date,
+            crc, len(data), size, len(name), 0) + name)
+        data_offset = self.offset
+        self.__write(data)
+
+        self.central.append(
+            (name, mode, method, tim, date, crc, len(data), size,
+             header_offset))
+        return data_offset
+
+    def close(self):
+        """Write the central directory."""
+
+        cd_offset = self.offset
+        for (name, mode, method, tim, date, crc, csize, size,
+             header_offset) in self.central:
+
+            # Offsets past 4GB go in a zip64 extra field
+
+            extra = b''
+            if header_offset >= 0xffffffff:
+                extra = struct.pack('<HHQ', 1, 8, header_offset)
+                header_offset = 0xffffffff
+
+            external = (mode & 0xffff) << 16
+            if name.endswith(b'/'):
+                external |= 0x10
+
+            self.__write(CENTRAL_HEADER.pack(
+                CENTRAL_HEADER_SIG,
+                (UNIX_HOST << 8) | (ZIP64_VERSION if extra else ZIP_VERSION),
+                ZIP64_VERSION if extra else ZIP_VERSION,
+                0, method, tim, date, crc, csize, size,
+                len(name), len(extra), 0, 0, 0, external, header_offset))
+            self.__write(name + extra)
+
+        cd_size = self.offset - cd_offset
+        count = len(self.central)
+
+        if (count >= 0xffff or cd_offset >= 0xffffffff
+                or cd_size >= 0xffffffff):
+            zip64_offset = self.offset
+            self.__write(ZIP64_END_RECORD.pack(
+                ZIP64_END_RECORD_SIG, ZIP64_END_RECORD.size - 12,
+                (UNIX_HOST << 8) | ZIP64_VERSION, ZIP64_VERSION, 0, 0,
+                count, count, cd_size, cd_offset))
+            self.__write(ZIP64_LOCATOR.pack(
+                ZIP64_LOCATOR_SIG, 0, zip64_offset, 1))
+            (count, cd_size, cd_offset) = (
+                min(count, 0xffff), min(cd_size, 0xffffffff),
+                min(cd_offset, 0xffffffff))
+
+        self.__write(END_RECORD.pack(
+            END_RECORD_SIG, 0, 0, count, count, cd_size, cd_offset, 0))
+
+
+def load_manifest(zipname):
+    """Return the manifest for the ZIPNAME archive, a dictionary of member
+    descriptions indexed by member name, or an empty dictionary if we have
+    no usable manifest."""
+
+    manifest = zipname + MANIFEST_SUFFIX
+    if not (os.path.exists(zipname) and os.path.exists(manifest)):
+        return {}
+
+    with open(manifest) as f:
+        data = json.load(f)
+
+    # Make sure the manifest describes the archive we have
+
+    st = os.stat(zipname)
+    if data.get('archive_size') != st.st_size:
+        return {}
+    return data['members']
+
+
+def read_raw(f, member):
+    """Return the compressed data for MEMBER, as described in a manifest,
+    out of the F archive file object."""
+
+    f.seek(member['offset'])
+    data = f.read(member['csize'])
+    if len(data) != member['csize']:
+        raise ValueError('truncated member data at %d' % member['offset'])
+    return data
+
+
+def package_tree(root, zipname, jobs=None, level=6):
+    """Write the ZIPNAME archive of the ROOT directory tree, with member
+    names starting with the basename of ROOT, as "zip -r ZIPNAME ROOT" run
+    from the parent of ROOT would. Reuse unchanged members from a previous
+    archive at ZIPNAME and compress the others with JOBS processes, as many
+    as we have CPUs if None. Return a (reused, compressed) pair of member
+    counts."""
+
+    old_members = load_manifest(zipname)
+
+    base = os.path.basename(os.path.normpath(root))
+    entries = [(base, True)] + [
+        (base + '/' + name, is_dir)
+        for (name, is_dir) in FilterRules([]).walk(root)]
+
+    # Figure out which members we can reuse. Trust the size and modification
+    # time to tell unchanged files, and check the hash of the contents
+    # otherwise.
+
+    plan = []
+    to_compress = []
+    for (name, is_dir) in entries:
+        path = os.path.join(os.path.dirname(os.path.normpath(root)), name)
+        st = os.stat(path)
+
+        if is_dir:
+            plan.append((name + '/', st, None))
+            continue
+
+        old = old_members.get(name)
+        if old and (old['size'], old['mtime']) != (st.st_size,
+                                                   int(st.st_mtime)):
+            old = old if old['sha1'] == file_sha1(path) else None
+
+        plan.append((name, st, old))
+        if old is None:
+            to_compress.append((path, level))
+
+    pool = multiprocessing.Pool(jobs) if to_compress else None
+    compressed = (pool.imap(compress_member, to_compress, chunksize=8)
+                  if pool else iter([]))
+
+    tmpname = '%s.tmp%d' % (zipname, os.getpid())
+    new_members = {}
+    old_f = None
+
+    try:
+        old_f = open(zipname, 'rb') if old_members else None
+        with open(tmpname, 'wb') as f:
+            writer = ArchiveWriter(f)
+
+            for (name, st, old) in plan:
+                if name.endswith('/'):
+                    writer.add(name, st.st_mode, st.st_mtime,
+                               0, 0, ZIP_STORED, b'')
+                    continue
+
+                if old is not None:
+                    (sha1, crc, size, method, data) = (
+                        old['sha1'], old['crc'], old['size'], old['method'],
+                        read_raw(old_f, old))
+                else:
+                    (sha1, crc, size, method, data) = next(compressed)
+
+                offset = writer.add(name, st.st_mode, st.st_mtime,
+                                    crc, size, method, data)
+
+                new_members[name] = {
+                    'sha1': sha1, 'crc': crc, 'size': size,
+                    'mtime': int(st.st_mtime), 'method': method,
+                    'csize': len(data), 'offset': offset}
+
+            writer.close()
+
+        if pool:
+            pool.close()
+            pool.join()
+
+    except BaseException:
+        if pool:
+            pool.terminate()
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+    finally:
+        if old_f:
+            old_f.close()
+
+    # Replace the previous archive and its manifest. The manifest goes
+    # last, and the archive size in it guards against mismatches if we are
+    # interrupted in between.
+
+    if os.path.exists(zipname):
+        os.remove(zipname)
+    os.rename(tmpname, zipname)
+
+    # json.dump and indentation would take the slow pure Python encoder,
+    # which matters for kits with tens of thousands of members.
+
+    with open(zipname + MANIFEST_SUFFIX, 'w') as f:
+        f.write(json.dumps({'archive_size': os.path.getsize(zipname),
+                            'members': new_members}))
+
+    return (len(plan) - len(to_compress) - sum(
+        1 for (name, _, _) in plan if name.endswith('/')), len(to_compress))
@@ -2,6 +2,8 @@ import os.path
 import qm
 import qm.rest.pdfgenerator
 
+import importers
+
 def get_userconf():
        # retrieve the author from the environment data artifact
        env = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'env.py')
@@ -30,6 +32,10 @@ class GenHTML(qm.rest.pdfgenerator.SphinxGenerateHtml):
 
 
 def _generate(name, path, generator):
+    # The model may have changed since the previous generation in this
+    # session: forget what the importers know about it.
+    importers.INDEX.clear()
+
     root = None
     top = qm.get_toplevel_artifacts()
     for artifact in top:
@@ -142,6 +142,187 @@ def is_functional(source_resource):
 # Utils #
 #########
 
+class ArtifactIndex(object):
+    """
+    Memoized views on the artifact graph: first requirement ancestor,
+    sources, testcase children and descendants, testcases derived from LRM
+    sections and short descriptions of artifacts, keyed by artifact full
+    name. The views are only valid for a given state of the model, so
+    generate_doc clears the index at the start of each generation.
+
+    Importers used to walk the graph again for each artifact they processed,
+    which made the document generation time quadratic in the number of
+    testcases. Each view is computed at most once per artifact here, out of
+    the views for its parent or its children, so that the total work is
+    linear in the size of the graph.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """
+        Forget everything, e.g. after changes to the model.
+        """
+        self.first_reqs = {}
+        self.sources = {}
+        self.tc_children = {}
+        self.tc_descendants = {}
+        self.source_descendants = {}
+        self.derived_tcs = {}
+        self.short_descriptions = {}
+        self.resource_kinds = {}
+
+    def first_req_relative(self, artifact):
+        """
+        Returns the first parent which is a req.
+
+        :param artifact: the artifact
+        :type artifact: artifact
+        """
+        key = artifact.full_name
+        if key not in self.first_reqs:
+            parent = artifact.relative_to
+            self.first_reqs[key] = (
+                parent if (parent is None or is_req(parent))
+                else self.first_req_relative(parent))
+        return self.first_reqs[key]
+
+    def sources_for(self, artifact):
+        """
+        Returns the sources of an artifact followed by those of all its
+        parents.
+
+        :param artifact: the artifact
+        :type artifact: artifact
+        """
+        key = artifact.full_name
+        if key not in self.sources:
+            result = [child for child in artifact.relatives
+                      if is_source(child)]
+            if artifact.relative_to is not None:
+                result += self.sources_for(artifact.relative_to)
+            self.sources[key] = result
+        return self.sources[key]
+
+    def tc_children_of(self, artifact):
+        """
+        Returns the list of the tc or tc_set children of an artifact.
+
+        :param artifact: the artifact
+        :type artifact: artifact
+        """
+        key = artifact.full_name
+        if key not in self.tc_children:
+            self.tc_children[key] = [child for child in artifact.relatives
+                                     if is_tc_or_set(child)]
+        return self.tc_children[key]
+
+    def testcases_under(self, artifact):
+        """
+        Returns either itself if artifact is a tc or a tc_set
+        or the list of the test cases children of the artifact
+
+        :param artifact: the artifact
+        :type artifact: artifact
+        """
+        key = artifact.full_name
+        if key not in self.tc_descendants:
+            if is_tc_or_set(artifact):
+                result = [artifact]
+            else:
+                result = []
+                for child in artifact.relatives:
+                    result += self.testcases_under(child)
+            self.tc_descendants[key] = result
+        return self.tc_descendants[key]
+
+    def sources_under(self, artifact):
+        """
+        Returns either itself if artifact is a source or
+        the list of the sources children of artifact
+
+        :param artifact: the artifact
+        :type artifact: artifact
+        """
+        key = artifact.full_name
+        if key not in self.source_descendants:
+            if is_source(artifact):
+                result = [artifact]
+            else:
+                result = []
+                for child in artifact.relatives:
+                    result += self.sources_under(child)
+            self.source_descendants[key] = result
+        return self.source_descendants[key]
+
+    def derived_testcases(self, artifact):
+        """
+        Returns the list of the tcs derived from an artifact, typically an
+        LRM section.
+
+        :param artifact: the artifact
+        :type artifact: artifact
+        """
+        key = artifact.full_name
+        if key not in self.derived_tcs:
+            self.derived_tcs[key] = [child
+                                     for children in artifact.derived_to
+                                     for child in children.all
+                                     if is_tc(child)]
+        return self.derived_tcs[key]
+
+    def short_description(self, artifact):
+        """
+        Get the first line of a file as the short description.
+        Layout elements are removed from the description.
+
+        :param artifact: the artifact
+        :type artifact: artifact
+        """
+        key = artifact.full_name
+        if key not in self.short_descriptions:
+            for item in artifact.contents(class_to_content_key(artifact)):
+                content = item.get_content()
+
+                for line in content.splitlines():
+                    line = line.strip()
+                    if len(line) > 0:
+                        #  ** has to be removed
+                        #  from short_description when used in tables
+                        first_line = line.replace('**', '')
+                        break
+
+            self.short_descriptions[key] = first_line
+        return self.short_descriptions[key]
+
+    def resources_of(self, source):
+        """
+        Returns the list of (resource, kind) pairs for the resources of a
+        source artifact, where kind is 'driver', 'functional' or 'helper'.
+
+        :param source: the source artifact
+        :type source: artifact
+        """
+        key = source.full_name
+        if key not in self.resource_kinds:
+            result = []
+            for content_key in source.contents_keys:
+                for resource in source.contents(content_key):
+                    result.append(
+                        (resource,
+                         'driver' if is_driver(resource)
+                         else 'functional' if is_functional(resource)
+                         else 'helper'))
+            self.resource_kinds[key] = result
+        return self.resource_kinds[key]
+
+
+# The index all the importers query
+
+INDEX = ArtifactIndex()
+
+
 def get_short_description(artifact):
     """
     Get the first line of a file as the short description.
@@ -150,19 +331,7 @@ def get_short_description(artifact):
     :param artifact: the artifact
     :type artifact: artifact
     """
-
-    for item in artifact.contents(class_to_content_key(artifact)):
-        content = item.get_content()
-
-        for line in content.splitlines():
-            line = line.strip()
-            if len(line) > 0:
-                #  ** has to be removed
-                #  from short_description when used in tables
-                first_line = line.replace('**', '')
-                break
-
-    return first_line
+    return INDEX.short_description(artifact)
 
 
 def get_first_req_relative(artifact):
@@ -172,9 +341,7 @@ def get_first_req_relative(artifact):
     :param artifact: the artifact
     :type artifact: artifact
     """
-    parent = artifact.relative_to
-    return (parent if (parent is None or is_req(parent))
-            else get_first_req_relative(parent))
+    return INDEX.first_req_relative(artifact)
 
 
 def write_artifact_ref(artifact_full_name, label=None):
@@ -288,17 +455,15 @@ class LRMTableImporter(ArtifactImporter):
                     language_version = a.attributes['language'].strip()
 
                 ref = {}
-                for children in a.derived_to:
-                    for child in children.all:
-                        if is_tc(child):
-                            parent = get_first_req_relative(child).full_name
+                for child in INDEX.derived_testcases(a):
+                    parent = get_first_req_relative(child).full_name
 
-                            if parent not in ref.keys():
-                                ref[parent] = []
+                    if parent not in ref.keys():
+                        ref[parent] = []
 
-                            ref[parent].append([child.full_name,
-                                                child.full_name.replace(
-                                                    parent, '')])
+                    ref[parent].append([child.full_name,
+                                        child.full_name.replace(
+                                            parent, '')])
 
                 pdf_tc_list = ""
                 html_tc_list = ""
@@ -454,11 +619,10 @@ class TCIndexImporter(ArtifactImporter):
         """
         result = []
 
-        for child in artifact.relatives:
-            if is_tc_or_set(child):
-                result.append(child)
-                if depth > 1:
-                    result += self.get_recursive_relatives(child, depth - 1)
+        for child in INDEX.tc_children_of(artifact):
+            result.append(child)
+            if depth > 1:
+                result += self.get_recursive_relatives(child, depth - 1)
 
         return result
 
@@ -739,17 +903,7 @@ class TestCaseImporter(ArtifactImporter):
         :param artifact: the artifact the sources are required from
         :type artifact: artifact
         """
-
-        result = []
-
-        for child in artifact.relatives:
-            if is_source(child):
-                result += [child]
-
-        if artifact.relative_to is not None:
-            result += self.get_sources(artifact.relative_to)
-
-        return result
+        return INDEX.sources_for(artifact)
 
     def to_rest(self, artifact):
 
@@ -795,29 +949,25 @@ class TestCaseImporter(ArtifactImporter):
 
                 continue
 
-            for key in item.contents_keys:
-                if len(item.contents(key)) > 0:
-
-                    for resource in item.contents(key):
+            for resource, kind in INDEX.resources_of(item):
 
-                        if is_driver(resource):
-                            driver_list += [resource.basename]
-                            driver_list_qmref += [writer.qmref
-                                                  (item.full_name,
-                                                   resource.basename)]
-                            continue
+                if kind == 'driver':
+                    driver_list += [resource.basename]
+                    driver_list_qmref += [writer.qmref
+                                          (item.full_name,
+                                           resource.basename)]
 
-                        if is_functional(resource):
-                            func_list += [resource.basename]
-                            func_list_qmref += [writer.qmref
-                                                (item.full_name,
-                                                 resource.basename)]
-                            continue
+                elif kind == 'functional':
+                    func_list += [resource.basename]
+                    func_list_qmref += [writer.qmref
+                                        (item.full_name,
+                                         resource.basename)]
 
-                        helper_list += [resource.basename]
-                        helper_list_qmref += [writer.qmref
-                                              (item.full_name,
-                                               resource.basename)]
+                else:
+                    helper_list += [resource.basename]
+                    helper_list_qmref += [writer.qmref
+                                          (item.full_name,
+                                           resource.basename)]
 
         driver_list.sort()
         driver_list_qmref.sort()
@@ -1006,15 +1156,7 @@ class TestCasesImporter(ArtifactImporter):
         :param artifact: the artifact
         :type artifact: artifact
         """
-        result = []
-
-        if is_tc_or_set(artifact):
-            return [artifact]
-
-        for child in artifact.relatives:
-            result += self.get_testcases(child)
-
-        return result
+        return INDEX.testcases_under(artifact)
 
     def get_sources(self, artifact):
         """
@@ -1024,15 +1166,7 @@ class TestCasesImporter(ArtifactImporter):
         :param artifact: the artifact
         :type artifact: artifact
         """
-        result = []
-
-        if is_source(artifact):
-            return [artifact]
-
-        for child in artifact.relatives:
-            result += self.get_sources(child)
-
-        return result
+        return INDEX.sources_under(artifact)
 
     def qmlink_to_rest(self, parent, artifacts):
 
@@ -4,8 +4,11 @@
 Generation engine, that makes choice on what to generate.
 '''
 
+import multiprocessing
+import optparse
 import os
 import os.path
+import sys
 import textwrap
 
 
@@ -14,6 +17,7 @@ import SCOV.expgen.language.ada
 import SCOV.expgen.generator            as generator
 import SCOV.expgen.generator.composition
 import SCOV.expgen.generator.parsing
+import SCOV.expgen.generator.selection
 import SCOV.expgen.generator.utils
 import SCOV.expgen.topology             as topology
 import SCOV.expgen.utils                as utils
@@ -30,37 +34,145 @@ ada = language.ada.Language()
 one_operand_per_line = True
 
 
-def run(group_py):
+def parse_options(argv=None):
+    '''
+    Parse the command line of "group.py" scripts and return the options.
+    '''
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option(
+        '-j', '--jobs', dest='jobs', type='int', default=None,
+        help='Number of worker processes, as many as we have CPUs by default'
+    )
+    parser.add_option(
+        '--minimal-vectors', dest='criterion', metavar='CRITERION',
+        type='choice', default=None,
+        choices=[
+            generator.selection.UNIQUE_CAUSE, generator.selection.MASKING
+        ],
+        help='Instead of the hand-written drivers, exercise each topology with'
+             ' a consolidated driver that only calls a minimal set of truth'
+             ' vectors achieving CRITERION MC/DC ("unique-cause" or'
+             ' "masking")'
+    )
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error('unexpected arguments: {}'.format(' '.join(args)))
+    return options
+
+
+def run(group_py, jobs=None, criterion=None):
     '''
     Run generation in the directory containing "group_py", catch any exception
-    if any, display them and exit accordingly.
+    if any, display them and exit accordingly. Use `jobs` worker processes, or
+    as many as we have CPUs if None. If `criterion` is not None, generate
+    testcases that exercise a minimal set of truth vectors achieving
+    `criterion` MC/DC instead of the hand-written drivers.
+
+    Arguments left to None are taken from the command line, if specified
+    there.
     '''
-    import sys
+    options = parse_options()
+    if jobs is None:
+        jobs = options.jobs
+    if criterion is None:
+        criterion = options.criterion
 
     env = generator.utils.Environment()
     group_py_dir = os.path.dirname(os.path.abspath(group_py))
     try:
         with env.get_dir(group_py_dir):
-            generate_all(env)
+            generate_all(env, jobs, criterion)
     except GenerationError as e:
         print >> sys.stderr, '{}: error: {}'.format(e.context, e.message)
         sys.exit(1)
 
 
-def generate_all(env):
+# Name of the file, in each topology directory, where we record a digest of
+# the generation inputs together with the list of generated files.
+MANIFEST_FILE = 'expgen.manifest'
+
+
+def default_jobs():
+    '''
+    Return the default number of worker processes for generation.
+    '''
+    # On Windows, worker processes re-import the main module, which is the
+    # "group.py" script: stay sequential there.
+    if sys.platform == 'win32':
+        return 1
+    return multiprocessing.cpu_count()
+
+
+def generate_all(env, jobs=None, criterion=None):
     '''
-    Generate code for all topology directories in the current directory.
+    Generate code for all topology directories in the current directory. If
+    `criterion` is not None, generated testcases exercise a minimal set of
+    truth vectors achieving `criterion` MC/DC (see `plan_topology`).
+
+    Topologies whose inputs did not change since the last generation are
+    skipped. The work for the others is split into one task per (topology,
+    language, context) combination, processed by a pool of `jobs` worker
+    processes.
     '''
+    if jobs is None:
+        jobs = default_jobs()
+
+    gen_digest = generator.utils.generator_digest()
+
     # Each directory contains drivers for a given topology.
-    for topo_dir in os.listdir('.'):
+    tasks = []
+    manifests = {}
+    for topo_dir in sorted(os.listdir('.')):
         if not os.path.isdir(topo_dir) or topo_dir == 'src':
             continue
         with env.get_dir(topo_dir):
-            generate_topology(topo_dir, env)
+            topo_tasks = plan_topology(topo_dir, env, gen_digest, criterion)
+        if topo_tasks is not None:
+            inputs_digest, topo_tasks = topo_tasks
+            manifests[topo_dir] = (inputs_digest, [])
+            tasks.extend(topo_tasks)
+
+    if not tasks:
+        return
 
-def generate_topology(topo_dir, env):
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(processes=jobs)
+        try:
+            results = pool.map(generate_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [generate_task(task) for task in tasks]
+
+    # Report the first error we got, if any. Only record manifests when the
+    # whole generation succeeded.
+    for topo_dir, error, outputs in results:
+        if error is not None:
+            raise GenerationError(*error)
+        manifests[topo_dir][1].extend(outputs)
+
+    # Remove what the previous generation produced and this one did not:
+    # a consolidated driver left over from a previous generation with another
+    # criterion, for instance, would hide the hand-written drivers.
+    for topo_dir, (inputs_digest, outputs) in manifests.items():
+        manifest = os.path.join(topo_dir, MANIFEST_FILE)
+        for stale in (
+            set(generator.utils.manifest_outputs(manifest)) - set(outputs)
+        ):
+            if os.path.exists(os.path.join(topo_dir, stale)):
+                os.remove(os.path.join(topo_dir, stale))
+        generator.utils.write_manifest(
+            manifest, inputs_digest, sorted(outputs)
+        )
+
+
+def parse_topology_dir(topo_dir, env):
     '''
-    Generate code inside the `topo_dir` directory.
+    Parse all drivers in the "src" subdirectory of the current directory,
+    which must be the `topo_dir` topology directory. Return the topology they
+    use and the set of truth vectors they involve, or (None, None) if there
+    is no driver.
     '''
     topo = None
     truth_vectors = set()
@@ -68,7 +180,7 @@ def generate_topology(topo_dir, env):
     # Look at all drivers to collect the truth vectors involved. Extract the
     # topology used and check that each driver use the same one.
     with env.get_dir('src'):
-        for driver in os.listdir('.'):
+        for driver in sorted(os.listdir('.')):
             if not driver.startswith('test_') or not driver.endswith('.adb'):
                 continue
 
@@ -91,21 +203,105 @@ def generate_topology(topo_dir, env):
                 )
             topo = topology.Topology(drv_topo)
 
+    return (topo, truth_vectors if topo is not None else None)
+
+
+def plan_topology(topo_dir, env, gen_digest, criterion=None):
+    '''
+    Compute the list of generation tasks for the `topo_dir` topology directory,
+    which must be the current one. Return None if there is nothing to generate,
+    either because this is not a topology directory or because the previous
+    generation is up to date. Return an (inputs digest, tasks) tuple otherwise.
+
+    If `criterion` is not None, select a minimal set of truth vectors achieving
+    `criterion` MC/DC for the topology: the generated testcases then exercise
+    a consolidated driver calling only these vectors, in place of the
+    hand-written drivers.
+    '''
+    topo, truth_vectors = parse_topology_dir(topo_dir, env)
+
     # If we happen to get here for subdirectories that are not aimed at
     # hosting a topology, there is just nothing to generate.
     # ??? We might want to tighten our callers and make this an error.
     if topo is None:
-        return
+        return None
+
+    # Our outputs only depend on the drivers (which hold the topology and the
+    # truth vectors), on the vector selection criterion and on the generator
+    # itself.
+    inputs_digest = generator.utils.files_digest(
+        [os.path.join('src', driver)
+         for driver in sorted(os.listdir('src'))
+         if driver.startswith('test_') and driver.endswith('.adb')],
+        '{}\0{}'.format(gen_digest, criterion or '')
+    )
+    if generator.utils.manifest_up_to_date(MANIFEST_FILE, inputs_digest):
+        return None
+
+    selection = None
+    if criterion is not None:
+        selection = generator.selection.select_vectors(topo, criterion)
+        print '{}: {} vectors in drivers, {} needed for {} MC/DC{}'.format(
+            topo_dir, len(truth_vectors), len(selection.vectors), criterion,
+            '' if selection.optimal else ' (search incomplete)'
+        )
+
+    topo_path = os.getcwd()
+    tasks = []
+    for lang_index, lang in enumerate(generator.composition.languages):
+        for i, ctx, op_kinds in ctx_op_combinations(topo, lang):
+            tasks.append((
+                topo_dir, topo_path, lang_index, i,
+                generator.composition.contexts.index(ctx),
+                [generator.composition.operand_kinds.index(op_kind)
+                 for op_kind in op_kinds],
+                selection
+            ))
+    return (inputs_digest, tasks)
+
+
+def generate_task(task):
+    '''
+    Process one generation task, as computed by `plan_topology`. Return a
+    (topology directory, error, outputs) tuple, where error is None or the
+    (context, message) of a generation error, and outputs is the list of files
+    we generated, relative to the topology directory.
+
+    This may run in a worker process, so the task only holds picklable
+    references to the topology directory and to the composition elements,
+    together with the vector selection, if any.
+    '''
+    (topo_dir, topo_path, lang_index, i, ctx_index, op_kind_indexes,
+     selection) = task
+
+    lang = generator.composition.languages[lang_index]
+    ctx = generator.composition.contexts[ctx_index]
+    op_kinds = [
+        generator.composition.operand_kinds[j] for j in op_kind_indexes
+    ]
 
-    # Now we have the topology and the truth vectors, we can generate
-    # everything else.
-    for lang in generator.composition.languages:
+    env = generator.utils.Environment(topo_path)
+    try:
+        topo, truth_vectors = parse_topology_dir(topo_dir, env)
+        op_dir = os.path.join(lang.NAME, 'Op{}'.format(i))
         with env.get_dir(lang.NAME):
-            generate_language(env, topo, truth_vectors, lang)
+            with env.get_dir('Op{}'.format(i)):
+                outputs = generate_ctx_op(
+                    env, topo, truth_vectors, lang, ctx, op_kinds, selection
+                )
+    except GenerationError as e:
+        return (topo_dir, (e.context, e.message), [])
+    finally:
+        env.leave()
+
+    return (topo_dir, None, [os.path.join(op_dir, path) for path in outputs])
+
 
-def generate_language(env, topo, truth_vectors, lang):
+def ctx_op_combinations(topo, lang):
     '''
-    Generate code for a given topology inside for the given language.
+    Yield the (index, context, operand kinds) combinations to generate for
+    a given topology and language. Each operand kind and each context that can
+    be used with `lang` is part of at least one combination.
     '''
     # First get a list of operand kinds and contexts that can be used with
     # `lang`.
@@ -125,8 +321,7 @@ def generate_language(env, topo, truth_vectors, lang):
         ]
         first_unused_op_kind = i + topo.arity
 
-        with env.get_dir('Op{}'.format(i)):
-            generate_ctx_op(env, topo, truth_vectors, lang, ctx, op_kinds)
+        yield (i, ctx, op_kinds)
 
     # If some operand kinds were not used in the previous combination, use them
     # with the first context. This way, each operand kind and each context will
@@ -149,10 +344,22 @@ def generate_language(env, topo, truth_vectors, lang):
                 operand_kinds_to_test[(k + j) % len(operand_kinds_to_test)]
                 for j in range(topo.arity)
             ]
-            with env.get_dir('Op{}'.format(i)):
-                generate_ctx_op(env, topo, truth_vectors, lang, ctx, op_kinds)
+            yield (i, ctx, op_kinds)
+
+def generate_ctx_op(env, topo, truth_vectors, lang, ctx, op_kinds,
+                    selection=None):
+    '''
+    Generate the sources and the testcase for one combination of context and
+    operand kinds in the current directory. Return the list of generated
+    files, relative to the current directory.
+
+    If `selection` is not None, the testcase exercises a consolidated driver
+    for the selected vectors only, generated in its own "src" directory,
+    instead of the hand-written drivers of the topology.
+    '''
+    if selection is not None:
+        truth_vectors = set(selection.vectors)
 
-def generate_ctx_op(env, topo, truth_vectors, lang, ctx, op_kinds):
     formal_names = [
         'X{}'.format(i + 1)
         for i in range(topo.arity)
@@ -172,38 +379,45 @@ def generate_ctx_op(env, topo, truth_vectors, lang, ctx, op_kinds):
         ()
     ))
 
+    atomic_open = generator.utils.atomic_open
+    outputs = []
+
+    def output(*path):
+        outputs.append(os.path.join(*path))
+        return path[-1]
+
     with env.get_dir('src'):
         # First generate types needed by operands.
-        with open(
-            lang.get_specification_filename(lang.TYPES_MODULE), 'w'
-        ) as types_fp:
+        with atomic_open(output(
+            'src', lang.get_specification_filename(lang.TYPES_MODULE)
+        )) as types_fp:
             lang.serialize_specification_types(types_fp, used_types)
 
         # Then generate the ADA binding for the run module...
-        with open(
-            ada.get_specification_filename(ada.RUN_MODULE), 'w'
-        ) as run_fp:
+        with atomic_open(output(
+            'src', ada.get_specification_filename(ada.RUN_MODULE)
+        )) as run_fp:
             ada.serialize_run_module_interface(run_fp, lang, truth_vectors)
         # ... and the run module itself, in the decided language.
-        with open(
-            lang.get_implementation_filename(lang.RUN_MODULE), 'w'
-        ) as run_fp:
+        with atomic_open(output(
+            'src', lang.get_implementation_filename(lang.RUN_MODULE)
+        )) as run_fp:
             lang.serialize_run_module_implementation(
                 run_fp, op_kinds, truth_vectors
             )
 
         # And finally generate the specification and the implementation for the
         # computing module.
-        with open(
-            lang.get_specification_filename(lang.COMPUTING_MODULE), 'w'
-        ) as comp_fp:
+        with atomic_open(output(
+            'src', lang.get_specification_filename(lang.COMPUTING_MODULE)
+        )) as comp_fp:
             lang.serialize_specification_program(
                 comp_fp, program, formal_names, formal_types
             )
 
-        with open(
-            lang.get_implementation_filename(lang.COMPUTING_MODULE), 'w'
-        ) as comp_fp:
+        with atomic_open(output(
+            'src', lang.get_implementation_filename(lang.COMPUTING_MODULE)
+        )) as comp_fp:
 
             # Prepend the "computing" module implementation with some comments
             # documenting the operands usage and the target of the context.
@@ -237,12 +451,37 @@ def generate_ctx_op(env, topo, truth_vectors, lang, ctx, op_kinds):
                 one_operand_per_line
             )
 
+        # The testcase looks for drivers in its own "src" directory first,
+        # so the consolidated driver replaces the hand-written ones there.
+        if selection is not None:
+            name = generator.selection.driver_name(selection.criterion)
+            with atomic_open(output('src', name + '.adb')) as driver_fp:
+                generator.selection.serialize_driver(
+                    driver_fp, name, topo, selection
+                )
+
     # The "test.py" testcase file is hardcoded...
-    with open('test.py', 'w') as test_fp:
-        test_fp.write('''\
+    with atomic_open(output('test.py')) as test_fp:
+        if selection is None:
+            test_fp.write('''\
 from SCOV.tc import *
 from SCOV.tctl import CAT
 
 [TestCase(category=cat).run() for cat in CAT.critcats]
 thistest.result()
 ''')
+        else:
+            # Consolidation specs up-tree designate hand-written drivers,
+            # which the consolidated driver makes irrelevant.
+            test_fp.write('''\
+from SCOV.tc import *
+from SCOV.tctl import CAT
+
+for cat in CAT.critcats:
+    tc = TestCase(category=cat)
+    tc.all_cspecs = []
+    tc.run()
+thistest.result()
+''')
+
+    return outputs
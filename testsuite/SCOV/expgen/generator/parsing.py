@@ -36,20 +36,20 @@ def parse_topology(topo_dir, driver, line_no, tokens):
     def parse_or(i):
         check_eof(i)
         left, i = parse_and(i)
-        while i < len(tokens):
+        while i < len(tokens) and tokens[i] != ')':
             if tokens[i:i + 2] != ['or', 'else']:
                 raise error(
                     'expected "or else" but found {}'.format(tokens[i])
                 )
             i += 2
             right, i = parse_and(i)
-            left = ast.And(left, right)
+            left = ast.Or(left, right)
         return left, i
 
     def parse_and(i):
         check_eof(i)
         left, i = parse_not(i)
-        while i < len(tokens):
+        while i < len(tokens) and tokens[i] not in (')', 'or'):
             if tokens[i:i + 2] != ['and', 'then']:
                 raise error(
                     'expected "and then" but found {}'.format(tokens[i])
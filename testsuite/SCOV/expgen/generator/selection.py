@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+
+'''
+Selection of minimal sets of truth vectors achieving MC/DC for a topology.
+
+Hand-written drivers often list more truth vectors than MC/DC needs, and
+each of them is a run procedure to build and execute for every generated
+testcase. This module computes small vector sets that still demonstrate the
+independent influence of each operand, and writes consolidated drivers that
+exercise only these vectors.
+
+Vectors that follow the same short-circuit evaluation path are equivalent for
+MC/DC, so the selection works on evaluation paths (see
+`CompiledTopology.evaluation_paths`). As in MC_DC.Is_MC_DC_Pair, two paths
+with different outcomes show the independent influence of an operand if it is
+the only operand evaluated in both with different values (unique cause), or
+the last such operand (masking). For each operand and each path, the set of
+paths that form an independence pair with it is precomputed as a bitset, so
+that checking whether a set of paths covers an operand is a few bitwise
+operations.
+
+Choosing the smallest set of paths that covers all operands is a set cover
+problem over independence pairs: we first build a greedy solution, then try
+to improve it with a bounded branch-and-bound search, so that the result is
+minimal for usual topologies and near-minimal for the largest ones.
+'''
+
+import SCOV.expgen.ast                  as ast
+import SCOV.expgen.language             as language
+import SCOV.expgen.language.ada
+import SCOV.expgen.generator            as generator
+import SCOV.expgen.generator.composition
+import SCOV.expgen.topology             as topology
+
+from SCOV.expgen.language.ada import conv_name
+
+from SCOV.expgen.generator.errors import GenerationError
+
+
+# Used to name the run procedures the drivers call.
+ada = language.ada.Language()
+
+
+UNIQUE_CAUSE = 'unique-cause'
+MASKING = 'masking'
+
+# Maximum number of nodes the exact search explores before we settle for the
+# best solution found so far.
+SEARCH_BUDGET = 100000
+
+
+def bits(mask):
+    '''
+    Yield the indexes of the bits set in `mask`, in increasing order.
+    '''
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Selection(object):
+    '''
+    Result of a vector selection for a topology.
+
+    `vectors` is the list of selected truth vectors, in the format used for
+    driver truth vectors: a tuple of operand values followed by the expected
+    outcome. `pairs` gives, for each operand, the (first, second) couple of
+    indexes in `vectors` that shows its independent influence, or None if no
+    such couple exists. `optimal` tells whether the search completed, in which
+    case no smaller set of vectors achieves the same coverage.
+    '''
+
+    def __init__(self, criterion, vectors, pairs, optimal):
+        self.criterion = criterion
+        self.vectors = vectors
+        self.pairs = pairs
+        self.optimal = optimal
+
+    @property
+    def uncovered(self):
+        '''
+        Return the list of operand indexes the selection does not cover.
+        '''
+        return [i for i, pair in enumerate(self.pairs) if pair is None]
+
+
+class VectorSelector(object):
+    '''
+    Compute minimal sets of truth vectors achieving MC/DC for `topo`, a
+    topology.Topology instance, according to `criterion`.
+    '''
+
+    def __init__(self, topo, criterion=UNIQUE_CAUSE):
+        if criterion not in (UNIQUE_CAUSE, MASKING):
+            raise ValueError('Invalid MC/DC criterion: {}'.format(criterion))
+        self.criterion = criterion
+        self.arity = topo.arity
+        self.paths = topo.compile().evaluation_paths()
+
+        # partners[c][i] is the bitset of paths that form an independence
+        # pair for operand c with path i.
+        self.partners = [[0] * len(self.paths) for _ in range(self.arity)]
+        for i, (values_1, outcome_1, _) in enumerate(self.paths):
+            for j in range(i + 1, len(self.paths)):
+                values_2, outcome_2, _ = self.paths[j]
+                if outcome_1 == outcome_2:
+                    continue
+                differing = [
+                    c for c, (v1, v2) in enumerate(zip(values_1, values_2))
+                    if v1 is not None and v2 is not None and v1 != v2
+                ]
+                if criterion == UNIQUE_CAUSE and len(differing) != 1:
+                    continue
+                c = differing[-1]
+                self.partners[c][i] |= 1 << j
+                self.partners[c][j] |= 1 << i
+
+        # All the independence pairs for each operand, as bitsets of paths.
+        self.pairs = [
+            [(1 << i) | (1 << j)
+             for i, mask in enumerate(partners)
+             for j in bits(mask >> (i + 1) << (i + 1))]
+            for partners in self.partners
+        ]
+
+        # Operands for which no pair exists cannot be covered whatever the
+        # selection: leave them aside.
+        self.coverable = [c for c in range(self.arity) if self.pairs[c]]
+
+    def is_covered(self, c, selected):
+        '''
+        Return whether the `selected` bitset of paths covers operand `c`.
+        '''
+        partners = self.partners[c]
+        return any(partners[i] & selected for i in bits(selected))
+
+    def uncovered(self, selected):
+        '''
+        Return the list of coverable operands the `selected` bitset of paths
+        does not cover.
+        '''
+        return [
+            c for c in self.coverable if not self.is_covered(c, selected)
+        ]
+
+    def greedy(self):
+        '''
+        Return a bitset of paths covering all coverable operands, built by
+        repeatedly adding the independence pair that covers the most new
+        operands per added path.
+        '''
+        selected = 0
+        uncovered = self.uncovered(selected)
+        while uncovered:
+            best = None
+            for c in uncovered:
+                for pair in self.pairs[c]:
+                    cost = bin(pair & ~selected).count('1')
+                    candidate = selected | pair
+                    gain = sum(
+                        1 for d in uncovered
+                        if d == c or self.is_covered(d, candidate)
+                    )
+                    # Compare gain / cost ratios without divisions
+                    if best is None or gain * best[1] > best[0] * cost:
+                        best = (gain, cost, candidate)
+            selected = best[2]
+            uncovered = self.uncovered(selected)
+        return selected
+
+    def search(self, budget=SEARCH_BUDGET):
+        '''
+        Return a (bitset of paths, optimal) couple for a smallest set of paths
+        covering all coverable operands. Start from the greedy solution and
+        look for smaller ones with a branch-and-bound search that explores at
+        most `budget` nodes. `optimal` is False if the budget was exhausted.
+        '''
+        best = [self.greedy()]
+        best_size = [bin(best[0]).count('1')]
+        nodes = [0]
+
+        def explore(selected, size):
+            nodes[0] += 1
+            if nodes[0] > budget:
+                return False
+
+            uncovered = self.uncovered(selected)
+            if not uncovered:
+                best[0], best_size[0] = selected, size
+                return True
+
+            # Branch on the operand with the fewest ways to be covered, and
+            # try the cheapest pairs first.
+            choices = None
+            for c in uncovered:
+                candidates = sorted(
+                    (bin(pair & ~selected).count('1'), pair)
+                    for pair in self.pairs[c]
+                )
+                if choices is None or len(candidates) < len(choices):
+                    choices = candidates
+
+            # Covering the remaining operands takes at least as many paths as
+            # the cheapest way to cover the most constrained one.
+            if size + choices[0][0] >= best_size[0]:
+                return True
+
+            for cost, pair in choices:
+                if size + cost >= best_size[0]:
+                    break
+                if not explore(selected | pair, size + cost):
+                    return False
+            return True
+
+        complete = explore(0, 0)
+        return (best[0], complete)
+
+    def select(self, budget=SEARCH_BUDGET):
+        '''
+        Return a Selection for a smallest set of vectors achieving MC/DC.
+        '''
+        selected, optimal = self.search(budget)
+        paths = list(bits(selected))
+
+        # Operands that are not evaluated on a path can take any value: pick
+        # the first vector that follows this path, i.e. False for all of them.
+        vectors = []
+        for i in paths:
+            _, outcome, mask = self.paths[i]
+            index = next(bits(mask))
+            vectors.append(tuple(
+                bool(index >> c & 1) for c in range(self.arity)
+            ) + (outcome, ))
+
+        pairs = []
+        for c in range(self.arity):
+            pair = None
+            for k, i in enumerate(paths):
+                matches = self.partners[c][i] & selected
+                if matches:
+                    pair = (k, paths.index(next(bits(matches))))
+                    break
+            pairs.append(pair)
+
+        return Selection(self.criterion, vectors, pairs, optimal)
+
+
+def select_vectors(topo, criterion=UNIQUE_CAUSE, budget=SEARCH_BUDGET):
+    '''
+    Return a Selection for a smallest set of truth vectors achieving
+    `criterion` MC/DC for the `topo` topology.
+    '''
+    return VectorSelector(topo, criterion).select(budget)
+
+
+#
+# Consolidated drivers
+#
+
+def format_topology(topo):
+    '''
+    Return the image of `topo` as expected on the "Topology:" line of drivers
+    (see parsing.parse_topology).
+    '''
+
+    def helper(expr, parent_prec):
+        if isinstance(expr, topology.OperandPlaceholder):
+            return '_'
+        elif isinstance(expr, ast.Not):
+            return 'not {}'.format(helper(expr.expr, 3))
+        elif isinstance(expr, (ast.And, ast.Or)):
+            prec, op = (
+                (2, 'and then') if isinstance(expr, ast.And) else
+                (1, 'or else')
+            )
+            # Operators are left-associative: keep the tree structure by
+            # parenthesizing right operands that are chains of the same
+            # operator.
+            result = '{} {} {}'.format(
+                helper(expr.left, prec), op, helper(expr.right, prec + 0.5)
+            )
+            if prec < parent_prec:
+                result = '( {} )'.format(result)
+            return result
+        else:
+            raise ValueError('Invalid topology node: {}'.format(expr))
+
+    return helper(topo.expression, 0)
+
+
+def driver_name(criterion):
+    '''
+    Return the base name of the consolidated driver for `criterion`.
+    '''
+    return 'test_min_{}'.format(
+        {UNIQUE_CAUSE: 'ucmcdc', MASKING: 'masking'}[criterion]
+    )
+
+
+def serialize_driver(stream, name, topo, selection):
+    '''
+    Write to `stream` the `name` Ada test driver for `topo`, that calls the run
+    procedure of each vector in `selection`.
+
+    This raises a GenerationError if the selection does not cover all the
+    operands, as we could not state coverage expectations for the driver then.
+    '''
+    if selection.uncovered:
+        raise GenerationError(name,
+            'Cannot achieve {} MC/DC for operands {}'.format(
+                selection.criterion,
+                ', '.join(str(c + 1) for c in selection.uncovered)
+            )
+        )
+
+    unit = conv_name(name)
+
+    lines = [
+        '--  Minimal set of vectors achieving {} MC/DC{}'.format(
+            selection.criterion,
+            '' if selection.optimal else ' (search incomplete)'
+        ),
+        '',
+        'with {0}, {1}; use {0}, {1};'.format(
+            conv_name(ada.SUPPORT_MODULE), conv_name(ada.RUN_MODULE)
+        ),
+        '',
+        '-- Topology: {}'.format(format_topology(topo)),
+        'procedure {} is'.format(unit),
+        'begin',
+    ]
+    lines.extend(
+        '   {};'.format(conv_name(ada.get_run_procedure_name(vector)))
+        for vector in selection.vectors
+    )
+    lines.append('end {};'.format(unit))
+    lines.append('')
+
+    # All the operands are covered, hence all the decision lines
+    for lang in generator.composition.languages:
+        lines.append('--# {}'.format(
+            lang.get_implementation_filename(lang.COMPUTING_MODULE)
+        ))
+        lines.append('--  /eval/ l+ ## 0')
+
+    for line in lines:
+        stream.write(line)
+        stream.write('\n')
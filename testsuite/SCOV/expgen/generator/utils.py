@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
 import os
 import os.path
+import sys
 
 '''
 Various generation helpers
@@ -26,10 +29,15 @@ class Environment(object):
         def __exit__(self, type, value, traceback):
             self.env.pop_dir()
 
-    def __init__(self):
+    def __init__(self, root=None):
+        '''
+        Start from the current directory, or enter `root` if not None.
+        '''
         self.dir_stack = [
             os.getcwd()
         ]
+        if root is not None:
+            self.push_dir(root)
 
     def get_dir(self, subdir):
         '''
@@ -43,7 +51,13 @@ class Environment(object):
         '''
         new_dir = os.path.join(self.dir_stack[-1], subdir)
         if not os.path.exists(new_dir):
-            os.mkdir(new_dir)
+            # Concurrent generation tasks may race to create the same
+            # directory.
+            try:
+                os.mkdir(new_dir)
+            except OSError:
+                if not os.path.isdir(new_dir):
+                    raise
         os.chdir(new_dir)
         self.dir_stack.append(new_dir)
 
@@ -53,3 +67,112 @@ class Environment(object):
         '''
         self.dir_stack.pop()
         os.chdir(self.dir_stack[-1])
+
+    def leave(self):
+        '''
+        Go back to the directory we started from.
+        '''
+        del self.dir_stack[1:]
+        os.chdir(self.dir_stack[0])
+
+
+class atomic_open(object):
+    '''
+    Context manager to write a file atomically: the content is written to a
+    temporary file in the same directory, which replaces `filename` only when
+    the context is left without error.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.tmp_filename = '{}.tmp{}'.format(filename, os.getpid())
+
+    def __enter__(self):
+        self.fp = open(self.tmp_filename, 'w')
+        return self.fp
+
+    def __exit__(self, type, value, traceback):
+        self.fp.close()
+        if type is not None:
+            os.remove(self.tmp_filename)
+            return
+        # rename does not replace existing files on Windows
+        if sys.platform == 'win32' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(self.tmp_filename, self.filename)
+
+
+def files_digest(filenames, salt='', root='.'):
+    '''
+    Return a hexadecimal digest of the names and contents of the given files,
+    starting from `salt`. File names are relative to the `root` directory.
+    '''
+    digest = hashlib.sha1(salt)
+    for filename in filenames:
+        digest.update(filename)
+        digest.update('\0')
+        with open(os.path.join(root, filename), 'rb') as fp:
+            digest.update(fp.read())
+        digest.update('\0')
+    return digest.hexdigest()
+
+
+def generator_digest():
+    '''
+    Return a digest of the expgen package sources, so that changes to the
+    generator invalidate previously generated files.
+    '''
+    expgen_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(expgen_dir):
+        dirnames.sort()
+        sources.extend(
+            os.path.relpath(os.path.join(dirpath, filename), expgen_dir)
+            for filename in sorted(filenames)
+            if filename.endswith('.py')
+        )
+    return files_digest(sources, root=expgen_dir)
+
+
+def manifest_up_to_date(manifest, inputs_digest):
+    '''
+    Return whether the `manifest` file records `inputs_digest` as the digest
+    of the generation inputs and all the files it lists still exist.
+    '''
+    if not os.path.exists(manifest):
+        return False
+    try:
+        with open(manifest, 'r') as fp:
+            contents = json.load(fp)
+    except ValueError:
+        return False
+    return (
+        contents.get('inputs') == inputs_digest
+        and all(os.path.exists(output) for output in contents['outputs'])
+    )
+
+
+def manifest_outputs(manifest):
+    '''
+    Return the list of generated files the `manifest` file records, or an
+    empty list if there is no valid manifest.
+    '''
+    if not os.path.exists(manifest):
+        return []
+    try:
+        with open(manifest, 'r') as fp:
+            return json.load(fp)['outputs']
+    except (ValueError, KeyError):
+        return []
+
+
+def write_manifest(manifest, inputs_digest, outputs):
+    '''
+    Record `inputs_digest` as the digest of the generation inputs and the
+    `outputs` list of generated files in the `manifest` file.
+    '''
+    with atomic_open(manifest) as fp:
+        json.dump(
+            {'inputs': inputs_digest, 'outputs': outputs}, fp,
+            indent=2, separators=(',', ': ')
+        )
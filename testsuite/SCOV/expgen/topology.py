@@ -33,6 +33,7 @@ class Topology(object):
         '''
         self.expression = expression
         self.arity = self.get_arity(expression)
+        self._compiled = None
 
     def get_arity(self, expression):
         '''
@@ -98,45 +99,19 @@ class Topology(object):
         Evaluate the boolean expression using the given `operands`.
         '''
 
-        def helper(expression, i):
-            '''
-            Likewise, helper to process sub-expressions in a recursive fashion.
-            `i` is the first `operand` to use. Return the result of the given
-            `expression` evaluation and the index of the next operand to use.
-            '''
-
-            # If we find a placeholder, return the next operand.
-            if isinstance(expression, OperandPlaceholder):
-                return (operands[i], i + 1)
-
-            # Otherwise, evaluate sub-expressions and return the result.
-            if isinstance(expression, ast.And):
-                left, i = helper(expression.left, i)
-                right, i = helper(expression.right, i)
-                return (left and right, i)
-            elif isinstance(expression, ast.Or):
-                left, i = helper(expression.left, i)
-                right, i = helper(expression.right, i)
-                return (left or right, i)
-            elif isinstance(expression, ast.Not):
-                result, i = helper(expression.expr, i)
-                return (not result, i)
-            else:
-                raise ValueError(
-                    'Invalid topology node: {}'.format(expression)
-                )
-
         # The number of operands must naturally match the number of
         # placeholders in the expression pattern.
         assert len(operands) == self.arity
 
-        result, next_operand = helper(self.expression, 0)
-
-        # All operands must have be replaced.
-        assert next_operand == self.arity
-
-        return result
+        return self.compile().outcome(vector_index(operands))
 
+    def compile(self):
+        '''
+        Return the CompiledTopology for this topology, computed only once.
+        '''
+        if self._compiled is None:
+            self._compiled = CompiledTopology(self)
+        return self._compiled
 
     def __str__(self):
 
@@ -157,3 +132,152 @@ class Topology(object):
                 return 'not {}'.format(helper(expr.expr))
 
         return helper(self.expression)
+
+
+def vector_index(operands):
+    '''
+    Return the index of the `operands` truth vector in truth tables: operand
+    number `i` is True in the vector of index `v` iff bit `i` of `v` is set.
+    '''
+    return sum(1 << i for i, value in enumerate(operands) if value)
+
+
+class CompiledTopology(object):
+    '''
+    Bit-parallel evaluator for a topology.
+
+    The topology is turned into a straight-line program over integer masks,
+    with one bit per truth vector (see `vector_index`), so that a single
+    execution evaluates the decision for all the 2**arity vectors at once. The
+    program also computes, for each operand, the mask of vectors for which
+    short-circuit evaluation actually evaluates it.
+    '''
+
+    def __init__(self, topology):
+        self.arity = topology.arity
+        self.vector_count = 1 << self.arity
+        self.full_mask = (1 << self.vector_count) - 1
+
+        program = self._compile(topology.expression)
+
+        # Operand number `i` is False for 2**i vectors, then True for 2**i
+        # vectors, and so on.
+        self.operand_masks = []
+        for i in range(self.arity):
+            period = 1 << (i + 1)
+            block = ((1 << (1 << i)) - 1) << (1 << i)
+            repeat = self.full_mask // ((1 << period) - 1)
+            self.operand_masks.append(block * repeat)
+
+        self.outcome_mask, self.evaluated_masks = program(
+            self.full_mask, *self.operand_masks
+        )
+
+    def _compile(self, expression):
+        '''
+        Return a Python function that takes the mask of all vectors and the
+        operand masks, and returns the outcome mask together with the tuple of
+        evaluated masks for all operands.
+        '''
+        lines = []
+        evaluated = []
+
+        def new_mask(code):
+            name = 't{}'.format(len(lines))
+            lines.append('    {} = {}'.format(name, code))
+            return name
+
+        def helper(expression, reached, i):
+            '''
+            Emit code for `expression`, evaluated for the vectors in the
+            `reached` mask. `i` is the first operand to use. Return the name
+            of the outcome mask and the index of the next operand to use.
+            '''
+            if isinstance(expression, OperandPlaceholder):
+                evaluated.append(reached)
+                return ('x{}'.format(i), i + 1)
+
+            # Short-circuit operators evaluate their right operand only when
+            # the left one does not determine the result.
+            if isinstance(expression, ast.And):
+                left, i = helper(expression.left, reached, i)
+                right, i = helper(
+                    expression.right,
+                    new_mask('{} & {}'.format(reached, left)), i
+                )
+                return (new_mask('{} & {}'.format(left, right)), i)
+            elif isinstance(expression, ast.Or):
+                left, i = helper(expression.left, reached, i)
+                right, i = helper(
+                    expression.right,
+                    new_mask('{} & ~{}'.format(reached, left)), i
+                )
+                return (new_mask('{} | {}'.format(left, right)), i)
+            elif isinstance(expression, ast.Not):
+                result, i = helper(expression.expr, reached, i)
+                return (new_mask('full & ~{}'.format(result)), i)
+            else:
+                raise ValueError(
+                    'Invalid topology node: {}'.format(expression)
+                )
+
+        result, next_operand = helper(expression, 'full', 0)
+        assert next_operand == self.arity
+
+        source = 'def program(full{}):\n{}\n    return ({}, ({}))\n'.format(
+            ''.join(', x{}'.format(i) for i in range(self.arity)),
+            '\n'.join(lines),
+            result,
+            ''.join('{}, '.format(mask) for mask in evaluated)
+        )
+        namespace = {}
+        exec(compile(source, '<topology>', 'exec'), namespace)
+        return namespace['program']
+
+    def outcome(self, index):
+        '''
+        Return the outcome of the decision for the vector of the given index.
+        '''
+        return bool(self.outcome_mask >> index & 1)
+
+    def evaluated(self, index):
+        '''
+        Return the list of operand indexes that are evaluated for the vector
+        of the given index.
+        '''
+        return [
+            i for i, mask in enumerate(self.evaluated_masks)
+            if mask >> index & 1
+        ]
+
+    def truth_table(self):
+        '''
+        Yield an (operands, outcome) couple for each truth vector, in vector
+        index order.
+        '''
+        for index in range(self.vector_count):
+            yield (
+                tuple(bool(index >> i & 1) for i in range(self.arity)),
+                self.outcome(index)
+            )
+
+    def evaluation_paths(self):
+        '''
+        Return the list of distinct short-circuit evaluation paths, as
+        (operands, outcome, vectors mask) tuples. In `operands`, operands that
+        are not evaluated are None. `vectors mask` is the mask of all the
+        truth vectors that follow this path.
+        '''
+        paths = {}
+        for index in range(self.vector_count):
+            operands = tuple(
+                bool(index >> i & 1) if mask >> index & 1 else None
+                for i, mask in enumerate(self.evaluated_masks)
+            )
+            key = (operands, self.outcome(index))
+            paths[key] = paths.get(key, 0) | (1 << index)
+
+        return sorted(
+            (operands, outcome, mask)
+            for (operands, outcome), mask in paths.items()
+        )
@@ -23,6 +23,7 @@ __all__ = ["SCOV_helper"]
 
 from collections import defaultdict
 import os
+import threading
 
 from SCOV.tctl import CAT, CovControl
 
@@ -31,6 +32,8 @@ from SCOV.instr import xcov_instrument
 from SUITE.context import thistest
 from SUITE.control import language_info
 from SUITE.cutils import to_list, list_to_file, match, contents_of, no_ext
+from SUITE.cutils import FatalError, Wdir, logical_cwd, mkdir_remapped
+from SUITE.ckptreduce import CheckpointReducer, CheckpointReductionError
 from SUITE.gprutils import GPRswitches
 from SUITE.tutils import gprbuild, gprfor, cmdrun, xrun, xcov, frame
 from SUITE.tutils import gprbuild_cargs_with
@@ -139,6 +142,11 @@ class WdirControl:
 # == SCOV_helper and internal helpers ==
 # ======================================
 
+# Name of the checkpoint saved by the coverage analysis of a test, from which
+# we produce the report formats beyond the first one.
+
+ANALYSIS_CKPT = "test.ckpt"
+
 # Relevant expectations and emitted Line and Report notes for each test
 # CATEGORY:
 # ---------------------------------------------------------------------
@@ -445,7 +453,7 @@ class SCOV_helper:
         # original expectations file, and base prefix of Working Directory
         # names
 
-        self.homedir = os.getcwd()+"/"
+        self.homedir = logical_cwd()+"/"
         self.xfile   = xfile
 
         # The WdirControl object telling about the Working and Binary
@@ -711,10 +719,13 @@ class SCOV_helper:
     # -------------------------
     # -- gen_one_xcov_report --
     # -------------------------
-    def gen_one_xcov_report(self, inputs, format, options=""):
-        """Helper for gen_xcov_reports, to produce one specific report for a
-        particulat FORMAT, from provided INPUTS. The command output is saved
-        in a file named FORMAT.out."""
+    def run_one_xcov_report(self, inputs, format, options="",
+                            register_failure=True):
+        """Helper for gen_xcov_reports, to run gnatcov coverage for a
+        particular FORMAT, from provided INPUTS. FORMAT may be None to perform
+        the coverage analysis only, typically to save a checkpoint. The
+        command output is saved in a file named FORMAT.out, or analysis.out
+        for a None FORMAT. Return the process descriptor."""
 
         # Compute the set of arguments we are to pass to gnatcov coverage.
 
@@ -725,9 +736,9 @@ class SCOV_helper:
         # options which might be absent from the tool qualified interface
         # descriptions.
 
-        covargs = [
-            '--annotate='+format, inputs
-            ] + (self.covoptions + to_list(options))
+        covargs = (
+            (['--annotate='+format] if format else []) + [inputs]
+            + self.covoptions + to_list(options))
 
         if self.gprmode:
             covargs.append ('--output-dir=.')
@@ -735,8 +746,15 @@ class SCOV_helper:
         # Run, latching standard output in a file so we can check contents on
         # return.
 
-        ofile = format+".out"
-        p = xcov (args = ['coverage'] + covargs, out = ofile)
+        ofile = (format if format else "analysis")+".out"
+        p = xcov (args = ['coverage'] + covargs, out = ofile,
+                  register_failure = register_failure)
+        p.output_file = ofile
+        return p
+
+    def check_one_xcov_report(self, p):
+        """Helper for gen_xcov_reports, to check the outcome of a gnatcov
+        coverage execution, as returned by run_one_xcov_report."""
 
         # Standard output might typically contain labeling warnings issued
         # by the static analysis phase, or error messages issued when a trace
@@ -745,12 +763,48 @@ class SCOV_helper:
         # Note that we do this in qualification mode as well, even though what
         # we're looking at is not stricly part of the qualified interface.
 
+        ofile = p.output_file
+
         thistest.fail_if (
             os.path.getsize (ofile) > 0,
             "xcov standard output not empty (%s):\n--\n%s"  % (
                 ofile, contents_of (ofile))
             )
 
+    def gen_one_xcov_report(self, inputs, format, options=""):
+        """Helper for gen_xcov_reports, to produce one specific report for a
+        particulat FORMAT, from provided INPUTS. The command output is saved
+        in a file named FORMAT.out."""
+
+        self.check_one_xcov_report (
+            self.run_one_xcov_report (inputs, format, options))
+
+    def gen_xcov_reports_concurrently(self, inputs, formats):
+        """Helper for gen_xcov_reports, to produce reports for each of the
+        (FORMAT, OPTIONS) pairs in FORMATS, from provided INPUTS, with
+        concurrent gnatcov executions."""
+
+        # Check the outcome of each execution once they all completed, so
+        # that only the main thread registers failures.
+
+        procs = [None] * len(formats)
+
+        def run(i, format, options):
+            procs[i] = self.run_one_xcov_report (
+                inputs, format, options, register_failure=False)
+
+        threads = [threading.Thread (target=run, args=(i, format, options))
+                   for i, (format, options) in enumerate (formats)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        for p in procs:
+            thistest.stop_if (
+                p is None or p.status != 0,
+                FatalError ("gnatcov coverage exit in error", outfile=(
+                    p.output_file if p is not None else None)))
+            self.check_one_xcov_report (p)
+
     # ----------------------
     # -- gen_xcov_reports --
     # ----------------------
@@ -792,11 +846,18 @@ class SCOV_helper:
             ("--checkpoint=", ckptname_for) if use_checkpoint_inputs \
             else ("", self.mode_tracename_for)
 
+        input_files = [self.awdir_for(pgm) + input_fn(pgm)
+                       for pgm in self.programs()]
+
+        # Large sets of checkpoints may be reduced beforehand, so that we
+        # only provide the roots of the reduction tree for the report.
+
+        reducer = None
+        if use_checkpoint_inputs and thistest.options.ckpt_fanin:
+            (reducer, input_files) = self.reduce_checkpoints(input_files)
+
         inputs = "%s@%s" % (
-            input_opt, list_to_file(
-                [self.awdir_for(pgm) + input_fn(pgm)
-                 for pgm in self.programs()],
-                "inputs.list"))
+            input_opt, list_to_file(input_files, "inputs.list"))
 
         # Determine what command line options we'll pass to designate units of
         # interest and maybe produce a coverage checkpoint. We don't need and
@@ -809,23 +870,95 @@ class SCOV_helper:
             ["--save-checkpoint=%s" % ckptname_for(single_driver)]
             if single_driver and checkpoints else [])
 
-        # Now produce the --annotate=report format:
-
-        self.gen_one_xcov_report(
-            inputs, format="report",
-            options=sco_options + save_checkpoint_options + ['-o', 'test.rep'])
-
-        # Then an alternate .xcov output format, unless we are performing a
-        # qualification run, for which that format isn't appropriate. No need
-        # to regenerate a coverage checkpoint there - it would convey the same
-        # as what the --annotate=report already produced if a checkpoint is
-        # needed.
+        # If we are performing a qualification run, only produce the
+        # --annotate=report format, straight from the traces. The alternate
+        # .xcov output format isn't appropriate there.
 
         if thistest.options.qualif_level:
+            self.gen_one_xcov_report(
+                inputs, format="report",
+                options=(sco_options + save_checkpoint_options
+                         + ['-o', 'test.rep']))
+            self.cleanup_reduction(reducer)
             return
 
-        self.gen_one_xcov_report(
-            inputs, format="xcov", options=sco_options)
+        # Otherwise, we need both the --annotate=report and the xcov formats.
+        # Perform the trace/SCO analysis only once, saving a checkpoint from
+        # which we produce the other format. Reuse the checkpoint we might
+        # need to produce for consolidation purposes, as it conveys the same
+        # information.
+
+        ckpt = (ckptname_for(single_driver) if save_checkpoint_options
+                else ANALYSIS_CKPT)
+        ckpt_inputs = "--checkpoint=%s" % ckpt
+
+        if self.concurrent_reports():
+            # Analysis first, then the two formats at the same time
+
+            self.gen_one_xcov_report(
+                inputs, format=None,
+                options=sco_options + ['--save-checkpoint=%s' % ckpt])
+
+            self.gen_xcov_reports_concurrently(
+                ckpt_inputs, formats=[("report", ['-o', 'test.rep']),
+                                      ("xcov", [])])
+        else:
+            self.gen_one_xcov_report(
+                inputs, format="report",
+                options=(sco_options + ['--save-checkpoint=%s' % ckpt]
+                         + ['-o', 'test.rep']))
+
+            self.gen_one_xcov_report(ckpt_inputs, format="xcov")
+
+        self.cleanup_reduction(reducer)
+
+    def reduce_checkpoints(self, ckpts):
+        """Perform a hierarchical reduction of the list of CKPTS, down to the
+        configured fanin. Return the reducer, to clean up the intermediate
+        files once the reports are produced, and the list of resulting
+        checkpoints."""
+
+        def merge(inputs_list, ckpt, log):
+            p = xcov (
+                args = ['coverage'] + self.covoptions + [
+                    '--checkpoint=@%s' % inputs_list,
+                    '--save-checkpoint=%s' % ckpt],
+                out = log, register_failure = False)
+            return p.status == 0
+
+        jobs = (thistest.options.ckpt_jobs
+                if self.concurrent_gnatcov_ok() else 1)
+
+        reducer = CheckpointReducer (
+            merge=merge, fanin=thistest.options.ckpt_fanin, jobs=jobs,
+            workdir=thistest.options.ckpt_workdir)
+        try:
+            return (reducer, reducer.reduce (ckpts))
+        except CheckpointReductionError as e:
+            thistest.stop (FatalError (str (e), outfile=e.log))
+
+    def cleanup_reduction(self, reducer):
+        """Remove the intermediate files of a checkpoint reduction performed
+        with REDUCER, if any."""
+
+        if reducer is not None:
+            reducer.cleanup()
+
+    def concurrent_gnatcov_ok(self):
+        """Whether we may run several gnatcov commands concurrently."""
+
+        # Valgrind logs and bootstrap traces are named after counters which
+        # assume sequential gnatcov executions.
+
+        return (not thistest.options.enable_valgrind
+                and thistest.options.trace_dir is None)
+
+    def concurrent_reports(self):
+        """Whether the various report formats should be produced by
+        concurrent gnatcov executions."""
+
+        return (thistest.options.concurrent_reports
+                and self.concurrent_gnatcov_ok())
 
     # ------------------------------
     # -- check_unexpected_reports --
@@ -1014,7 +1147,7 @@ class SCOV_helper:
     # ---------
     def log(self):
         frame ("%s/ %s, %s\n%s coverage with %s"
-               % (os.path.relpath (os.getcwd(), thistest.homedir),
+               % (os.path.relpath (logical_cwd(), thistest.homedir),
                   str([no_ext(main) for main in self.drivers]),
                   self.xfile,
                   self.testcase.category.name if self.testcase.category
@@ -1030,10 +1163,13 @@ class SCOV_helper:
         expected to be either absolute or relative from the homedir."""
 
         self.to_homedir()
-        mkdir(wdir)
+        if Wdir.remap_root:
+            mkdir_remapped(wdir, Wdir.remap_root, Wdir.remap_top)
+        else:
+            mkdir(wdir)
         cd(wdir)
 
-        thistest.log("Work directory: %s" % os.getcwd())
+        thistest.log("Work directory: %s" % logical_cwd())
 
     # ----------------
     # -- to_homedir --
@@ -13,6 +13,7 @@ import os
 import re
 import optparse
 import collections
+import multiprocessing
 from gnatpython.fileutils import find
 
 # The testsuite dir corresponding to this local "qualification" dir. This is
@@ -25,12 +26,13 @@ LOCAL_TESTSUITE_DIR = \
     os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(LOCAL_TESTSUITE_DIR)
 
-from SUITE.qdata import qdaf_in, stdf_in
+from SUITE.qdata import qdaf_in, stdf_in, qload_from
 from SUITE.qdata import QUALDATA_FILE, QLANGUAGES, QROOTDIR
-from SUITE.qdata import CTXDATA_FILE
+from SUITE.qdata import CTXDATA_FILE, QSTRBOX_DIR, STREXT
 from SUITE.control import BUILDER
 
 from SUITE import dutils
+from SUITE.resultsdb import ResultsDB, results_db_in
 
 from SCOV.internals.cnotes import (
     r0, r0c, xBlock0, sNoCov, sPartCov,
@@ -79,21 +81,138 @@ def exit_if(p, msg):
 #    ...
 # }
 
+# All we need from this for the report is, for each testcase, its identifier,
+# execution status and the number of expected/satisfied notes of each kind.
+# We digest every testcase into a TCsummary holding just that, and keep the
+# digests in a persistent cache at the location where the testsuite was run,
+# so that regenerating a report after a partial rerun of the testsuite only
+# needs to reload the dumps which changed in between.
+
+STRCACHE_FILE = os.path.join(QSTRBOX_DIR, "strcache" + STREXT)
+# Name of a file, relative to the testsuite toplevel directory, where the
+# testcase digests computed for the STR production are cached.
+
+STRCACHE_VERSION = 1
+# Version of the cache contents layout. Cached data with a different version
+# is discarded.
+
+OUTPUT_DIR = "output"
+# Name of the testsuite output directory, where the testsuite driver records
+# the results of the tests it runs in a database. We query it to locate the
+# testcases which ran instead of looking for dumps throughout the tree.
+
+
+class TCsummary(object):
+
+    def __init__(self, tcid, status, comment, counts):
+        self.tcid = tcid
+        self.status = status
+        self.comment = comment
+
+        # { note kind -> (#expected, #satisfied) }, for the note kinds
+        # of which the testcase has at least one expectation
+        self.counts = counts
+
+    def data(self):
+        """A representation of this summary with core python types only,
+        suitable for storage in the cache."""
+        return (self.tcid, self.status, self.comment, self.counts)
+
+
+def dump_stamp(dirname):
+    """A stamp of the dumps for the testcase in DIRNAME, to be compared
+    against a cached one to decide whether the cached digest is still
+    valid."""
+
+    def stamp_of(filename):
+        st = os.stat(filename)
+        return (st.st_size, st.st_mtime)
+
+    return (stamp_of(qdaf_in(dirname)), stamp_of(stdf_in(dirname)))
+
+
+def counts_from(qda):
+    """Compute the { note kind -> (#expected, #satisfied) } dictionary of
+    expectation counters for the QDA qualification data."""
+
+    counts = {}
+    for qde in qda.entries:
+        for src in qde.xrnotes:
+            for notelist in qde.xrnotes[src].itervalues():
+                for note in notelist:
+                    (expected, satisfied) = counts.get(note.kind, (0, 0))
+                    counts[note.kind] = (
+                        expected + 1,
+                        satisfied + 1 if note.satisfied() else satisfied)
+    return counts
+
+
+def load_summary(dirname):
+    """Load dump data associated with one testcase and return a
+    (DIRNAME, stamp, summary data) tuple for it. Module level function
+    so we can use it in worker processes."""
+
+    stamp = dump_stamp(dirname)
+
+    qda = qload_from(qdaf_in(dirname))
+    std = qload_from(stdf_in(dirname))
+
+    return (dirname, stamp,
+            TCsummary(tcid=qda.tcid, status=std.status, comment=std.comment,
+                      counts=counts_from(qda)).data())
+
 
 class QualificationDataRepository(object):
 
-    def __init__(self, testsuite_dir):
+    def __init__(self, testsuite_dir, use_cache=True, jobs=1):
         """Initialize a Qualification Data repository.
 
         :param testsuite_dir: root directory of the testsuite
         :type testsuite_dir: str
+        :param use_cache: whether we should reuse the testcase digests
+            cached by a previous report generation for the same testsuite dir
+        :type use_cache: bool
+        :param jobs: number of worker processes to use for dump loading
+        :type jobs: int
         """
         # The full qualification data for this report; sequence of testcase
-        # Qdata instances:
+        # TCsummary instances:
         self.qdl = []
 
+        self.jobs = jobs
+
+        self.cache_file = os.path.join(testsuite_dir, STRCACHE_FILE)
+        self.cache = self.load_cache() if use_cache else {}
+
         self.load_all(root=testsuite_dir)
 
+        self.save_cache()
+
+    def load_cache(self):
+        """Fetch the { dirname -> (stamp, summary data) } digests cached by
+        a previous run, if any."""
+
+        if not os.path.exists(self.cache_file):
+            return {}
+
+        try:
+            cached = dutils.pload_from(self.cache_file)
+        except Exception:
+            print "!! unable to load cache from %s, ignoring" % (
+                self.cache_file)
+            return {}
+
+        if cached.get('version') != STRCACHE_VERSION:
+            return {}
+
+        return cached['entries']
+
+    def save_cache(self):
+        if os.path.isdir(os.path.dirname(self.cache_file)):
+            dutils.pdump_to(
+                self.cache_file,
+                o={'version': STRCACHE_VERSION, 'entries': self.cache})
+
     def load_all(self, root):
         """Load all data generate by a testsuite run.
 
@@ -103,9 +222,70 @@ class QualificationDataRepository(object):
         print "== Registering test execution dumps from %s ..." % root
 
         # all directories containing a tc.dump file are containing
-        # test results/dumps
-        for p in find(root, QUALDATA_FILE, follow_symlinks=True):
-            self.load_test(os.path.dirname(p))
+        # test results/dumps. Pick the cached digest for those which haven't
+        # changed since it was computed and reload the other ones.
+
+        dirnames = self.tc_dirnames(root)
+
+        entries = {}
+        stale = []
+
+        for dirname in dirnames:
+            cached = self.cache.get(dirname)
+            if cached is not None and cached[0] == dump_stamp(dirname):
+                entries[dirname] = cached
+            else:
+                stale.append(dirname)
+
+        print "== %d testcase digests from cache, %d to (re)load" % (
+            len(entries), len(stale))
+
+        for (dirname, stamp, data) in self.load_tests(stale):
+            entries[dirname] = (stamp, data)
+
+        # Replace the cache contents altogether, which gets rid of the
+        # entries for testcases that are gone
+
+        self.cache = entries
+
+        self.qdl = [TCsummary(*entries[dirname][1]) for dirname in dirnames]
+
+    def tc_dirnames(self, root):
+        """Return the list of testcase directories with execution dumps
+        under ROOT. Query the results database of the testsuite run when
+        there is one, and look for dumps throughout the tree otherwise."""
+
+        db_file = results_db_in(os.path.join(root, OUTPUT_DIR))
+
+        if not os.path.exists(db_file):
+            return [os.path.dirname(p)
+                    for p in find(root, QUALDATA_FILE, follow_symlinks=True)]
+
+        db = ResultsDB(db_file)
+        try:
+            dirnames = [os.path.normpath(os.path.join(root, row['dir']))
+                        for row in db.latest_results()]
+        finally:
+            db.close()
+
+        return [dirname for dirname in dirnames
+                if os.path.exists(qdaf_in(dirname))]
+
+    def load_tests(self, dirnames):
+        """Load dump data associated with each testcase in DIRNAMES and
+        return the list of corresponding load_summary results. Resort to
+        a pool of worker processes when we have a significant amount of
+        work to do, typically with a cold cache."""
+
+        if self.jobs > 1 and len(dirnames) > self.jobs:
+            pool = multiprocessing.Pool(processes=self.jobs)
+            try:
+                return pool.map(load_summary, dirnames, chunksize=16)
+            finally:
+                pool.close()
+                pool.join()
+
+        return [self.load_test(dirname) for dirname in dirnames]
 
     def load_test(self, dirname):
         """Load dump data associated with one testcase.
@@ -115,13 +295,7 @@ class QualificationDataRepository(object):
         """
         print "loading from %s" % dirname
 
-        qda = dutils.pload_from(qdaf_in(dirname))
-        std = dutils.pload_from(stdf_in(dirname))
-
-        qda.status = std.status
-        qda.comment = std.comment
-
-        self.qdl.append(qda)
+        return load_summary(dirname)
 
 # =======================================
 # == Qualification report and helpers  ==
@@ -624,7 +798,9 @@ class QDreport(object):
 
         # Fetch the test results:
 
-        qdreg = QualificationDataRepository(testsuite_dir=self.o.testsuite_dir)
+        qdreg = QualificationDataRepository(
+            testsuite_dir=self.o.testsuite_dir,
+            use_cache=self.o.use_cache, jobs=self.o.jobs)
         self.qdl = sorted(qdreg.qdl, key=lambda qd: qd.tcid)
 
         self.rstf = None
@@ -716,15 +892,15 @@ class QDreport(object):
     def tccolumns(self):
         return (colid.tc,) + self.viocnt_columns + (colid.sta,)
 
-    def count(self, note, cell):
-        cell.expected += 1
-        if note.satisfied():
-            cell.satisfied += 1
+    def count(self, counts, cell):
+        (expected, satisfied) = counts
+        cell.expected += expected
+        cell.satisfied += satisfied
 
     def tcdata_for(self, qd):
 
-        # Process one qualification data item, producing a report data line
-        # for one testcase
+        # Process one testcase summary, producing a report data line for
+        # one testcase
 
         this_tcdata = dict(
             [(colid.tc, TcidCell(qd.tcid))] +
@@ -732,10 +908,9 @@ class QDreport(object):
             [(colid.sta, QstatusCell(qd.status))]
             )
 
-        [self.count(note=note, cell=this_tcdata[column_for[note.kind]])
-         for qde in qd.entries for src in qde.xrnotes
-         for notelist in qde.xrnotes[src].itervalues()
-         for note in notelist]
+        [self.count(counts=qd.counts[kind],
+                    cell=this_tcdata[column_for[kind]])
+         for kind in qd.counts]
 
         return this_tcdata
 
@@ -1177,6 +1352,17 @@ if __name__ == "__main__":
         help="Name of a directory where the testsuite was run. "
         "Defaults to \"%s\"." % default_testsuite_dir)
 
+    op.add_option(
+        "--no-cache", dest="use_cache", default=True, action="store_false",
+        help="Reload all the testcase dumps, regardless of the digests "
+        "cached by a previous run for the same testsuite dir.")
+
+    default_jobs = multiprocessing.cpu_count()
+    op.add_option(
+        "--jobs", dest="jobs", default=default_jobs, type='int',
+        help="Number of worker processes to use for dump loading. "
+        "Defaults to %d." % default_jobs)
+
     (options, args) = op.parse_args()
 
     QDreport(options=options)
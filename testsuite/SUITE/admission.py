@@ -0,0 +1,277 @@
+"""Adaptive admission control for the testsuite main loop.
+
+The toplevel driver runs testcases through a gnatpython MainLoop with a fixed
+number of job slots. Testcases vary widely in CPU and memory use, so a fixed
+count either oversubscribes the host or underuses it. This module provides an
+admission controller which the driver queries before starting each testcase,
+and which only lets a testcase start while the projected host load and memory
+use stay under configurable ceilings.
+
+Projections rely on the peak RSS of each testcase process tree, sampled while
+the testcases run and recorded across runs in a history file. Resource usage
+information is fetched from /proc, and admission is only controlled by the
+number of job slots on hosts where this is not available.
+"""
+
+import json
+import os
+import threading
+import time
+
+# Name of the default history file, in the testsuite output dir
+
+RSS_HISTORY_FILE = "peak_rss.json"
+
+# Name of the file, in the testsuite output dir, where admission decisions
+# are logged
+
+ADMISSION_LOG_FILE = "admission.log"
+
+
+# =========================
+# == Host resource usage ==
+# =========================
+
+def proc_available():
+    """Whether we can fetch resource usage information from /proc."""
+    return os.path.exists("/proc/meminfo")
+
+
+def meminfo():
+    """Return a (total, available) pair of memory sizes in kB for the
+    host."""
+
+    values = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            (key, value) = line.split(':', 1)
+            values[key] = int(value.split()[0])
+
+    # MemAvailable is missing from older kernels, approximate then
+
+    available = values.get(
+        'MemAvailable',
+        values['MemFree'] + values.get('Buffers', 0) + values.get('Cached', 0))
+
+    return (values['MemTotal'], available)
+
+
+def processes():
+    """Return a dictionary of (ppid, state, rss in kB) triplets for all the
+    processes on the host, indexed by pid."""
+
+    page_kb = os.sysconf('SC_PAGE_SIZE') / 1024
+    result = {}
+
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % entry) as f:
+                stat = f.read()
+        except IOError:
+            # Process gone in the meantime
+            continue
+
+        # The command name is parenthesized and might contain spaces, so
+        # split what follows it.
+
+        fields = stat[stat.rindex(')') + 2:].split()
+        result[int(entry)] = (
+            int(fields[1]), fields[0], int(fields[21]) * page_kb)
+
+    return result
+
+
+def tree_rss(pid, procs):
+    """Return the sum of the RSS of the process tree rooted at PID, out of
+    the PROCS dictionary as returned by processes(), or None if PID has
+    terminated."""
+
+    if pid not in procs or procs[pid][1] == 'Z':
+        return None
+
+    children = {}
+    for (child, (ppid, _, _)) in procs.items():
+        children.setdefault(ppid, []).append(child)
+
+    rss = 0
+    todo = [pid]
+    while todo:
+        p = todo.pop()
+        rss += procs[p][2]
+        todo.extend(children.get(p, []))
+    return rss
+
+
+# =======================
+# == Admission control ==
+# =======================
+
+class AdmissionControl:
+    """Admission controller for testcases, identified by name.
+
+    Let testcases start while the host load average, or the number of running
+    testcases if higher, stays below MAX_LOAD, and while the projected memory
+    use stays below the MEM_CEILING fraction of the host memory. The peak RSS
+    of testcases is recorded in HISTORY_FILE, and admission decisions are
+    logged to LOG_FILE. Resource usage is sampled every POLL_INTERVAL
+    seconds."""
+
+    def __init__(self, max_load, mem_ceiling, history_file, log_file,
+                 poll_interval=1.0):
+        self.max_load = max_load
+        self.mem_ceiling = mem_ceiling
+        self.history_file = history_file
+        self.poll_interval = poll_interval
+
+        self.enabled = proc_available()
+
+        self.history = {}
+        if os.path.exists(history_file):
+            with open(history_file) as f:
+                self.history = json.load(f)
+
+        self.log_fd = open(log_file, 'w')
+
+        # Running testcases: root pid and peak RSS observed so far, indexed
+        # by name. The sampling thread updates the peaks.
+
+        self.running = {}
+        self.lock = threading.Lock()
+
+        self.stopped = threading.Event()
+        if self.enabled:
+            self.sampler = threading.Thread(target=self.__sample_loop)
+            self.sampler.daemon = True
+            self.sampler.start()
+
+    def __log(self, text):
+        self.log_fd.write("%.1f %s\n" % (time.time(), text))
+        self.log_fd.flush()
+
+    # -- Sampling --
+
+    def __sample(self):
+        """Update the peak RSS of the running testcases. Return the list
+        of (name, current rss) pairs for those still running."""
+
+        procs = processes()
+        alive = []
+
+        with self.lock:
+            for (name, entry) in self.running.items():
+                rss = tree_rss(entry['pid'], procs)
+                if rss is not None:
+                    entry['peak'] = max(entry['peak'], rss)
+                    alive.append((name, rss))
+        return alive
+
+    def __sample_loop(self):
+        while not self.stopped.wait(self.poll_interval):
+            self.__sample()
+
+    # -- Projections --
+
+    def expected_peak(self, name):
+        """Expected peak RSS of testcase NAME, in kB, from the history. For
+        testcases we don't know about, use the average of known peaks."""
+
+        if name in self.history:
+            return self.history[name]
+        elif self.history:
+            return sum(self.history.values()) / len(self.history)
+        else:
+            return 0
+
+    def __decide(self, name):
+        """Return a (verdict, reason) pair for the admission of testcase
+        NAME at this point."""
+
+        alive = self.__sample()
+
+        # Always admit when nothing else runs, to ensure progress
+
+        if not alive:
+            return (True, "idle host")
+
+        load = max(os.getloadavg()[0], len(alive)) + 1
+        if load > self.max_load:
+            return (False, "projected load %.1f > %.1f" % (
+                load, self.max_load))
+
+        # Projected memory needs: what the running testcases might still
+        # need to reach their expected peaks, plus the candidate's peak.
+
+        with self.lock:
+            pending = sum(
+                max(0, max(self.expected_peak(n), self.running[n]['peak'])
+                    - rss)
+                for (n, rss) in alive)
+
+        need = pending + self.expected_peak(name)
+        (total, available) = meminfo()
+        margin = available - (1.0 - self.mem_ceiling) * total
+
+        if need > margin:
+            return (False, "projected memory need %d kB > %d kB" % (
+                need, margin))
+
+        return (True, "projected load %.1f, memory need %d kB of %d kB" % (
+            load, need, margin))
+
+    # -- Driver interface --
+
+    def admit(self, name):
+        """Wait until testcase NAME may start."""
+
+        if not self.enabled:
+            return
+
+        start = time.time()
+        denied_for = None
+
+        while True:
+            (verdict, reason) = self.__decide(name)
+
+            # Log denials once per distinct reason, to keep the log
+            # readable.
+
+            if verdict:
+                self.__log("admit %s after %.1fs: %s" % (
+                    name, time.time() - start, reason))
+                return
+            elif reason.split(' >')[0] != denied_for:
+                denied_for = reason.split(' >')[0]
+                self.__log("defer %s: %s" % (name, reason))
+
+            time.sleep(self.poll_interval)
+
+    def started(self, name, pid):
+        """Register the start of testcase NAME, with PID as the root of its
+        process tree."""
+
+        if self.enabled:
+            with self.lock:
+                self.running[name] = {'pid': pid, 'peak': 0}
+
+    def finished(self, name):
+        """Register the termination of testcase NAME, recording its peak
+        RSS in the history."""
+
+        with self.lock:
+            entry = self.running.pop(name, None)
+
+        if entry and entry['peak'] > 0:
+            self.history[name] = entry['peak']
+            self.__log("peak %s: %d kB" % (name, entry['peak']))
+
+    def close(self):
+        """Stop sampling and save the history."""
+
+        self.stopped.set()
+        self.log_fd.close()
+
+        with open(self.history_file, 'w') as f:
+            json.dump(self.history, f, indent=1, sort_keys=True,
+                      separators=(',', ': '))
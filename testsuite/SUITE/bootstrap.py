@@ -0,0 +1,278 @@
+"""Incremental bootstrap coverage of gnatcov by its own testsuite.
+
+With --bootstrap-scos, the testsuite runs every "gnatcov coverage" command
+under "gnatcov run", which drops a trace per command in a directory dedicated
+to each testcase. This module turns the traces of each testcase into a
+coverage checkpoint as soon as the testcase completes, with background gnatcov
+runs, and merges these checkpoints as they come, by groups of FANIN, into a
+tree of intermediate checkpoints. The final report then only has to
+consolidate the few checkpoints at the top of the tree, after a last
+hierarchical reduction (see ckptreduce.py).
+
+The set of checkpoints covering all the testcases processed so far is listed
+in a file of the traces directory, updated as checkpoints are produced, which
+allows producing partial reports while the testsuite is still running, for
+example with:
+
+  ./SUITE/ckptreduce.py --level=stmt @output/traces/checkpoints.list -- \\
+       --scos=@<scos list> --annotate=html --output-dir=<dir>
+"""
+
+import glob
+import os
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from gnatpython.ex import Run
+from gnatpython.fileutils import mkdir, rm
+
+from SUITE import ckptreduce
+
+# Name of the file, in the traces dir, listing the checkpoints which cover
+# all the testcases processed so far
+
+CHECKPOINTS_LIST = "checkpoints.list"
+
+# Name of the file, in the traces dir, listing the traces we couldn't turn
+# into checkpoints, to be used as inputs of the final report directly
+
+TRACES_LIST = "trace.list"
+
+# Coverage level of the bootstrap analysis
+
+LEVEL = "stmt"
+
+
+class BootstrapCoverage:
+    """Incremental bootstrap coverage analysis of the tests traces in
+    subdirectories of TRACE_DIR, for the SCOS list file, with the GNATCOV
+    program. At most JOBS gnatcov runs are performed concurrently, and
+    checkpoints are merged by groups of at most FANIN."""
+
+    def __init__(self, trace_dir, scos, gnatcov, jobs=1,
+                 fanin=ckptreduce.DEFAULT_FANIN):
+        assert fanin >= 2, "checkpoint merge fanin must be at least 2"
+
+        self.trace_dir = trace_dir
+        self.scos = scos
+        self.gnatcov = gnatcov
+        self.jobs = max(1, jobs)
+        self.fanin = fanin
+
+        self.covargs = ['--level=%s' % LEVEL]
+        self.merge = ckptreduce.gnatcov_merger(gnatcov, self.covargs)
+
+        self.reduce_dir = os.path.join(trace_dir, 'reduce')
+        mkdir(self.reduce_dir)
+
+        # Checkpoints awaiting a merge, by level in the tree: test
+        # checkpoints at level 0, and merges of FANIN checkpoints of level N
+        # at level N+1.
+
+        self.levels = []
+
+        # Inputs of the merges in progress, indexed by output checkpoint
+
+        self.merging = {}
+
+        # Checkpoints which failed to merge, and traces which failed to
+        # convert, to be used as inputs of the final report nevertheless
+
+        self.unmerged = []
+        self.traces = []
+
+        self.errors = []
+        self.n_merges = 0
+
+        # Number of gnatcov runs submitted and not completed yet, and the
+        # condition variable protecting all the above, which the completion
+        # of each run notifies.
+
+        self.pending = 0
+        self.lock = threading.Condition()
+
+        self.pool = ThreadPool(self.jobs)
+
+    # -----------------------------
+    # -- Background gnatcov runs --
+    # -----------------------------
+
+    def __submit(self, fn, *args):
+        """Run FN(*ARGS) in the background. Expect the lock to be held."""
+
+        self.pending += 1
+        self.pool.apply_async(self.__run, (fn, ) + args)
+
+    def __run(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            with self.lock:
+                self.errors.append(str(e))
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.lock.notify_all()
+
+    def __update_list(self):
+        """Update the list of checkpoints for partial reports. Expect the
+        lock to be held."""
+
+        ckpts = ([ckpt for level in self.levels for ckpt in level]
+                 + [ckpt for group in self.merging.values() for ckpt in group]
+                 + self.unmerged)
+
+        filename = os.path.join(self.trace_dir, CHECKPOINTS_LIST)
+        with open(filename + '.tmp', 'w') as f:
+            f.write(''.join(ckpt + '\n' for ckpt in ckpts))
+        os.rename(filename + '.tmp', filename)
+
+    def __push(self, level, ckpt, merged_group=None):
+        """Register CKPT at LEVEL, replacing the MERGED_GROUP of checkpoints
+        it results from if not None, and start merging the checkpoints at
+        this level if we have enough of them."""
+
+        with self.lock:
+            if merged_group is not None:
+                del self.merging[ckpt]
+
+            while len(self.levels) <= level:
+                self.levels.append([])
+            self.levels[level].append(ckpt)
+
+            # A "merge" of a single checkpoint would only move it to the
+            # next level, again and again.
+
+            if self.fanin >= 2 and len(self.levels[level]) >= self.fanin:
+                group = self.levels[level]
+                self.levels[level] = []
+
+                self.n_merges += 1
+                output = os.path.join(
+                    self.reduce_dir,
+                    "l%d-%d.ckpt" % (level + 1, self.n_merges))
+                self.merging[output] = group
+                self.__submit(self.__merge, level + 1, group, output)
+
+            self.__update_list()
+
+        # The checkpoints we merged are not listed any more, so we can
+        # remove them now.
+
+        if merged_group is not None:
+            [rm(ckpt) for ckpt in merged_group]
+
+    def __convert(self, test_trace_dir, traces):
+        """Turn the TRACES of a testcase, in TEST_TRACE_DIR, into a
+        checkpoint and remove them. Keep the traces and the gnatcov output
+        on failure, including failures to run gnatcov at all."""
+
+        base = test_trace_dir.rstrip(os.sep)
+        (traces_list, ckpt, log) = [
+            base + ext for ext in ('.list', '.ckpt', '.out')]
+
+        try:
+            with open(traces_list, 'w') as f:
+                f.write(''.join(trace + '\n' for trace in traces))
+
+            p = Run([self.gnatcov, 'coverage'] + self.covargs
+                    + ['--scos=@%s' % self.scos, '@%s' % traces_list,
+                       '--save-checkpoint=%s' % ckpt],
+                    output=log)
+            error = (None if p.status == 0 else
+                     "checkpoint production for %s failed, see %s"
+                     % (test_trace_dir, log))
+        except Exception as e:
+            error = ("checkpoint production for %s failed: %s"
+                     % (test_trace_dir, e))
+
+        if error:
+            with self.lock:
+                self.traces.extend(traces)
+                self.errors.append(error)
+            return
+
+        # Only remove the traces once the checkpoint is accounted for
+
+        self.__push(0, ckpt)
+        [rm(f) for f in (traces_list, log)]
+        rm(test_trace_dir, recursive=True)
+
+    def __merge(self, level, group, output):
+        """Merge the GROUP of checkpoints into OUTPUT, at LEVEL. Keep the
+        checkpoints of GROUP for the final report on failure."""
+
+        basename = os.path.splitext(output)[0]
+        (inputs_list, log) = [basename + ext for ext in ('.list', '.out')]
+
+        try:
+            with open(inputs_list, 'w') as f:
+                f.write(''.join(ckpt + '\n' for ckpt in group))
+
+            error = (None if self.merge(inputs_list, output, log) else
+                     str(ckptreduce.CheckpointReductionError(output, log)))
+        except Exception as e:
+            error = "merge into %s failed: %s" % (output, e)
+
+        if error:
+            with self.lock:
+                del self.merging[output]
+                self.unmerged.extend(group)
+                self.errors.append(error)
+                self.__update_list()
+            return
+
+        [rm(f) for f in (inputs_list, log)]
+        self.__push(level, output, merged_group=group)
+
+    # ----------------
+    # -- Public API --
+    # ----------------
+
+    def add(self, test_trace_dir):
+        """Start processing the bootstrap traces of a completed testcase,
+        in TEST_TRACE_DIR."""
+
+        traces = sorted(glob.glob(os.path.join(test_trace_dir, '*.trace')))
+        if not traces:
+            return
+
+        with self.lock:
+            self.__submit(self.__convert, test_trace_dir, traces)
+
+    def close(self, html_dir, log):
+        """Wait for the processing of all the testcases to complete, then
+        produce the html report in HTML_DIR, with output to LOG. Return the
+        list of messages about failures along the way, leading to traces or
+        checkpoints being consolidated in the final report directly."""
+
+        with self.lock:
+            while self.pending:
+                self.lock.wait(1.0)
+
+        self.pool.close()
+        self.pool.join()
+
+        # Checkpoints of each level are fewer than FANIN, but we might have
+        # many levels and unmerged ones, so reduce what remains first.
+
+        reducer = ckptreduce.CheckpointReducer(
+            merge=self.merge, fanin=self.fanin, jobs=self.jobs,
+            workdir=os.path.join(self.reduce_dir, 'final'))
+        roots = reducer.reduce(
+            [ckpt for level in self.levels for ckpt in level]
+            + self.unmerged)
+
+        traces_list = os.path.join(self.trace_dir, TRACES_LIST)
+        with open(traces_list, 'w') as f:
+            f.write(''.join(trace + '\n' for trace in self.traces))
+
+        Run(['time', self.gnatcov, 'coverage'] + self.covargs
+            + ['--scos=@%s' % self.scos, '--annotate=html']
+            + ['--checkpoint=%s' % ckpt for ckpt in roots]
+            + (['@%s' % traces_list] if self.traces else [])
+            + ['--output-dir=%s' % html_dir],
+            output=log)
+
+        return self.errors
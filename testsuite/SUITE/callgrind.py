@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+
+"""Suite-wide aggregation of callgrind profiles of gnatcov.
+
+With --enable-valgrind=callgrind, each gnatcov execution in a testcase runs
+under callgrind and produces a profile of its own. This module merges all
+these profiles to tell which gnatcov routines are the most expensive across
+a whole testsuite run, per gnatcov subcommand (run, coverage, instrument...)
+as told by the command line recorded in each profile.
+
+For each subcommand, it produces a report of the top functions by exclusive
+and inclusive cost, and a merged profile in the callgrind format, to be
+browsed with kcachegrind. Merged profiles hold the exclusive cost of each
+function and the calls between functions, without line level information.
+
+Profiles are parsed by a pool of worker processes, each merging the profiles
+of a batch of files, and the parent merges the results of each batch as they
+come, so the amount of memory needed only depends on the number of distinct
+functions and call edges.
+
+This is used by the testsuite driver at the end of callgrind runs, and is
+usable as a standalone script on the directories holding profiles, e.g.:
+
+  ./SUITE/callgrind.py --top=50 --output-dir=profile output/callgrind
+"""
+
+import fnmatch
+import multiprocessing
+import optparse
+import os
+import re
+import sys
+
+# Pattern of the names of the callgrind profiles to aggregate, as produced
+# by tutils.maybe_valgrind, possibly prefixed by the testsuite driver when
+# saving them out of test directories.
+
+PROFILE_PATTERN = "*callgrind-*.log"
+
+# Name of the report file, and prefix of the names of the merged profiles,
+# followed by the gnatcov subcommand, in the output directory
+
+REPORT_FILE = "callgrind_report.txt"
+MERGED_PREFIX = "callgrind.out."
+
+# Default number of functions in each top list of the report
+
+DEFAULT_TOP = 30
+
+# Number of profiles each worker merges before handing the result over
+
+BATCH_SIZE = 16
+
+# Group for profiles which don't tell the gnatcov subcommand
+
+UNKNOWN_GROUP = "unknown"
+
+
+class Profile:
+    """Merged callgrind profile data. Functions are designated by (object,
+    name) pairs. Costs are lists of counters for the EVENTS, in order."""
+
+    def __init__(self):
+        self.events = []
+        self.runs = 0
+
+        # { function -> [file, exclusive costs] }
+        self.functions = {}
+
+        # { (caller, callee) -> [count, inclusive costs] }
+        self.calls = {}
+
+    def event_map(self, events):
+        """Return the list of our indexes for EVENTS, adding those we don't
+        have yet."""
+
+        for event in events:
+            if event not in self.events:
+                self.events.append(event)
+        return [self.events.index(event) for event in events]
+
+    def add_costs(self, acc, costs, mapping):
+        """Add COSTS, indexed as per MAPPING, to the ACC list of costs."""
+
+        if len(acc) < len(self.events):
+            acc.extend([0] * (len(self.events) - len(acc)))
+        for (i, cost) in enumerate(costs):
+            acc[mapping[i]] += cost
+
+    def function(self, fn, filename=None):
+        """Return the [file, exclusive costs] entry for FN."""
+
+        entry = self.functions.get(fn)
+        if entry is None:
+            entry = self.functions[fn] = [filename, []]
+        elif entry[0] is None:
+            entry[0] = filename
+        return entry
+
+    def merge(self, other):
+        """Merge the OTHER profile into this one."""
+
+        mapping = self.event_map(other.events)
+        self.runs += other.runs
+
+        for (fn, (filename, costs)) in other.functions.iteritems():
+            self.add_costs(self.function(fn, filename)[1], costs, mapping)
+
+        for (edge, (count, costs)) in other.calls.iteritems():
+            entry = self.calls.get(edge)
+            if entry is None:
+                entry = self.calls[edge] = [0, []]
+            entry[0] += count
+            self.add_costs(entry[1], costs, mapping)
+
+    def totals(self):
+        """Return the total costs, as the sum of the exclusive costs of all
+        the functions."""
+
+        totals = [0] * len(self.events)
+        for (_, costs) in self.functions.itervalues():
+            for (i, cost) in enumerate(costs):
+                totals[i] += cost
+        return totals
+
+    def inclusive_costs(self):
+        """Return the { function -> inclusive costs } dictionary. As with
+        callgrind_annotate, the inclusive cost of a function is its exclusive
+        cost plus the cost of its calls to other functions, so cycles of
+        mutually recursive functions are accounted more than once."""
+
+        result = {}
+        for (fn, (_, costs)) in self.functions.iteritems():
+            result[fn] = list(costs) + [0] * (len(self.events) - len(costs))
+
+        for ((caller, callee), (_, costs)) in self.calls.iteritems():
+            if caller == callee:
+                continue
+            acc = result.setdefault(caller, [0] * len(self.events))
+            for (i, cost) in enumerate(costs):
+                acc[i] += cost
+
+        return result
+
+    def calls_to(self):
+        """Return the { function -> number of calls } dictionary."""
+
+        result = {}
+        for ((_, callee), (count, _)) in self.calls.iteritems():
+            result[callee] = result.get(callee, 0) + count
+        return result
+
+
+# =============
+# == Parsing ==
+# =============
+
+def subcommand_of(cmd):
+    """Return the gnatcov subcommand from the CMD command line recorded in
+    a profile."""
+
+    args = cmd.split()
+    return (args[1] if len(args) > 1 and not args[1].startswith('-')
+            else UNKNOWN_GROUP)
+
+
+NAME_RE = re.compile(r'\((\d+)\)(?: (.*))?$')
+
+
+def parse_profile(filename, profiles):
+    """Parse the callgrind profile in FILENAME and merge it into the Profile
+    for its gnatcov subcommand in PROFILES, a { subcommand -> Profile }
+    dictionary."""
+
+    # Compressed names, by kind: objects, files and functions
+
+    names = {'ob': {}, 'fl': {}, 'fn': {}}
+
+    def name(kind, value):
+        m = NAME_RE.match(value)
+        if not m:
+            return value
+        (id, text) = m.groups()
+        if text is not None:
+            names[kind][id] = text
+            return text
+        return names[kind].get(id, value)
+
+    # Profiles may consist of several parts, each with its own header
+
+    group = UNKNOWN_GROUP
+    profile = None
+    counted = False
+    mapping = []
+    npos = 1
+
+    ob = fl = fn = None
+    entry = None
+    (cob, cfn) = (None, None)
+    call = None
+    skip_next = False
+
+    with open(filename) as f:
+        for line in f:
+            line = line.rstrip('\n')
+
+            if skip_next:
+                skip_next = False
+                continue
+
+            if not line or line.startswith('#'):
+                continue
+
+            c = line[0]
+
+            # Cost lines, the most frequent ones
+
+            if c.isdigit() or c in '+-*':
+                fields = line.split()
+                costs = [int(x) for x in fields[npos:]]
+
+                if call is not None:
+                    edge_entry = profile.calls.get(call[0])
+                    if edge_entry is None:
+                        edge_entry = profile.calls[call[0]] = [0, []]
+                    edge_entry[0] += call[1]
+                    profile.add_costs(edge_entry[1], costs, mapping)
+                    call = None
+                    (cob, cfn) = (None, None)
+                elif entry is not None:
+                    profile.add_costs(entry[1], costs, mapping)
+                continue
+
+            (key, _, value) = line.partition('=')
+
+            if key == 'fn':
+                fn = (ob, name('fn', value))
+                entry = profile.function(fn, fl)
+            elif key in ('fl', 'fi', 'fe'):
+                value = name('fl', value)
+                if key == 'fl':
+                    fl = value
+            elif key == 'ob':
+                ob = name('ob', value)
+            elif key == 'cob':
+                cob = name('ob', value)
+            elif key in ('cfi', 'cfl'):
+                name('fl', value)
+            elif key == 'cfn':
+                cfn = name('fn', value)
+            elif key == 'calls':
+                callee = (cob if cob is not None else ob, cfn)
+                call = ((fn, callee), int(value.split()[0]))
+            elif key in ('jump', 'jcnd'):
+                skip_next = True
+
+            # Header lines
+
+            elif line.startswith('events:'):
+                profile = profiles.get(group)
+                if profile is None:
+                    profile = profiles[group] = Profile()
+                if not counted:
+                    profile.runs += 1
+                    counted = True
+                mapping = profile.event_map(line.split()[1:])
+            elif line.startswith('positions:'):
+                npos = len(line.split()[1:])
+            elif line.startswith('cmd:'):
+                group = subcommand_of(line[len('cmd:'):])
+
+    return profiles
+
+
+def parse_batch(filenames):
+    """Parse the profiles in FILENAMES and return the { subcommand ->
+    Profile } dictionary of their merged data, with the list of messages
+    about files we couldn't parse. Module level function so we can use it in
+    worker processes."""
+
+    profiles = {}
+    errors = []
+    for filename in filenames:
+        try:
+            parse_profile(filename, profiles)
+        except (IOError, ValueError, AttributeError) as e:
+            errors.append("%s: %s" % (filename, e))
+    return (profiles, errors)
+
+
+def find_profiles(roots):
+    """Return the sorted list of the profile files under ROOTS."""
+
+    result = []
+    for root in roots:
+        for (dirpath, _, filenames) in os.walk(root, followlinks=True):
+            result.extend(
+                os.path.join(dirpath, f)
+                for f in fnmatch.filter(filenames, PROFILE_PATTERN))
+    return sorted(result)
+
+
+def merge_profiles(filenames, jobs=1):
+    """Parse and merge the profiles in FILENAMES, using JOBS processes.
+    Return the { subcommand -> Profile } dictionary of merged data, with the
+    list of messages about files we couldn't parse."""
+
+    batches = [filenames[i:i + BATCH_SIZE]
+               for i in range(0, len(filenames), BATCH_SIZE)]
+
+    profiles = {}
+    errors = []
+
+    def merge_batch(result):
+        (batch_profiles, batch_errors) = result
+        for (group, profile) in batch_profiles.iteritems():
+            profiles.setdefault(group, Profile()).merge(profile)
+        errors.extend(batch_errors)
+
+    if jobs > 1 and len(batches) > 1:
+        pool = multiprocessing.Pool(processes=jobs)
+        try:
+            for result in pool.imap_unordered(parse_batch, batches):
+                merge_batch(result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for batch in batches:
+            merge_batch(parse_batch(batch))
+
+    return (profiles, errors)
+
+
+# =============
+# == Outputs ==
+# =============
+
+def fn_image(fn):
+    (ob, name) = fn
+    return "%s [%s]" % (name, os.path.basename(ob)) if ob else name
+
+
+def report_lines(profiles, top=DEFAULT_TOP):
+    """Return the lines of a report on the top TOP functions for each of
+    the PROFILES, by exclusive and inclusive cost of the first event."""
+
+    lines = []
+
+    # Most expensive subcommands first
+
+    for (group, profile) in sorted(
+            profiles.iteritems(), key=lambda (g, p): -(p.totals() or [0])[0]):
+
+        if not profile.events:
+            continue
+
+        event = profile.events[0]
+        total = profile.totals()[0] or 1
+        calls_to = profile.calls_to()
+
+        lines.extend([
+            "",
+            "=" * 79,
+            "== gnatcov %s: %d runs, %d %s" % (
+                group, profile.runs, profile.totals()[0], event),
+            "=" * 79])
+
+        def table(title, costs):
+            lines.extend([
+                "",
+                "-- %s (top %d) --" % (title, top),
+                "",
+                "%15s %6s %10s  %s" % (event, "%", "calls", "function")])
+
+            ranked = sorted(
+                ((c[0] if c else 0, fn) for (fn, c) in costs.iteritems()),
+                reverse=True)[:top]
+
+            lines.extend(
+                "%15d %5.1f%% %10d  %s" % (
+                    cost, 100.0 * cost / total, calls_to.get(fn, 0),
+                    fn_image(fn))
+                for (cost, fn) in ranked)
+
+        table("exclusive cost",
+              dict((fn, costs)
+                   for (fn, (_, costs)) in profile.functions.iteritems()))
+        table("inclusive cost", profile.inclusive_costs())
+
+    return lines
+
+
+def write_merged(filename, group, profile):
+    """Write PROFILE, for gnatcov subcommand GROUP, to FILENAME in the
+    callgrind format."""
+
+    ids = {'ob': {}, 'fl': {}, 'fn': {}}
+
+    def ref(kind, value):
+        """Compressed name for VALUE of KIND."""
+        table = ids[kind]
+        if value in table:
+            return "(%d)" % table[value]
+        table[value] = len(table) + 1
+        return "(%d) %s" % (table[value], value)
+
+    def costs_image(costs):
+        return ' '.join(str(c) for c in costs) if costs else '0'
+
+    calls_from = {}
+    for ((caller, callee), data) in profile.calls.iteritems():
+        calls_from.setdefault(caller, []).append((callee, data))
+
+    with open(filename, 'w') as f:
+        f.write("# callgrind format\n"
+                "version: 1\n"
+                "creator: gnatcov testsuite callgrind aggregation\n"
+                "cmd: gnatcov %s (%d runs merged)\n"
+                "positions: line\n"
+                "events: %s\n"
+                "summary: %s\n\n" % (
+                    group, profile.runs, ' '.join(profile.events),
+                    costs_image(profile.totals())))
+
+        for fn in sorted(profile.functions, key=lambda fn: (fn[0], fn[1])):
+            (fl, costs) = profile.functions[fn]
+            (ob, name) = fn
+
+            f.write("ob=%s\nfl=%s\nfn=%s\n0 %s\n" % (
+                ref('ob', ob or '???'), ref('fl', fl or '???'),
+                ref('fn', name), costs_image(costs)))
+
+            for (callee, (count, call_costs)) in sorted(
+                    calls_from.get(fn, [])):
+                (cob, cname) = callee
+                cfile = profile.functions.get(callee, [None])[0]
+                f.write("cob=%s\ncfi=%s\ncfn=%s\ncalls=%d 0\n0 %s\n" % (
+                    ref('ob', cob or '???'), ref('fl', cfile or '???'),
+                    ref('fn', cname), count, costs_image(call_costs)))
+
+            f.write("\n")
+
+
+def aggregate(roots, output_dir, jobs=1, top=DEFAULT_TOP):
+    """Merge all the profiles under ROOTS and produce the report and merged
+    profiles in OUTPUT_DIR. Return a (number of profiles, errors) pair, where
+    errors is the list of messages about files we couldn't parse."""
+
+    filenames = find_profiles(roots)
+    (profiles, errors) = merge_profiles(filenames, jobs=jobs)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    with open(os.path.join(output_dir, REPORT_FILE), 'w') as f:
+        f.write('\n'.join(
+            ["Callgrind profiles: %d" % len(filenames)]
+            + report_lines(profiles, top=top)
+            + ["", "Unreadable profiles: %d" % len(errors)]
+            + errors) + '\n')
+
+    for (group, profile) in profiles.iteritems():
+        write_merged(
+            os.path.join(output_dir, MERGED_PREFIX + group), group, profile)
+
+    return (len(filenames), errors)
+
+
+# ======================
+# == main entry point ==
+# ======================
+
+if __name__ == "__main__":
+
+    op = optparse.OptionParser(usage="%prog [options] DIR...")
+
+    op.add_option(
+        "--top", dest="top", type="int", default=DEFAULT_TOP,
+        help="Number of functions in each top list of the report.")
+    op.add_option(
+        "--jobs", "-j", dest="jobs", type="int",
+        default=multiprocessing.cpu_count(),
+        help="Max number of profile parsing processes.")
+    op.add_option(
+        "--output-dir", dest="output_dir", default=".",
+        help="Directory where the report and merged profiles are placed.")
+
+    (options, args) = op.parse_args()
+
+    if not args:
+        op.error("no directory to look for profiles in")
+
+    (count, errors) = aggregate(
+        args, options.output_dir, jobs=options.jobs, top=options.top)
+
+    print "%d profiles merged, report in %s" % (
+        count - len(errors), os.path.join(options.output_dir, REPORT_FILE))
+    if errors:
+        print "%d profiles could not be read:" % len(errors)
+        print '\n'.join(errors)
+
+    sys.exit(0)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+"""Hierarchical reduction of coverage checkpoints.
+
+Consolidating a large number of coverage checkpoints with a single
+"gnatcov coverage --checkpoint=@<list>" command serializes all the loading and
+merging activities on a single core. This module provides a driver to perform
+such a consolidation as a tree of intermediate "gnatcov coverage" runs, each
+merging at most FANIN checkpoints into a new one with --save-checkpoint. Runs
+at the same level of the tree are independent from each other and are
+performed concurrently.
+
+The reduction stops as soon as at most FANIN checkpoints remain, which the
+caller is expected to provide to the final report production command, acting
+as the root of the tree.
+
+This is usable both from the testsuite infrastructure, with a caller provided
+function to execute gnatcov, and as a standalone script for consolidations
+out of the testsuite. It doesn't depend on the current "thistest" instance.
+"""
+
+import multiprocessing
+import multiprocessing.pool
+import optparse
+import os
+import sys
+
+from gnatpython.ex import Run
+from gnatpython.fileutils import mkdir, rm
+
+# Default number of checkpoints merged by each intermediate gnatcov run
+
+DEFAULT_FANIN = 8
+
+# Default subdirectory of the current directory where intermediate lists,
+# checkpoints and logs are placed
+
+DEFAULT_WORKDIR = "ckptreduce.d"
+
+
+def gnatcov_merger(gnatcov="gnatcov", covargs=()):
+    """Return a function to merge checkpoints, suitable for the MERGE
+    argument of CheckpointReducer. The function executes the GNATCOV program
+    with COVARGS, which should at least convey the --level of the analysis,
+    and returns whether the execution succeeded."""
+
+    def merge(inputs_list, ckpt, log):
+        p = Run([gnatcov, 'coverage'] + list(covargs) + [
+                '--checkpoint=@%s' % inputs_list,
+                '--save-checkpoint=%s' % ckpt],
+                output=log)
+        return p.status == 0
+
+    return merge
+
+
+class CheckpointReductionError(Exception):
+    """Exception to raise when an intermediate merge fails."""
+
+    def __init__(self, ckpt, log):
+        Exception.__init__(
+            self, "merge into %s failed, see %s" % (ckpt, log))
+        self.ckpt = ckpt
+        self.log = log
+
+
+class CheckpointReducer:
+    """Driver for hierarchical checkpoint reductions. MERGE is the function
+    to execute for each intermediate merge, called as MERGE(INPUTS_LIST,
+    CKPT, LOG) to merge the checkpoints listed in the INPUTS_LIST file into
+    CKPT, with output to LOG, and returning whether the merge succeeded.
+
+    Intermediate files are placed in WORKDIR, and at most JOBS merges are
+    performed concurrently. The gnatcov executions are the ones taking time,
+    so threads are enough to keep JOBS processes busy."""
+
+    def __init__(self, merge, fanin=DEFAULT_FANIN, jobs=1,
+                 workdir=DEFAULT_WORKDIR):
+        assert fanin >= 2, "checkpoint reduction fanin must be at least 2"
+
+        self.merge = merge
+        self.fanin = fanin
+        self.jobs = max(1, jobs)
+        self.workdir = workdir
+
+    def groups_for(self, ckpts):
+        """Split the list of CKPTS into groups of at most FANIN elements."""
+        return [ckpts[i:i + self.fanin]
+                for i in range(0, len(ckpts), self.fanin)]
+
+    def merge_group(self, level, index, group):
+        """Merge the checkpoints in GROUP, at INDEX of tree LEVEL. Return
+        the resulting checkpoint, GROUP's only element if it is alone."""
+
+        if len(group) == 1:
+            return group[0]
+
+        basename = os.path.join(self.workdir, "l%d-%d" % (level, index))
+        (inputs_list, ckpt, log) = [
+            basename + ext for ext in (".list", ".ckpt", ".out")]
+
+        with open(inputs_list, 'w') as f:
+            f.write('\n'.join(group) + '\n')
+
+        if not self.merge(inputs_list, ckpt, log):
+            raise CheckpointReductionError(ckpt, log)
+        return ckpt
+
+    def reduce(self, ckpts):
+        """Reduce the list of CKPTS down to at most FANIN checkpoints, which
+        we return."""
+
+        if len(ckpts) <= self.fanin:
+            return list(ckpts)
+
+        mkdir(self.workdir)
+
+        pool = (multiprocessing.pool.ThreadPool(self.jobs)
+                if self.jobs > 1 else None)
+        try:
+            level = 0
+            while len(ckpts) > self.fanin:
+                level += 1
+                args = [(level, index, group) for index, group
+                        in enumerate(self.groups_for(ckpts))]
+
+                ckpts = (pool.map(lambda a: self.merge_group(*a), args)
+                         if pool else [self.merge_group(*a) for a in args])
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        return ckpts
+
+    def cleanup(self):
+        """Remove the intermediate files."""
+        rm(self.workdir, recursive=True)
+
+
+# ======================
+# == main entry point ==
+# ======================
+
+def read_inputs(args):
+    """Expand the list of checkpoint ARGS, where @FILE designates a file
+    holding a list of checkpoints, one per line."""
+
+    ckpts = []
+    for arg in args:
+        if arg.startswith('@'):
+            with open(arg[1:]) as f:
+                ckpts.extend(line.strip() for line in f if line.strip())
+        else:
+            ckpts.append(arg)
+    return ckpts
+
+
+if __name__ == "__main__":
+
+    op = optparse.OptionParser(
+        usage="%prog [options] CKPT|@LISTFILE ... [-- REPORT-ARGS]")
+
+    op.add_option(
+        "--level", dest="level", default=None,
+        help="Coverage criterion of the checkpoints, passed as --level.")
+    op.add_option(
+        "--fanin", dest="fanin", type="int", default=DEFAULT_FANIN,
+        help="Max number of checkpoints merged by each gnatcov run.")
+    op.add_option(
+        "--jobs", "-j", dest="jobs", type="int",
+        default=multiprocessing.cpu_count(),
+        help="Max number of concurrent gnatcov runs.")
+    op.add_option(
+        "--workdir", dest="workdir", default=DEFAULT_WORKDIR,
+        help="Directory where intermediate files are placed.")
+    op.add_option(
+        "--gnatcov", dest="gnatcov", default="gnatcov",
+        help="gnatcov program to use.")
+    op.add_option(
+        "--keep", dest="keep", default=False, action="store_true",
+        help="Keep the intermediate files.")
+
+    (options, args) = op.parse_args()
+
+    # REPORT-ARGS are passed as is to the final gnatcov coverage command,
+    # together with the --checkpoint options for the root of the reduction.
+
+    if '--' in sys.argv:
+        report_args = sys.argv[sys.argv.index('--') + 1:]
+        args = args[:len(args) - len(report_args)]
+    else:
+        report_args = []
+
+    if not options.level:
+        op.error("--level is required")
+    if options.fanin < 2:
+        op.error("--fanin must be at least 2")
+
+    ckpts = read_inputs(args)
+    if not ckpts:
+        op.error("no checkpoint to reduce")
+
+    covargs = ['--level=%s' % options.level]
+
+    reducer = CheckpointReducer(
+        merge=gnatcov_merger(options.gnatcov, covargs),
+        fanin=options.fanin, jobs=options.jobs, workdir=options.workdir)
+
+    try:
+        roots = reducer.reduce(ckpts)
+    except CheckpointReductionError as e:
+        print "ckptreduce: %s" % e
+        sys.exit(1)
+
+    # Without REPORT-ARGS, just list the root checkpoints for the caller to
+    # use, which requires keeping the intermediate files.
+
+    if not report_args:
+        print '\n'.join(roots)
+        sys.exit(0)
+
+    p = Run([options.gnatcov, 'coverage'] + covargs
+            + ['--checkpoint=%s' % ckpt for ckpt in roots]
+            + report_args,
+            output=None)
+
+    if not options.keep:
+        reducer.cleanup()
+
+    sys.exit(p.status)
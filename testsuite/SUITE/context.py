@@ -18,7 +18,7 @@ from gnatpython.main import Main
 
 from SUITE import control
 from SUITE.control import GPRCLEAN, BUILDER, env
-from SUITE.cutils import indent_after_first_line, lines_of, ndirs_in
+from SUITE.cutils import indent_after_first_line, lines_of, ndirs_in, Wdir
 
 
 # This module is loaded as part of a Run operation for a test.py
@@ -150,6 +150,8 @@ class Test (object):
         cd(TEST_DIR)
 
         self.options = self.__cmdline_options()
+        Wdir.remap_root = self.options.wdir_root
+        Wdir.remap_top = ROOT_DIR
         self.n_failed = 0
         self.report = _ReportOutput(self.options.report_file)
         self.current_test_index = 0
@@ -189,10 +191,12 @@ class Test (object):
         # number of times it has been used in order to generate multiple logs.
         self.callgrind_count = 0
 
-    def cleanup(self, project):
-        """Cleanup possible remnants of previous builds."""
-        Run([GPRCLEAN, "-P%s" % project] +
-            self.gprconfoptions + self.gprvaroptions)
+    def cleanup(self, project, gprclean=True):
+        """Cleanup possible remnants of previous builds. Leave build
+        artifacts alone if GPRCLEAN is False."""
+        if gprclean:
+            Run([GPRCLEAN, "-P%s" % project] +
+                self.gprconfoptions + self.gprvaroptions)
         rm('*.xcov')
         rm('*.bin')
 
@@ -288,6 +292,11 @@ class Test (object):
 
         main.add_option('--tags', dest='tags', default="")
 
+        main.add_option('--wdir-root', dest='wdir_root', metavar='DIR',
+                        default=None,
+                        help='Root of the tree where working directories '
+                             'physically reside, if not in the test tree.')
+
         control.add_shared_options_to(main, toplevel=False)
 
         main.parse_args()
@@ -2,6 +2,7 @@
 Testsuite control
 """
 
+import optparse
 import os.path
 import re
 
@@ -9,6 +10,7 @@ from gnatpython.env import Env
 from gnatpython.ex import Run
 from gnatpython.fileutils import rm
 
+from SUITE import ckptreduce
 from SUITE.cutils import no_ext
 
 
@@ -388,3 +390,53 @@ def add_shared_options_to(o, toplevel):
         '--consolidate', dest='consolidate', default="traces",
         help=("artefacts to be used for consolidation specs"),
         choices=('traces', 'checkpoints'))
+
+    # --incremental-builds
+    o.add_option(
+        '--incremental-builds', dest='incremental_builds',
+        action='store_true', default=False,
+        help=('Skip test program builds when the sources and build command '
+              'lines are the same as for the previous build, as recorded in '
+              'a stamp file. Ignored for qualification runs.'))
+
+    # --ckpt-fanin, --ckpt-jobs, --ckpt-workdir
+
+    def check_fanin(option, opt, value, parser):
+        if value < 2:
+            raise optparse.OptionValueError(
+                "%s must be at least 2 (got %d)" % (opt, value))
+        setattr(parser.values, option.dest, value)
+
+    def check_workdir(option, opt, value, parser):
+        # Each test needs a directory of its own, as tests run concurrently
+        # and name intermediate files after their position in the tree.
+        if os.path.isabs(value):
+            raise optparse.OptionValueError(
+                "%s must be relative to the test working directory (got %s)"
+                % (opt, value))
+        setattr(parser.values, option.dest, value)
+
+    o.add_option(
+        '--ckpt-fanin', dest='ckpt_fanin', metavar='N', type='int',
+        default=None, action='callback', callback=check_fanin,
+        help=('Reduce the set of checkpoints used as inputs of consolidation '
+              'reports with a tree of gnatcov runs, each merging at most N '
+              'checkpoints, N >= 2. No reduction by default.'))
+    o.add_option(
+        '--ckpt-jobs', dest='ckpt_jobs', metavar='N', type='int', default=1,
+        help='Max number of concurrent gnatcov runs for checkpoint '
+             'reductions.')
+    o.add_option(
+        '--ckpt-workdir', dest='ckpt_workdir', metavar='DIR', type='string',
+        default=ckptreduce.DEFAULT_WORKDIR, action='callback',
+        callback=check_workdir,
+        help=('Directory where intermediate files of checkpoint reductions '
+              'are placed, relative to the test working directory.'))
+
+    # --concurrent-reports
+    o.add_option(
+        '--concurrent-reports', dest='concurrent_reports',
+        action='store_true', default=False,
+        help=('Produce the various coverage report formats of SCOV driven '
+              'tests with concurrent gnatcov executions, out of a single '
+              'coverage analysis.'))
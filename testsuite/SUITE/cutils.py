@@ -5,6 +5,8 @@ toplevel suite driver. In particular, they don't depend on the current
 "thistest" instance.
 """
 
+import hashlib
+import json
 import os.path
 import re
 import shutil
@@ -127,21 +129,129 @@ def empty(f):
     return os.stat(f).st_size == 0
 
 
-def version(tool, nlines=1):
+# ---------------------------
+# -- Tool identity probing --
+# ---------------------------
+
+# Probing the identity of a tool involves launching it, which is costly when
+# done for each testcase. We cache the results, keyed by the resolved path of
+# the tool executable together with its size and modification time, or with
+# a hash of its contents. The cache is persisted in a file designated by the
+# environment variable below, so that the toplevel driver and all the
+# testcases it spawns share a single set of probes.
+
+TOOL_IDENTITY_CACHE_VAR = 'GNATCOV_TOOL_IDENTITY_CACHE'
+
+
+class ToolIdentityCache:
+    """Cache of tool version information, persisted in FILENAME. Identify
+    executables with a hash of their contents if HASH_CONTENTS, with their
+    size and modification time otherwise."""
+
+    def __init__(self, filename, hash_contents=False):
+        self.filename = filename
+        self.hash_contents = hash_contents
+        self.entries = {}
+
+    @staticmethod
+    def load(filename):
+        """Return the cache persisted in FILENAME, or an empty cache to be
+        persisted there if FILENAME cannot be read."""
+
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return ToolIdentityCache(filename)
+
+        cache = ToolIdentityCache(filename, data['hash_contents'])
+        cache.entries = data['entries']
+        return cache
+
+    def save(self):
+        """Persist the cache, merging the entries other processes might have
+        persisted since we loaded it. Testcases may do this concurrently, so
+        write to a temporary file first and rename it: entries added by
+        concurrent writers might get lost, and will just be probed again."""
+
+        if os.path.exists(self.filename):
+            on_disk = ToolIdentityCache.load(self.filename)
+            if on_disk.hash_contents == self.hash_contents:
+                on_disk.entries.update(self.entries)
+                self.entries = on_disk.entries
+
+        tmp = '%s.%d' % (self.filename, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'hash_contents': self.hash_contents,
+                       'entries': self.entries}, f,
+                      indent=1, sort_keys=True, separators=(',', ': '))
+        if sys.platform == 'win32' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmp, self.filename)
+
+    def key(self, tool, path, nlines):
+        """Cache key for version information on the first NLINES of output
+        of TOOL, with its executable at PATH."""
+
+        if self.hash_contents:
+            digest = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), b''):
+                    digest.update(chunk)
+            stamp = digest.hexdigest()
+        else:
+            st = os.stat(path)
+            stamp = '%d:%d' % (st.st_size, int(st.st_mtime))
+        return '%s:%s:%s:%d' % (tool, path, stamp, nlines)
+
+    def version(self, tool, path, nlines):
+        """Version information for TOOL, found at PATH, probing it on cache
+        misses."""
+
+        key = self.key(tool, path, nlines)
+        if key not in self.entries:
+            self.entries[key] = probe_version(tool, nlines)
+            if self.filename:
+                self.save()
+        return self.entries[key]
+
+
+# Cache for this process, initialized on first use
+
+_tool_identity_cache = None
+
+
+def setup_tool_identity_cache(filename, hash_contents=False):
+    """Start a fresh tool identity cache persisted in FILENAME, and have all
+    the processes we spawn from now on use it."""
+
+    global _tool_identity_cache
+    clear(filename)
+    _tool_identity_cache = ToolIdentityCache(filename, hash_contents)
+    _tool_identity_cache.save()
+    os.environ[TOOL_IDENTITY_CACHE_VAR] = os.path.abspath(filename)
+
+
+def tool_identity_cache():
+    """The tool identity cache for this process: the one designated by our
+    environment if any, a process local one otherwise."""
+
+    global _tool_identity_cache
+    if _tool_identity_cache is None:
+        filename = os.environ.get(TOOL_IDENTITY_CACHE_VAR)
+        _tool_identity_cache = (
+            ToolIdentityCache.load(filename) if filename
+            else ToolIdentityCache(None))
+    return _tool_identity_cache
+
+
+def probe_version(tool, nlines=1):
     """
     Return version information as reported by the execution of TOOL --version,
-    expected on the first NLINES of output. If TOOL is not available from PATH,
-    return a version text indicating unavailability.  If TOOL is 'gcc', append
-    the target for which it was configured to the base version info.
+    expected on the first NLINES of output. If TOOL is 'gcc', append the
+    target for which it was configured to the base version info.
     """
 
-    # If TOOL is not on PATH, return a version text indicating unavailability.
-    # This situation is legitimate here for gnatemu when running through a
-    # probe, and if we happen to actually need the tool later on, we'll see
-    # test failures anyway.
-    if not which(tool):
-        return 'N/A'
-
     # --version often dumps more than the version number on a line. A
     # copyright notice is typically found there as well. Our heuristic
     # here is to strip everything past the first comma.
@@ -161,6 +271,29 @@ def version(tool, nlines=1):
     return version_info
 
 
+def version(tool, nlines=1):
+    """
+    Return version information as reported by the execution of TOOL --version,
+    expected on the first NLINES of output. If TOOL is not available from PATH,
+    return a version text indicating unavailability.  If TOOL is 'gcc', append
+    the target for which it was configured to the base version info.
+
+    Results are cached in the tool identity cache, so TOOL is only launched
+    once per suite run as long as its executable does not change.
+    """
+
+    # If TOOL is not on PATH, return a version text indicating unavailability.
+    # This situation is legitimate here for gnatemu when running through a
+    # probe, and if we happen to actually need the tool later on, we'll see
+    # test failures anyway.
+    path = which(tool)
+    if not path:
+        return 'N/A'
+
+    return tool_identity_cache().version(
+        tool, os.path.realpath(path), nlines)
+
+
 def ndirs_in(path):
     """Return the number of directory name components in PATH."""
     # Count how many times we can split PATH with os.path until reaching an
@@ -185,19 +318,151 @@ def output_of(cmd, dir=None):
     return output
 
 
+def mirror_dir_for(root, path):
+    """
+    Return the path of the directory corresponding to PATH in the mirror of
+    the filesystem tree under ROOT.
+    """
+    return os.path.join(
+        root, os.path.splitdrive(os.path.abspath(path))[1].lstrip(os.sep))
+
+
+def original_dir_for(root, path):
+    """
+    Return the path of the directory that directory PATH stands for in the
+    mirror of the filesystem tree under ROOT, or PATH itself if it is not
+    part of this mirror.
+    """
+    rpath = os.path.relpath(os.path.realpath(path), os.path.realpath(root))
+    if rpath == os.pardir or rpath.startswith(os.pardir + os.sep):
+        return path
+    return os.path.normpath(os.path.join(os.sep, rpath))
+
+
+def logical_cwd():
+    """
+    Return the current working directory, as the path through the testcase
+    tree when this is a directory remapped by mkdir_remapped, or one of its
+    subdirectories. os.getcwd() returns the physical path under the mirror
+    root in this case, which is meaningless with respect to the testcase
+    tree.
+    """
+    cwd = os.getcwd()
+    if Wdir.remap_root:
+        cwd = original_dir_for(Wdir.remap_root, cwd)
+    return cwd
+
+
+def expose_in_mirror(root, path, top):
+    """
+    Make the mirror of directory PATH under ROOT, and the mirror of each of
+    its parents up to directory TOP, expose the original directory entries
+    through symbolic links. This preserves the meaning of relative paths from
+    directories remapped by mkdir_remapped, even though they are physically
+    elsewhere, as long as these paths don't go past TOP.
+
+    The links reflect the original entries at the time of the call, so this
+    is to be called again to account for entries created or removed since.
+    """
+    path = os.path.abspath(path)
+    top = os.path.abspath(top)
+    mkdir(mirror_dir_for(root, path))
+
+    while True:
+        mpath = mirror_dir_for(root, path)
+        entries = set(os.listdir(path))
+
+        # Entries which exist already in the mirror are either links from a
+        # previous call, mirror directories or remapped working directories,
+        # to preserve unless they are links to entries removed since.
+
+        for entry in os.listdir(mpath):
+            mentry = os.path.join(mpath, entry)
+            if (entry not in entries and os.path.islink(mentry)
+                    and os.readlink(mentry) == os.path.join(path, entry)):
+                os.remove(mentry)
+
+        for entry in entries:
+            mentry = os.path.join(mpath, entry)
+            if not os.path.lexists(mentry):
+                os.symlink(os.path.join(path, entry), mentry)
+
+        parent = os.path.dirname(path)
+        if path == top or parent == path:
+            return
+        path = parent
+
+
+def mkdir_remapped(dir, root, top):
+    """
+    Create directory DIR as a symbolic link to its mirror under ROOT, where
+    it physically resides. ROOT is typically on a local fast filesystem such
+    as a tmpfs. Nothing is created if DIR is already remapped this way, or is
+    within a remapped directory, but the mirrors of its parents up to TOP are
+    refreshed in any case, so that they expose the entries created in the
+    original directories since DIR was last entered.
+    """
+    dir = os.path.abspath(dir)
+    mdir = mirror_dir_for(root, dir)
+
+    # Subdirectories of remapped directories physically reside under ROOT
+    # already.
+
+    if (os.path.realpath(os.path.dirname(dir)) + os.sep).startswith(
+            os.path.realpath(root) + os.sep):
+        mkdir(dir)
+        return
+
+    if not (os.path.islink(dir) and os.readlink(dir) == mdir):
+
+        # Anything else is a leftover from a previous run. Beware that
+        # removing trees might follow symbolic links in some implementations.
+
+        if os.path.islink(dir):
+            os.remove(dir)
+        elif os.path.exists(dir):
+            shutil.rmtree(dir)
+
+        os.symlink(mdir, dir)
+
+    mkdir(mdir)
+    expose_in_mirror(root, os.path.dirname(dir), top)
+
+
+def remapped_dirs_in(dir, root):
+    """
+    Return the list of directories remapped under ROOT by mkdir_remapped,
+    found in the tree rooted at DIR.
+    """
+    root = os.path.abspath(root) + os.sep
+    return [os.path.join(path, d)
+            for (path, dirs, _) in os.walk(dir)
+            for d in dirs
+            if os.path.islink(os.path.join(path, d))
+            and os.readlink(os.path.join(path, d)).startswith(root)]
+
+
 class Wdir:
     """
     Simple helper to handle working directories.
     """
 
+    # Root of the mirror tree where working directories are to be remapped
+    # with mkdir_remapped, if any, and top directory of the tree the mirror
+    # exposes to them.
+    remap_root = None
+    remap_top = None
+
     def __init__(self, subdir=None, clean=False):
         """
         If `subdir` is passed, create a subdirectory with this name and move
         there. If `clean`, make sure it's removed first.
         """
-        self.homedir = os.getcwd()
+        self.homedir = logical_cwd()
         if subdir:
-            if clean and os.path.exists(subdir):
+            if clean and os.path.islink(subdir):
+                shutil.rmtree(os.path.realpath(subdir))
+            elif clean and os.path.exists(subdir):
                 shutil.rmtree(subdir)
             self.to_subdir(subdir)
 
@@ -207,7 +472,10 @@ class Wdir:
         directory). Create it if needed.
         """
         self.to_homedir()
-        mkdir(dir)
+        if Wdir.remap_root:
+            mkdir_remapped(dir, Wdir.remap_root, Wdir.remap_top)
+        else:
+            mkdir(dir)
         cd(dir)
 
     def to_homedir(self):
@@ -21,11 +21,11 @@
 #
 # ****************************************************************************
 
-import os, sys, re
+import os, sys, re, struct
 
 from SUITE import dutils
 
-from SUITE.cutils import output_of, version
+from SUITE.cutils import output_of, version, FatalError
 from gnatpython.ex import Run
 
 QLANGUAGES = ["Ada"]
@@ -149,7 +149,227 @@ class Qdata:
         self.entries.append (ob)
 
     def flush(self):
-        dutils.pdump_to (qdaf_in("."), o=self)
+        qdump_to (qdaf_in("."), o=self)
+
+# ===============================================
+# == Persistent format for qualification dumps ==
+# ===============================================
+
+# Qdata and TC_status instances are dumped in a compact binary format of our
+# own, which doesn't depend on the layout of the classes involved in the
+# testcase executions (Xnote, Block, Enote, ...) and can be read back without
+# them. A dump file is made of:
+#
+#   header  : QDF_MAGIC, u16 format version, u8 record kind (QDF_*)
+#   strings : u32 count, then for each: u32 length + bytes
+#   record  : contents for the record kind, where strings are designated
+#             by their u32 index in the table above (QDF_NOSTR for None)
+#
+# A Qdata record is:
+#
+#   u32 tcid, u32 #entries, then for each entry:
+#     u32 xfile, u32 wdir, u32 #drivers, u32 driver * #drivers,
+#     u32 #sources, then for each source:
+#       u32 source, u32 #notes, then for each note:
+#         u8 kind, u8 flags (QDF_SATISFIED | QDF_WEAK),
+#         u32 segment image, u32 stag text
+#
+# A TC_status record is:
+#
+#   u8 passed, u8 xfail (0 = False, 1 = True, 2 = None), u32 status,
+#   u32 comment
+#
+# All the integers are little endian. The reader falls back to pickle for
+# files without the magic header, dumped by older versions of the testsuite.
+
+QDF_MAGIC = "QDUMP"
+QDF_VERSION = 1
+
+QDF_QDATA, QDF_STATUS = range(1, 3)
+
+QDF_NOSTR = 0xffffffff
+
+QDF_SATISFIED = 0x1
+QDF_WEAK = 0x2
+
+_QDF_HEADER = struct.Struct ("<%dsHB" % len(QDF_MAGIC))
+_U32 = struct.Struct ("<I")
+_NOTE = struct.Struct ("<BBII")
+_STATUS = struct.Struct ("<BBII")
+
+_TRIBOOL_CODE = {False: 0, True: 1, None: 2}
+_TRIBOOL_VALUE = {0: False, 1: True, 2: None}
+
+class QDnote:
+    """Expected note, as read back from a qualification data dump. Offers
+    the subset of the Xnote interface of use for test results reporting, with
+    the segment and separation tag reduced to their textual images."""
+
+    def __init__(self, kind, satisfied, weak, segment, stag):
+        self.kind = kind
+        self.weak = weak
+        self.segment = segment
+        self.stag = stag
+        self._satisfied = satisfied
+
+    def satisfied(self):
+        return self._satisfied
+
+class _QDwriter:
+
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+        self.chunks = []
+
+    def sidx(self, text):
+        """Index of TEXT in the string table, interned on the fly."""
+        if text is None:
+            return QDF_NOSTR
+        if isinstance (text, unicode):
+            text = text.encode ('utf-8')
+        idx = self.index.get (text)
+        if idx is None:
+            idx = len (self.strings)
+            self.index[text] = idx
+            self.strings.append (text)
+        return idx
+
+    def u32(self, value):
+        self.chunks.append (_U32.pack (value))
+
+    def put_qdata(self, qda):
+        self.u32 (self.sidx (qda.tcid))
+        self.u32 (len (qda.entries))
+        for qde in qda.entries:
+            self.u32 (self.sidx (qde.xfile))
+            self.u32 (self.sidx (qde.wdir))
+            self.u32 (len (qde.drivers))
+            [self.u32 (self.sidx (driver)) for driver in qde.drivers]
+
+            self.u32 (len (qde.xrnotes))
+            for source in qde.xrnotes:
+                notes = [note for notelist in qde.xrnotes[source].values()
+                         for note in notelist]
+                self.u32 (self.sidx (source))
+                self.u32 (len (notes))
+                for note in notes:
+                    self.chunks.append (_NOTE.pack (
+                        note.kind,
+                        (QDF_SATISFIED if note.satisfied() else 0)
+                        | (QDF_WEAK if note.weak else 0),
+                        self.sidx (
+                            str (note.segment) if note.segment else None),
+                        self.sidx (note.stag.text if note.stag else None)))
+
+    def put_status(self, std):
+        self.chunks.append (_STATUS.pack (
+            _TRIBOOL_CODE[std.passed], _TRIBOOL_CODE[std.xfail],
+            self.sidx (std.status), self.sidx (std.comment)))
+
+    def image(self, kind):
+        header = [_QDF_HEADER.pack (QDF_MAGIC, QDF_VERSION, kind),
+                  _U32.pack (len (self.strings))]
+        for text in self.strings:
+            header.append (_U32.pack (len (text)))
+            header.append (text)
+        return "".join (header + self.chunks)
+
+class _QDreader:
+
+    def __init__(self, data, filename):
+        self.data = data
+        self.filename = filename
+        self.pos = _QDF_HEADER.size
+
+        (magic, self.version, self.kind) = _QDF_HEADER.unpack_from (data)
+        if self.version != QDF_VERSION:
+            raise FatalError (
+                "unsupported qualification data format version %d in %s" % (
+                    self.version, filename))
+
+        self.strings = [self.string() for i in range (self.u32())]
+
+    def u32(self):
+        (value,) = _U32.unpack_from (self.data, self.pos)
+        self.pos += _U32.size
+        return value
+
+    def string(self):
+        size = self.u32 ()
+        text = self.data[self.pos:self.pos+size]
+        self.pos += size
+        return text
+
+    def sref(self):
+        idx = self.u32 ()
+        return None if idx == QDF_NOSTR else self.strings[idx]
+
+    def get_qdata(self):
+        qda = Qdata (tcid=self.sref())
+        for e in range (self.u32()):
+            xfile = self.sref ()
+            wdir = self.sref ()
+            drivers = [self.sref() for d in range (self.u32())]
+
+            xrnotes = {}
+            for s in range (self.u32()):
+                source = self.sref ()
+                kdict = xrnotes[source] = {}
+                for n in range (self.u32()):
+                    (kind, flags, segment, stag) = _NOTE.unpack_from (
+                        self.data, self.pos)
+                    self.pos += _NOTE.size
+                    kdict.setdefault (kind, []).append (QDnote (
+                        kind=kind,
+                        satisfied=(flags & QDF_SATISFIED) != 0,
+                        weak=(flags & QDF_WEAK) != 0,
+                        segment=(None if segment == QDF_NOSTR
+                                 else self.strings[segment]),
+                        stag=(None if stag == QDF_NOSTR
+                              else self.strings[stag])))
+
+            qda.register (QDentry (
+                xfile=xfile, drivers=drivers, xrnotes=xrnotes, wdir=wdir))
+        return qda
+
+    def get_status(self):
+        (passed, xfail, status, comment) = _STATUS.unpack_from (
+            self.data, self.pos)
+        self.pos += _STATUS.size
+        return TC_status (
+            passed=_TRIBOOL_VALUE[passed], xfail=_TRIBOOL_VALUE[xfail],
+            status=None if status == QDF_NOSTR else self.strings[status],
+            comment=None if comment == QDF_NOSTR else self.strings[comment])
+
+def qdump_to(filename, o):
+    """Dump O, a Qdata or TC_status instance, to FILENAME in our
+    qualification data format."""
+
+    writer = _QDwriter ()
+    if isinstance (o, Qdata):
+        writer.put_qdata (o)
+        kind = QDF_QDATA
+    else:
+        writer.put_status (o)
+        kind = QDF_STATUS
+
+    with open (filename, 'wb') as f:
+        f.write (writer.image (kind))
+
+def qload_from(filename):
+    """Load back a Qdata or TC_status instance from FILENAME, dumped either
+    in our qualification data format or as a pickle."""
+
+    with open (filename, 'rb') as f:
+        data = f.read ()
+
+    if not data.startswith (QDF_MAGIC):
+        return dutils.pload_from (filename)
+
+    reader = _QDreader (data, filename)
+    return (reader.get_qdata() if reader.kind == QDF_QDATA
+            else reader.get_status())
 
 # -------------
 # -- qdaf_in --
@@ -158,7 +378,7 @@ class Qdata:
 QUALDATA_FILE = "tc"+STREXT
 
 def qdaf_in(dir):
-    """Filename for qualification data to be pickled in DIR for a testcase.
+    """Filename for qualification data to be dumped in DIR for a testcase.
     This hosts instances of objects representing test executions, each holding
     dictionaries of expected notes together with their dischargers."""
     return os.path.join (dir, QUALDATA_FILE)
@@ -0,0 +1,376 @@
+"""Testsuite results database.
+
+The toplevel driver records the result of every testcase it runs in an
+SQLite database in the testsuite output dir, in addition to the GAIA log
+files and the per-test outputs. The database is append-only: each testsuite
+run adds a run entry, with the suite discriminants and a fingerprint of the
+execution context, then one result entry per test with its status, comment,
+timings, test specific discriminants and a fingerprint of the test sources.
+
+Decisions to reuse the results of a previous run, comparisons against the
+results of another run and report generation are then indexed queries
+instead of scans of the test directories and result files.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Name of the database file, in the testsuite output dir
+
+RESULTS_DB = "results.db"
+
+# Version of the database schema, to be bumped on incompatible changes
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stamp REAL NOT NULL,
+    shard TEXT,
+    discriminants TEXT,
+    fingerprint TEXT,
+    context TEXT,
+    cmdline TEXT
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    comment TEXT,
+    start REAL,
+    duration REAL,
+    discriminants TEXT,
+    fingerprint TEXT,
+    PRIMARY KEY (run, name)
+);
+
+CREATE INDEX IF NOT EXISTS results_by_name ON results (name, run);
+"""
+
+# Statuses which denote unexpected failures, as opposed to OK, UOK or XFAIL
+
+FAILURE_STATUSES = ('FAILED', 'RMFAILED')
+
+# Prefix of SQLite database files, to tell them from GAIA results files
+
+SQLITE_MAGIC = b"SQLite format 3\0"
+
+
+def results_db_in(dirname):
+    """Name of the results database file in testsuite output directory
+    DIRNAME."""
+    return os.path.join(dirname, RESULTS_DB)
+
+
+def is_results_db(filename):
+    """Whether FILENAME is an SQLite database file."""
+    with open(filename, 'rb') as f:
+        return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+def context_fingerprint(context):
+    """Return a fingerprint of CONTEXT, a dictionary of items describing the
+    execution context of a run which must match for results to be
+    reusable."""
+    return hashlib.sha1(json.dumps(context, sort_keys=True)).hexdigest()
+
+
+def test_fingerprint(paths):
+    """Return a fingerprint of the contents of the test files at PATHS, a
+    list of test script and options file names. Missing files count as
+    empty."""
+
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(os.path.basename(path))
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def reuse_errors(row, context, fingerprint):
+    """Return a list of messages explaining why the result in ROW, as
+    returned by ResultsDB.latest_result, may not be reused for a run with
+    execution CONTEXT and test sources FINGERPRINT. Empty if it may."""
+
+    errors = []
+
+    if row['run_fingerprint'] != context_fingerprint(context):
+        previous = json.loads(row['run_context'] or '{}')
+        for key in sorted(set(context) | set(previous)):
+            if context.get(key) != previous.get(key):
+                errors.append(
+                    '  * %s mismatch: "%s" (expected "%s")'
+                    % (key, context.get(key), previous.get(key)))
+
+    if row['fingerprint'] != fingerprint:
+        errors.append('  * Test sources changed')
+
+    if row['status'] not in ('OK', 'UOK'):
+        errors.append('  * Previous status was %s' % row['status'])
+
+    return errors
+
+
+class ResultsDB:
+    """Handle to the results database in FILENAME, created if needed."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.row_factory = sqlite3.Row
+
+        # Results are committed one at a time as tests complete. The write
+        # ahead log makes this cheap and lets readers proceed meanwhile.
+
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError(
+                "%s: unsupported results database version %d"
+                % (filename, version))
+
+        self.db.executescript(SCHEMA)
+        self.db.execute("PRAGMA user_version=%d" % SCHEMA_VERSION)
+        self.db.commit()
+
+        self.has_baseline = False
+
+    def close(self):
+        self.db.close()
+
+    # -----------------------
+    # -- Recording results --
+    # -----------------------
+
+    def start_run(self, shard=None, discriminants=(), context=None,
+                  cmdline=None):
+        """Register a new run and return its identifier. SHARD is the "K/N"
+        shard specification of the run, if any, DISCRIMINANTS the list of
+        suite discriminants and CONTEXT the dictionary of execution context
+        items from which we compute the run fingerprint."""
+
+        cursor = self.db.execute(
+            "INSERT INTO runs"
+            " (stamp, shard, discriminants, fingerprint, context, cmdline)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (time.time(), shard, ' '.join(discriminants),
+             context_fingerprint(context) if context is not None else None,
+             json.dumps(context, sort_keys=True)
+             if context is not None else None,
+             cmdline))
+        self.db.commit()
+        return cursor.lastrowid
+
+    def add_result(self, run, name, dir, filename, status, comment=None,
+                   start=None, duration=None, discriminants=(),
+                   fingerprint=None):
+        """Record the result of the test NAME, from the test script FILENAME
+        in directory DIR, for RUN."""
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO results"
+            " (run, name, dir, filename, status, comment, start, duration,"
+            "  discriminants, fingerprint)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run, name, dir, filename, status, comment, start, duration,
+             ' '.join(discriminants), fingerprint))
+        self.db.commit()
+
+    def add_results(self, run, rows):
+        """Record the results in ROWS, a sequence of dictionaries with the
+        add_result arguments as keys, for RUN. Discriminants are expected as
+        strings there, as returned by run_results."""
+
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO results"
+                " (run, name, dir, filename, status, comment, start,"
+                "  duration, discriminants, fingerprint)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run, row['name'], row['dir'], row['filename'],
+                  row['status'], row['comment'], row['start'],
+                  row['duration'], row['discriminants'], row['fingerprint'])
+                 for row in rows])
+
+    # -------------
+    # -- Queries --
+    # -------------
+
+    def run_info(self, run):
+        """Return the row for RUN in the runs table, None if there is no
+        such run."""
+        return self.db.execute(
+            "SELECT * FROM runs WHERE id = ?", (run, )).fetchone()
+
+    def latest_run(self):
+        """Return the identifier of the most recent run, None if there is
+        none."""
+        return self.db.execute("SELECT MAX(id) FROM runs").fetchone()[0]
+
+    def run_results(self, run):
+        """Return the list of result rows for RUN, as dictionaries."""
+        return [dict(row) for row in self.db.execute(
+            "SELECT * FROM results WHERE run = ? ORDER BY name", (run, ))]
+
+    def latest_result(self, name, before=None):
+        """Return the result row of the most recent run of the test NAME,
+        joined with the fingerprint and context of that run, or None if the
+        test never ran. Only consider runs before the BEFORE run if not
+        None."""
+        return self.db.execute(
+            "SELECT results.*, runs.fingerprint AS run_fingerprint,"
+            "       runs.context AS run_context"
+            " FROM results JOIN runs ON runs.id = results.run"
+            " WHERE results.name = ? AND results.run < ?"
+            " ORDER BY results.run DESC LIMIT 1",
+            (name, before if before is not None else 1 << 62)).fetchone()
+
+    def latest_results(self):
+        """Return the list of the most recent result rows for each test
+        ever recorded, as dictionaries."""
+        return [dict(row) for row in self.db.execute(
+            "SELECT * FROM results AS r"
+            " WHERE r.run = (SELECT MAX(run) FROM results"
+            "                WHERE name = r.name)"
+            " ORDER BY r.name")]
+
+    # --------------------------
+    # -- Comparison baselines --
+    # --------------------------
+
+    def attach_baseline(self, path):
+        """Setup the results to compare against: the latest results of each
+        test in another results database, or in the database of another
+        testsuite output dir, or the results in a GAIA results file, as
+        lines of "name:status[:comment]" text."""
+
+        if os.path.isdir(path):
+            path = results_db_in(path)
+
+        self.db.execute(
+            "CREATE TEMP TABLE baseline"
+            " (name TEXT PRIMARY KEY, status TEXT, comment TEXT)")
+
+        if is_results_db(path):
+            self.db.execute("ATTACH DATABASE ? AS old", (path, ))
+            self.db.execute(
+                "INSERT INTO baseline"
+                " SELECT name, status, comment FROM old.results AS r"
+                " WHERE r.run = (SELECT MAX(run) FROM old.results"
+                "                WHERE name = r.name)")
+            self.db.commit()
+            self.db.execute("DETACH DATABASE old")
+        else:
+            with open(path) as f:
+                rows = [(line.split(':', 2) + [None])[:3]
+                        for line in f.read().splitlines() if ':' in line]
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO baseline VALUES (?, ?, ?)", rows)
+
+        self.has_baseline = True
+
+    def compared_results(self, run):
+        """Return the list of (name, status, comment, old status) tuples for
+        the results of RUN, where old status is the status in the baseline,
+        None if the test is not there or if we have no baseline."""
+
+        if not self.has_baseline:
+            return [(row['name'], row['status'], row['comment'], None)
+                    for row in self.db.execute(
+                        "SELECT name, status, comment FROM results"
+                        " WHERE run = ? ORDER BY name", (run, ))]
+
+        return [tuple(row) for row in self.db.execute(
+            "SELECT r.name, r.status, r.comment, b.status"
+            " FROM results AS r LEFT JOIN baseline AS b USING (name)"
+            " WHERE r.run = ? ORDER BY r.name", (run, ))]
+
+    def removed_tests(self, run):
+        """Return the list of (name, old status) pairs for the tests in the
+        baseline which have no result for RUN."""
+
+        if not self.has_baseline:
+            return []
+
+        return [tuple(row) for row in self.db.execute(
+            "SELECT name, status FROM baseline AS b"
+            " WHERE NOT EXISTS (SELECT 1 FROM results"
+            "                   WHERE run = ? AND name = b.name)"
+            " ORDER BY name", (run, ))]
+
+    # -------------
+    # -- Reports --
+    # -------------
+
+    def report_lines(self, run):
+        """Return the list of lines of a human readable report for the
+        results of RUN, compared with the baseline if we have one."""
+
+        results = self.compared_results(run)
+
+        def failed(status):
+            return status in FAILURE_STATUSES
+
+        def entry(name, status, comment=None, old_status=None):
+            return "  %-68s %s%s%s" % (
+                name, status,
+                " (was %s)" % old_status if old_status else "",
+                " - %s" % comment if comment else "")
+
+        tally = {}
+        for (_, status, _, _) in results:
+            tally[status] = tally.get(status, 0) + 1
+
+        lines = ["= Summary =", ""]
+        lines.extend("  %-10s: %d" % (status, tally[status])
+                     for status in sorted(tally))
+        lines.append("  %-10s: %d" % ("TOTAL", len(results)))
+
+        def section(title, entries):
+            lines.extend(["", "= %s (%d) =" % (title, len(entries)), ""])
+            lines.extend(entries)
+
+        if self.has_baseline:
+            section("New failures", [
+                entry(name, status, comment, old)
+                for (name, status, comment, old) in results
+                if failed(status) and old is not None and not failed(old)])
+            section("Still failing", [
+                entry(name, status, comment)
+                for (name, status, comment, old) in results
+                if failed(status) and failed(old)])
+            section("Fixed", [
+                entry(name, status, comment, old)
+                for (name, status, comment, old) in results
+                if not failed(status) and failed(old)])
+            section("New tests", [
+                entry(name, status, comment)
+                for (name, status, comment, old) in results
+                if old is None])
+            section("Removed tests", [
+                entry(name, old) for (name, old) in self.removed_tests(run)])
+        else:
+            section("Failures", [
+                entry(name, status, comment)
+                for (name, status, comment, _) in results
+                if failed(status)])
+
+        return lines
+
+    def write_report(self, filename, run):
+        """Write the report_lines for RUN to FILENAME."""
+        with open(filename, 'w') as f:
+            f.write('\n'.join(self.report_lines(run)) + '\n')
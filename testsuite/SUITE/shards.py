@@ -0,0 +1,96 @@
+"""Testsuite sharding facilities.
+
+This module exposes the means to split the set of testcases into N slices,
+or shards, for N testsuite runs to execute on different machines, and to
+merge the results of such runs afterwards. The assignment of testcases to
+shards only depends on the testcase names and on an optional set of recorded
+test durations, so it is the same for all the runs provided they are given
+the same inputs.
+"""
+
+import hashlib
+import os
+
+from SUITE.dutils import jdump_to, jload_from
+
+# Name of the file, in the testsuite output dir, where the testsuite driver
+# records data about the tests it ran: the shard specification, if any, and
+# for each test, the test directory, script filename and execution duration.
+# Can be used as a source of durations for later sharded runs.
+
+TESTS_INDEX = "tests.json"
+
+
+def parse_shard(text):
+    """Return the (K, N) pair of integers corresponding to a "K/N" shard
+    specification TEXT, where K is in 1..N. Raise ValueError if TEXT is not
+    a valid specification."""
+
+    try:
+        (k, n) = [int(item) for item in text.split('/')]
+    except ValueError:
+        raise ValueError("invalid shard specification: %s" % text)
+
+    if not 1 <= k <= n:
+        raise ValueError(
+            "shard index out of range in %s, expected 1 to %d" % (text, n))
+    return (k, n)
+
+
+def dump_tests_index(filename, shard, tests):
+    """Dump to FILENAME a tests index for SHARD, a "K/N" string or None,
+    from TESTS, a dictionary of per-test data indexed by test name."""
+    jdump_to(filename, {'shard': shard, 'tests': tests})
+
+
+def load_tests_index(filename):
+    """Load and return the tests index dumped by dump_tests_index in
+    FILENAME."""
+    return jload_from(filename)
+
+
+class ShardAssignment:
+    """Assignment of tests to N shards. Tests with a recorded duration in
+    DURATIONS, a dictionary of durations in seconds indexed by test name, are
+    distributed to balance the total duration of each shard. Other tests are
+    assigned according to a stable hash of their name."""
+
+    def __init__(self, n, durations=None):
+        self.n = n
+
+        # Longest processing time first: assign each test to the least
+        # loaded shard, by decreasing duration. Sort on names as well to get
+        # the same result whatever the order of the DURATIONS items.
+
+        self.assigned = {}
+
+        loads = [0.0] * n
+        for (name, duration) in sorted(
+                (durations or {}).items(),
+                key=lambda (name, duration): (-duration, name)):
+            shard = loads.index(min(loads))
+            loads[shard] += duration
+            self.assigned[name] = shard
+
+    def shard_of(self, name):
+        """Return the index of the shard, in 0..N-1, to which the test named
+        NAME is assigned."""
+
+        if name in self.assigned:
+            return self.assigned[name]
+
+        return int(int(hashlib.md5(name).hexdigest(), 16) % self.n)
+
+
+def durations_from(tests_index):
+    """Return the dictionary of test durations, indexed by test name, from
+    the TESTS_INDEX data."""
+    return {name: data['duration']
+            for (name, data) in tests_index['tests'].items()
+            if data.get('duration') is not None}
+
+
+def tests_index_in(dirname):
+    """Name of the tests index file in testsuite output directory
+    DIRNAME."""
+    return os.path.join(dirname, TESTS_INDEX)
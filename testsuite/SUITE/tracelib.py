@@ -7,6 +7,7 @@ import binascii
 import datetime
 import os
 from struct import Struct
+import zlib
 
 
 class Enum(object):
@@ -192,6 +193,174 @@ def unpack_from_file(fp, struct):
     return struct.unpack(buf)
 
 
+class Compression(object):
+    """
+    Compression formats for trace files.
+    """
+    Gzip = 'gzip'
+    Zlib = 'zlib'
+
+    ALL = (Gzip, Zlib)
+
+    WBITS = {
+        Gzip: 16 + zlib.MAX_WBITS,
+        Zlib: zlib.MAX_WBITS,
+    }
+    """
+    Window bits argument for the zlib functions, selecting the stream format.
+    """
+
+    @staticmethod
+    def detect(head):
+        """
+        Return the compression format for a file starting with the `head`
+        bytes (at least 2), or None for a raw trace file.
+        """
+        if head[:2] == '\x1f\x8b':
+            return Compression.Gzip
+
+        # zlib streams start with a CMF byte for the deflate method (8) and a
+        # FLG byte making CMF * 256 + FLG a multiple of 31. The first bytes of
+        # TRACE_MAGIC don't match this.
+        if (
+            len(head) >= 2 and
+            ord(head[0]) & 0x0f == 8 and
+            (ord(head[0]) * 256 + ord(head[1])) % 31 == 0
+        ):
+            return Compression.Zlib
+
+        return None
+
+
+class TraceReader(object):
+    """
+    Buffered reader for trace files, decompressing them on the fly if needed.
+
+    Data is pulled from the underlying file by chunks, so that compressed
+    traces never need to be expanded as a whole, neither in memory nor on
+    disk.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, fp):
+        """
+        :param file fp: File to read from, opened in binary mode. It does not
+            need to be seekable.
+        """
+        self.fp = fp
+
+        # Buffer of decoded bytes, and offset of the next byte to read in it
+        self.buf = fp.read(2)
+        self.pos = 0
+
+        self.compression = Compression.detect(self.buf)
+        self.decompressor = None
+        if self.compression:
+            self.decompressor = zlib.decompressobj(
+                Compression.WBITS[self.compression])
+            self.buf = self.decompressor.decompress(self.buf)
+
+        self.eof = False
+
+    @classmethod
+    def wrap(cls, fp):
+        """
+        Return `fp` if it is already a TraceReader, or a TraceReader for it.
+        """
+        return fp if isinstance(fp, cls) else cls(fp)
+
+    def _fill(self):
+        """
+        Decode the next chunk from the underlying file and append it to the
+        buffer. Return False at end of file.
+        """
+        chunk = self.fp.read(self.CHUNK_SIZE)
+        if not self.decompressor:
+            data = chunk
+
+        elif chunk:
+            data = self.decompressor.decompress(chunk)
+
+            # Concatenated gzip members are valid gzip files: restart
+            # decompression on what follows the end of a member.
+            while self.decompressor.unused_data:
+                rest = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(
+                    Compression.WBITS[self.compression])
+                data += self.decompressor.decompress(rest)
+
+        else:
+            data = self.decompressor.flush()
+
+        if not chunk and not data:
+            self.eof = True
+            return False
+
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def read(self, size=-1):
+        """
+        Read and return at most `size` decoded bytes, or all the remaining
+        ones if `size` is negative. Return an empty string at end of file.
+        """
+        if size < 0:
+            while self._fill():
+                pass
+        else:
+            while len(self.buf) - self.pos < size and not self.eof:
+                self._fill()
+
+        end = len(self.buf) if size < 0 else self.pos + size
+        result = self.buf[self.pos:end]
+        self.pos += len(result)
+        return result
+
+
+class TraceWriter(object):
+    """
+    Writer for trace files, compressing data on the fly.
+    """
+
+    def __init__(self, fp, compression, level=6):
+        """
+        :param file fp: File to write to, opened in binary mode.
+        :param str compression: Compression format, see Compression.
+        :param int level: Compression level, from 1 (fastest) to 9 (best).
+        """
+        self.fp = fp
+        self.compressor = zlib.compressobj(
+            level, zlib.DEFLATED, Compression.WBITS[compression])
+        self.pending = []
+        self.pending_size = 0
+
+    def write(self, data):
+        """
+        Compress `data` and write the result to the underlying file.
+
+        Trace entries come as many small writes, so data is accumulated and
+        compressed by chunks of about TraceReader.CHUNK_SIZE bytes.
+        """
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= TraceReader.CHUNK_SIZE:
+            self._compress_pending()
+
+    def _compress_pending(self):
+        self.fp.write(self.compressor.compress(''.join(self.pending)))
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self):
+        """
+        Flush the compressed stream. This does not close the underlying file.
+        """
+        self._compress_pending()
+        self.fp.write(self.compressor.flush())
+
+
 class TraceFile(object):
     """
     In-memory representation of a trace file.
@@ -238,34 +407,52 @@ class TraceFile(object):
     def read(cls, fp):
         """
         Read a trace file from the `fp` file. Return a TraceFile instance.
-        """
-        first_header = unpack_from_file(fp, TraceHeaderStruct)
-        infos = TraceInfoList.read(fp)
 
-        second_header = unpack_from_file(fp, TraceHeaderStruct)
-        bits = cls.bits(first_header)
-
-        entries = []
-        while True:
-            entry = TraceEntry.read(fp, bits)
-            if not entry:
-                break
-            entries.append(entry)
+        Compressed trace files are detected and decompressed on the fly.
+        """
+        stream = TraceStream(fp)
+        return cls(stream.first_header, stream.infos, stream.second_header,
+                   list(stream.entries()))
 
-        return cls(first_header, infos, second_header, entries)
+    @classmethod
+    def load(cls, filename):
+        """
+        Read a trace file from the `filename` file. Return a TraceFile
+        instance.
+        """
+        with open(filename, 'rb') as fp:
+            return cls.read(fp)
 
-    def write(self, fp):
+    def write(self, fp, compression=None):
         """
         Write this trace file to the `fp` file.
+
+        :param None|str compression: If not None, compression format for the
+            output. See Compression.
         """
         assert self.bits
 
+        if compression:
+            writer = TraceWriter(fp, compression)
+            self.write(writer)
+            writer.close()
+            return
+
         fp.write(TraceHeaderStruct.pack(*self.first_header))
         self.infos.write(fp)
         fp.write(TraceHeaderStruct.pack(*self.second_header))
         for entry in self.entries:
             entry.write(fp)
 
+    def save(self, filename, compression=None):
+        """
+        Write this trace file to the `filename` file.
+
+        :param None|str compression: See the write method.
+        """
+        with open(filename, 'wb') as fp:
+            self.write(fp, compression)
+
     def iter_entries(self, raw=False):
         """
         Yield all trace entries in this trace file.
@@ -302,6 +489,35 @@ class TraceFile(object):
             yield TraceEntry(e.bits, e.pc - offset, e.size, e.op, e.infos)
 
 
+class TraceStream(object):
+    """
+    Sequential access to a trace file, for traces too large to be loaded as
+    a whole. Headers and trace info are read upfront, and entries are decoded
+    as they are iterated over.
+    """
+
+    def __init__(self, fp):
+        """
+        :param file fp: File from which to read the trace, raw or compressed.
+        """
+        self.fp = TraceReader.wrap(fp)
+
+        self.first_header = unpack_from_file(self.fp, TraceHeaderStruct)
+        self.infos = TraceInfoList.read(self.fp)
+        self.second_header = unpack_from_file(self.fp, TraceHeaderStruct)
+        self.bits = TraceFile.bits(self.first_header)
+
+    def entries(self):
+        """
+        Yield the trace entries remaining in the trace file.
+        """
+        while True:
+            entry = TraceEntry.read(self.fp, self.bits)
+            if not entry:
+                break
+            yield entry
+
+
 class TraceInfo(object):
     """
     In-memory representation for a trace info entry.
@@ -498,3 +714,52 @@ def create_exec_infos(filename, code_size=None):
         infos.append(TraceInfo(InfoKind.ExecCodeSize, ' ' + str(code_size)))
 
     return TraceInfoList({info.kind: info for info in infos})
+
+
+def benchmark(trace, repeat=3):
+    """
+    Measure the throughput of reading and writing the `trace` TraceFile in
+    memory, raw and with each compression format. Return a list of (format,
+    size in bytes, write MB/s, read MB/s) tuples, the throughputs being
+    relative to the size of the raw trace.
+    """
+    from cStringIO import StringIO
+    import time
+
+    def best_time(fn):
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            fn()
+            times.append(time.time() - start)
+        return max(min(times), 1e-6)
+
+    raw_size = None
+    results = []
+    for compression in (None, ) + Compression.ALL:
+        out = StringIO()
+        trace.write(out, compression)
+        data = out.getvalue()
+        if raw_size is None:
+            raw_size = len(data)
+
+        write_time = best_time(lambda: trace.write(StringIO(), compression))
+        read_time = best_time(lambda: TraceFile.read(StringIO(data)))
+
+        results.append((compression or 'raw', len(data),
+                        raw_size / write_time / 1e6,
+                        raw_size / read_time / 1e6))
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+
+    for filename in sys.argv[1:]:
+        print('{}:'.format(filename))
+        for fmt, size, write_mbps, read_mbps in benchmark(
+            TraceFile.load(filename)
+        ):
+            print('  {:<5} {:>12} bytes  write {:8.1f} MB/s'
+                  '  read {:8.1f} MB/s'.format(fmt, size, write_mbps,
+                                               read_mbps))
@@ -8,7 +8,9 @@
 
 # ***************************************************************************
 
+import hashlib
 import os
+import re
 import time
 
 
@@ -22,9 +24,10 @@ from SUITE.context import ROOT_DIR, thistest
 
 # Then mind our own buisness
 
-from SUITE.cutils import FatalError, contents_of, text_to_file, to_list
+from SUITE.cutils import (FatalError, contents_of, no_ext, text_to_file,
+                          to_list)
 from gnatpython.ex import Run
-from gnatpython.fileutils import touch, unixpath, which
+from gnatpython.fileutils import rm, touch, unixpath, which
 
 
 # Precompute some values we might be using repeatedly
@@ -37,6 +40,11 @@ VALGRIND = 'valgrind' + env.host.os.exeext
 MEMCHECK_LOG = 'memcheck.log'
 CALLGRIND_LOG = 'callgrind-{}.log'
 
+# Name of the file where incremental builds record what the last successful
+# build of a project was about, parameterized by the project name
+
+GPRBUILD_STAMP = 'gprbuild-%s.stamp'
+
 
 run_processes = []
 """
@@ -174,16 +182,137 @@ def gprbuild(project,
                                     suitecargs=suitecargs,
                                     thiscargs=extracargs)
 
+    args = (to_list(BUILDER.BASE_COMMAND) +
+            ['-P%s' % project] + all_gargs + all_cargs + all_largs)
+
+    # In incremental mode, skip the build altogether if the last one was
+    # performed with the same command line on the same sources. Qualification
+    # runs always perform clean builds.
+
+    incremental = (thistest.options.incremental_builds
+                   and not thistest.options.qualif_level)
+
+    if incremental:
+        stamp_file = GPRBUILD_STAMP % no_ext(os.path.basename(project))
+        stamp = gprbuild_stamp_for(project, args)
+        if (os.path.exists(stamp_file)
+                and contents_of(stamp_file) == stamp
+                and all(os.path.exists(f)
+                        for f in gprbuild_outputs_for(project))):
+            thistest.cleanup(project, gprclean=False)
+            return
+
+        # Not up to date. Make sure a failing build won't leave a stale
+        # stamp around.
+        rm(stamp_file)
+
     # Now cleanup, do build and check status
     thistest.cleanup(project)
 
     ofile = "gprbuild.out"
-    args = (to_list(BUILDER.BASE_COMMAND) +
-            ['-P%s' % project] + all_gargs + all_cargs + all_largs)
     p = run_and_log(args, output=ofile, timeout=thistest.options.timeout)
     thistest.stop_if(p.status != 0,
                      FatalError("gprbuild exit in error", ofile))
 
+    if incremental:
+        text_to_file(text=stamp, filename=stamp_file)
+
+
+def gpr_files_for(project, visited=None):
+    """
+    Return the list of files involved in the build of PROJECT: the project
+    files of the closure of PROJECT and the source files in their source dirs,
+    as recognized by language_info. The project files are analyzed with simple
+    pattern matching, which is enough for the projects we generate and may
+    only overestimate the set of files otherwise.
+    """
+    visited = set() if visited is None else visited
+
+    if not project.endswith('.gpr'):
+        project += '.gpr'
+    project = os.path.abspath(project)
+    if project in visited or not os.path.exists(project):
+        return []
+    visited.add(project)
+
+    prjdir = os.path.dirname(project)
+    text = contents_of(project)
+    files = [project]
+
+    # Projects we depend on or extend
+
+    for dep in re.findall(r'(?:with|extends)\s+(?:all\s+)?"([^"]+)"', text,
+                          flags=re.IGNORECASE):
+        files.extend(gpr_files_for(os.path.join(prjdir, dep), visited))
+
+    # Our own source dirs, the project dir by default. A trailing "/**"
+    # requests the whole subtree.
+
+    m = re.search(r'for\s+Source_Dirs\s+use\s*\(([^)]*)\)', text,
+                  flags=re.IGNORECASE)
+    srcdirs = re.findall(r'"([^"]*)"', m.group(1)) if m else ['.']
+
+    for srcdir in srcdirs:
+        recursive = srcdir.endswith('**')
+        srcdir = os.path.join(prjdir, srcdir.rstrip('*').rstrip('/') or '.')
+        if not os.path.isdir(srcdir):
+            continue
+
+        if recursive:
+            candidates = [os.path.join(root, f)
+                          for (root, _, fnames) in os.walk(srcdir)
+                          for f in fnames]
+        else:
+            candidates = [os.path.join(srcdir, f)
+                          for f in os.listdir(srcdir)
+                          if os.path.isfile(os.path.join(srcdir, f))]
+
+        files.extend(f for f in candidates if language_info(f))
+    return files
+
+
+def gprbuild_outputs_for(project):
+    """
+    Return the list of build outputs of PROJECT we expect to find after a
+    successful build: its object directory and the executables for its mains.
+    As for gpr_files_for, this relies on simple pattern matching on the
+    project file, which is enough for the projects we generate.
+    """
+    if not project.endswith('.gpr'):
+        project += '.gpr'
+    prjdir = os.path.dirname(os.path.abspath(project))
+    text = contents_of(project)
+
+    def attribute(name):
+        m = re.search(r'for\s+%s\s+use\s*"([^"]*)"' % name, text,
+                      flags=re.IGNORECASE)
+        return os.path.join(prjdir, m.group(1)) if m else None
+
+    objdir = attribute('Object_Dir') or prjdir
+    exedir = attribute('Exec_Dir') or objdir
+
+    m = re.search(r'for\s+Main\s+use\s*\(([^)]*)\)', text,
+                  flags=re.IGNORECASE)
+    mains = re.findall(r'"([^"]*)"', m.group(1)) if m else []
+
+    return [objdir] + [os.path.join(exedir, exename_for(no_ext(main)))
+                       for main in mains]
+
+
+def gprbuild_stamp_for(project, args):
+    """
+    Compute the stamp of a build of PROJECT with the gprbuild command line
+    ARGS, to be recorded in its GPRBUILD_STAMP. This accounts for the command
+    line itself, which includes the cargs and largs, and for the contents of
+    all the files involved in the build.
+    """
+    digest = hashlib.md5()
+    for f in sorted(set(gpr_files_for(project))):
+        with open(f, 'rb') as fd:
+            digest.update('%s %s\n' % (f, hashlib.md5(fd.read()).hexdigest()))
+
+    return '%s\nsources: %s\n' % (' '.join(args), digest.hexdigest())
+
 
 def gprinstall(project, prefix=None):
     """
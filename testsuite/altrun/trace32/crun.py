@@ -10,7 +10,7 @@
 # use for your target configuration. Simplest is to error out on unrecognized
 # options.
 
-import t32api
+import t32session
 import sys
 import optparse
 import os
@@ -241,6 +241,41 @@ class Runner:
             print "unknown target %s" % self.options.target
             return
 
+        # Use the persistent session started by pre_testsuite.py if there is
+        # one. Connect and setup the board ourselves otherwise.
+
+        if t32session.session_available():
+            self.run_with_session()
+        else:
+            self.run_standalone()
+
+        print "=================================================="
+
+    def run_with_session(self):
+        log("Using persistent Trace32 session")
+
+        client = t32session.SessionClient()
+        try:
+            reply = client.request(
+                'run',
+                executable=os.path.abspath(self.get_executable_filename()),
+                trace=os.path.abspath(self.get_t32_trace_filename()),
+                target=self.options.target,
+                timeout=500)
+        except t32session.SessionError as e:
+            log("session request failed: %s" % e)
+            sys.exit(1)
+        finally:
+            client.close()
+
+        sys.stdout.write(reply['output'])
+
+        if reply['exception_raised']:
+            print "!!! EXCEPTION RAISED !!!"
+
+    def run_standalone(self):
+        import t32api
+
         t32api.connect()
         t32api.basic_setup()
 
@@ -255,8 +290,6 @@ class Runner:
         if t32api.CPU_stopped_at_symbol("__gnat_last_chance_handler"):
             print "!!! EXCEPTION RAISED !!!"
 
-        print "=================================================="
-
     def run_gnatcov_convert(self):
         print "============== GNATCOV CONVERT ==================="
         do("gnatcov convert " + " ".join(self.convert_command_line()))
@@ -2,5 +2,10 @@
 # running.
 
 from t32api import kill_trace32
+from t32session import stop_session
 
+# Stop the persistent session server first, so that it releases its
+# connection to Trace32.
+
+stop_session()
 kill_trace32()
@@ -5,6 +5,7 @@ import gnatpython.ex
 from gnatpython.env import putenv
 from time import sleep
 from t32api import PATH_TO_T32_HOME, PATH_TO_T32
+import t32session
 
 # ---------
 # -- log --
@@ -39,3 +40,18 @@ p = gnatpython.ex.Run([PATH_TO_T32,
                       bg=True)
 
 sleep(2)
+
+# Start the persistent session server, which connects to Trace32 and sets up
+# the board once for all the testcases. crun falls back to a connection of its
+# own if the server doesn't come up.
+
+p = gnatpython.ex.Run([sys.executable,
+                       os.path.join(altrun_dir_path, 't32session.py'),
+                       'serve',
+                       '--port-file=%s' % t32session.PORT_FILE
+                       ],
+                      output="t32session.out",
+                      bg=True)
+
+if not t32session.wait_for_session():
+    log("Trace32 session server didn't start, see t32session.out")
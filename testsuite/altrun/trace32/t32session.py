@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+# Persistent Trace32 session, shared by the crun invocations of a testsuite
+# run.
+#
+# Connecting to Trace32 PowerView and initializing the board (basic_setup,
+# trace initialization for the target) is done once, by a session server
+# started from pre_testsuite.py and stopped from post_testsuite.py. Each crun
+# invocation then only sends a "run" request to the server over a local TCP
+# socket, to load the executable, run it and export the trace.
+#
+# The protocol is a sequence of JSON objects, one per line. Each request is an
+# object with an "op" key:
+#
+#   {"op": "ping"}
+#   {"op": "run", "executable": <path>, "trace": <path>, "target": <name>,
+#    "timeout": <seconds>}
+#   {"op": "shutdown"}
+#
+# to which the server replies with an object with a "status" key ("ok" or
+# "error"), an "output" key holding what the Trace32 operations printed, plus
+# an "exception_raised" boolean for "run" requests and a "message" string for
+# errors.
+#
+# The server listens on an ephemeral port of the loopback interface, which it
+# writes to a "port file" once it is ready to accept requests.
+#
+# For local testing of the protocol, "serve --stand-in" runs the server on top
+# of a stand-in for the t32api module, which emulates the t32api responses
+# without any Trace32 installation or board.
+
+import SocketServer
+import StringIO
+import json
+import optparse
+import os
+import socket
+import sys
+import time
+
+altrun_dir_path = os.path.dirname(os.path.realpath(__file__))
+
+# Default location of the port file, known to the pre/post testsuite hooks
+# and to crun.
+
+PORT_FILE = os.path.join(altrun_dir_path, "t32session.port")
+
+# Targets for which we know how to initialize the trace
+
+TRACE_INIT_FOR = {
+    'trace32-stm32f7': 'init_trace_stm32f7'
+    }
+
+
+# ---------
+# -- log --
+# ---------
+def log(str):
+    print "trace32/t32session.py:" + str
+
+
+# =====================
+# == Stand-in t32api ==
+# =====================
+
+class StandInT32:
+    """Emulation of the t32api module functions we use, for testing
+    purposes. Keeps track of the sequence of calls it gets in CALLS and
+    produces empty trace files on export."""
+
+    def __init__(self):
+        self.calls = []
+        self.connected = False
+        self.stopped_at = None
+
+    def connect(self, node="localhost", port=20000, packlen=1024):
+        self.calls.append(('connect',))
+        print('Successfully established a remote connection with' +
+              ' TRACE32 PowerView.')
+        self.connected = True
+
+    def basic_setup(self):
+        assert self.connected
+        self.calls.append(('basic_setup',))
+
+    def init_trace_stm32f7(self):
+        assert self.connected
+        self.calls.append(('init_trace_stm32f7',))
+
+    def load_executable(self, path):
+        assert self.connected
+        if not os.path.isfile(path):
+            raise IOError("no such executable: %s" % path)
+        self.calls.append(('load_executable', path))
+        self.stopped_at = None
+
+    def set_breakpoint(self, symbol):
+        self.calls.append(('set_breakpoint', symbol))
+
+    def run_until(self, symbol, timeout_sec):
+        self.calls.append(('run_until', symbol, timeout_sec))
+        print "CPU current state:stopped"
+        self.stopped_at = symbol
+
+    def export_trace(self, path):
+        self.calls.append(('export_trace', path))
+        open(path, 'w').close()
+
+    def CPU_stopped_at_symbol(self, symbol):
+        return self.stopped_at == symbol
+
+
+# ===========================
+# == Session server engine ==
+# ===========================
+
+class Session:
+    """State of the connection to Trace32 on behalf of the server. API is
+    either the t32api module or a StandInT32 instance."""
+
+    def __init__(self, api):
+        self.api = api
+
+        # Whether the connection and basic board setup are done, and the set
+        # of targets for which the trace initialization was done. We redo the
+        # whole setup after any failure, as we can't tell in which state the
+        # board was left.
+
+        self.ready = False
+        self.traced_targets = set()
+
+    def setup_for(self, target):
+        if not self.ready:
+            self.api.connect()
+            self.api.basic_setup()
+            self.traced_targets = set()
+            self.ready = True
+
+        if target not in self.traced_targets:
+            getattr(self.api, TRACE_INIT_FOR[target])()
+            self.traced_targets.add(target)
+
+    def run(self, executable, trace, target, timeout):
+        """Run EXECUTABLE on the board for TARGET and export the branch
+        flow trace to TRACE. Return whether an exception was raised."""
+
+        self.setup_for(target)
+
+        self.api.load_executable(executable)
+        self.api.set_breakpoint("__gnat_last_chance_handler")
+        self.api.run_until("_exit", timeout_sec=timeout)
+        self.api.export_trace(trace)
+
+        return self.api.CPU_stopped_at_symbol("__gnat_last_chance_handler")
+
+    def process(self, request):
+        """Process one REQUEST, as decoded from the protocol, and return
+        the corresponding reply."""
+
+        op = request.get('op')
+
+        if op == 'ping':
+            return {'status': 'ok'}
+
+        elif op == 'shutdown':
+            return {'status': 'ok'}
+
+        elif op == 'run':
+            if request['target'] not in TRACE_INIT_FOR:
+                return {'status': 'error',
+                        'message': "unknown target %s" % request['target']}
+            return {
+                'status': 'ok',
+                'exception_raised': bool(self.run(
+                    executable=request['executable'],
+                    trace=request['trace'],
+                    target=request['target'],
+                    timeout=request.get('timeout', 500)))}
+
+        else:
+            return {'status': 'error', 'message': "unknown op %s" % op}
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            request = json.loads(line)
+
+            # Capture what the Trace32 operations print, to let crun display
+            # it as if it had performed the operations itself.
+
+            output = StringIO.StringIO()
+            sys.stdout = output
+            try:
+                reply = self.server.session.process(request)
+            except (Exception, SystemExit) as e:
+                self.server.session.ready = False
+                reply = {'status': 'error',
+                         'message': "%s: %s" % (e.__class__.__name__, e)}
+            finally:
+                sys.stdout = sys.__stdout__
+
+            reply['output'] = output.getvalue()
+            sys.stdout.write(reply['output'])
+            sys.stdout.flush()
+
+            self.wfile.write(json.dumps(reply) + '\n')
+            self.wfile.flush()
+
+            if request.get('op') == 'shutdown':
+                self.server.shutdown_requested = True
+                return
+
+
+class SessionServer(SocketServer.TCPServer):
+
+    # Requests are processed one at a time, which also serializes accesses
+    # to the board from concurrent testcases.
+
+    allow_reuse_address = True
+
+    def __init__(self, session, port=0):
+        SocketServer.TCPServer.__init__(
+            self, ('127.0.0.1', port), RequestHandler)
+        self.session = session
+        self.shutdown_requested = False
+
+    def serve_until_shutdown(self):
+        while not self.shutdown_requested:
+            self.handle_request()
+        self.server_close()
+
+
+def serve(port_file, stand_in=False):
+    """Run a session server, advertising its port in PORT_FILE until
+    a shutdown request is received."""
+
+    if stand_in:
+        api = StandInT32()
+    else:
+        import t32api
+        api = t32api
+
+    server = SessionServer(Session(api))
+
+    # Write the port file atomically, so clients never see a partial one
+
+    tmp_port_file = port_file + '.tmp'
+    with open(tmp_port_file, 'w') as f:
+        f.write("%d\n" % server.server_address[1])
+    os.rename(tmp_port_file, port_file)
+
+    log("serving on port %d" % server.server_address[1])
+    try:
+        server.serve_until_shutdown()
+    finally:
+        if os.path.exists(port_file):
+            os.remove(port_file)
+    log("shutdown")
+
+
+# ============
+# == Client ==
+# ============
+
+class SessionError(Exception):
+    pass
+
+
+class SessionClient:
+    """Client side of the protocol, connected to the server advertised in
+    PORT_FILE."""
+
+    def __init__(self, port_file=PORT_FILE):
+        with open(port_file) as f:
+            port = int(f.read().strip())
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.rfile = self.sock.makefile('r')
+
+    def request(self, op, **args):
+        """Send an OP request with ARGS and return the reply. Raise
+        SessionError if the server reports a failure."""
+
+        args['op'] = op
+        self.sock.sendall(json.dumps(args) + '\n')
+
+        line = self.rfile.readline()
+        if not line:
+            raise SessionError("connection closed by the session server")
+
+        reply = json.loads(line)
+        if reply['status'] != 'ok':
+            raise SessionError(reply.get('message', 'unknown error'))
+        return reply
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def session_available(port_file=PORT_FILE):
+    """Whether a session server is advertised in PORT_FILE and answers
+    requests."""
+
+    if not os.path.exists(port_file):
+        return False
+    try:
+        client = SessionClient(port_file)
+        try:
+            client.request('ping')
+        finally:
+            client.close()
+    except (socket.error, ValueError, SessionError):
+        return False
+    return True
+
+
+def wait_for_session(port_file=PORT_FILE, timeout_sec=30):
+    """Wait for a session server to be available in PORT_FILE, for at
+    most TIMEOUT_SEC seconds. Return whether it is."""
+
+    deadline = time.time() + timeout_sec
+    while time.time() < deadline:
+        if session_available(port_file):
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def stop_session(port_file=PORT_FILE):
+    """Request the session server advertised in PORT_FILE, if any, to
+    shut down."""
+
+    if not os.path.exists(port_file):
+        return
+    try:
+        client = SessionClient(port_file)
+        try:
+            client.request('shutdown')
+        finally:
+            client.close()
+    except (socket.error, ValueError, SessionError) as e:
+        log("unable to stop session server: %s" % e)
+
+
+# ======================
+# == main entry point ==
+# ======================
+
+if __name__ == "__main__":
+
+    op = optparse.OptionParser(usage="%prog [options] serve|ping|stop")
+
+    op.add_option(
+        "--port-file", dest="port_file", default=PORT_FILE,
+        help="File where the session server advertises its port.")
+    op.add_option(
+        "--stand-in", dest="stand_in", default=False, action='store_true',
+        help="Serve with a stand-in emulating the t32api responses.")
+
+    (options, args) = op.parse_args()
+
+    if len(args) != 1:
+        op.error("expected exactly one command")
+
+    if args[0] == 'serve':
+        serve(port_file=options.port_file, stand_in=options.stand_in)
+    elif args[0] == 'ping':
+        sys.exit(0 if session_available(options.port_file) else 1)
+    elif args[0] == 'stop':
+        stop_session(options.port_file)
+    else:
+        op.error("unknown command %s" % args[0])
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+# ***************************************************************************
+# ***                 COUVERTURE TESTSUITE SHARDS MERGER                  ***
+# ***************************************************************************
+
+"""./merge_shards.py [OPTIONS] SHARD_ROOT...
+
+Merge the results of testsuite runs performed with --shard=K/N, each from
+the testsuite directory SHARD_ROOT of a separate copy of the testsuite tree,
+into the testsuite directory of another copy, possibly one of the SHARD_ROOTs.
+
+The merged tree looks as if it came from a single run: the output directory
+holds the results, comments, failed test outputs and rep_gnatcov report for
+all the tests, and the test directories hold the testcase outputs and
+qualification data dumps. The context data of all the runs is checked for
+consistency beforehand.
+
+Shards may be run locally as separate processes, each from its own copy of
+the testsuite tree, for example:
+
+  for k in 1 2 3; do
+    cp -r testsuite shard$k
+    (cd shard$k && ./testsuite.py --shard=$k/3 ... &)
+  done
+  ...
+  cd testsuite && ./merge_shards.py ../shard1 ../shard2 ../shard3
+"""
+
+# ***************************************************************************
+
+from gnatpython.fileutils import mkdir, cp
+
+import json
+import optparse
+import os
+import sys
+
+from SUITE.cutils import contents_of, exit_if
+from SUITE.dutils import jdump_to, jload_from
+from SUITE.qdata import CTXDATA_FILE, QSTRBOX_DIR
+from SUITE.qdata import QUALDATA_FILE, STATUSDATA_FILE
+
+import SUITE.resultsdb as resultsdb
+import SUITE.shards as shards
+
+# Name of the output directory in a testsuite dir, as for testsuite.py
+
+OUTPUT_DIR = 'output'
+
+# Files in output dirs which must be identical for all the shards
+
+SHARED_LOGS = ('discs', )
+
+# Files in test dirs to merge, besides the test.py.out/log/err outputs
+
+TEST_DUMPS = (QUALDATA_FILE, STATUSDATA_FILE, 'ctx.dump')
+
+
+class Shard:
+    """Results of a sharded testsuite run in testsuite dir ROOT."""
+
+    def __init__(self, root):
+        self.root = root
+        self.output_dir = os.path.join(root, OUTPUT_DIR)
+
+        index_file = shards.tests_index_in(self.output_dir)
+        exit_if(
+            not os.path.exists(index_file),
+            "%s: no %s, not a testsuite run output" % (root, index_file))
+
+        self.index = shards.load_tests_index(index_file)
+
+        exit_if(
+            not self.index['shard'],
+            "%s: not a sharded testsuite run" % root)
+
+        (self.k, self.n) = shards.parse_shard(self.index['shard'])
+
+        # The results this shard recorded in its results database, from the
+        # last run there
+
+        db_file = resultsdb.results_db_in(self.output_dir)
+        exit_if(
+            not os.path.exists(db_file),
+            "%s: no %s, not a testsuite run output" % (root, db_file))
+
+        db = resultsdb.ResultsDB(db_file)
+        self.run = dict(db.run_info(db.latest_run()))
+        self.results = db.run_results(self.run['id'])
+        db.close()
+
+        self.ctxdata = (
+            jload_from(os.path.join(root, CTXDATA_FILE))
+            if os.path.exists(os.path.join(root, CTXDATA_FILE)) else None)
+
+    def log_lines(self, filename):
+        """Lines of the GAIA log FILENAME in our output dir."""
+        path = os.path.join(self.output_dir, filename)
+        return (contents_of(path).splitlines()
+                if os.path.exists(path) else [])
+
+
+# ========================
+# == Consistency checks ==
+# ========================
+
+# Context data items which must match across shards, for tests results to be
+# comparable. The run stamp and command line are expected to differ.
+
+CTXDATA_CHECKS = (
+    ('tree reference', lambda ctx: ctx['treeref']),
+    ('host', lambda ctx: ctx['host']),
+    ('options', lambda ctx: ctx['options']),
+    ('gnatpro version', lambda ctx: ctx['gnatpro']['version']),
+    ('gnatemu version', lambda ctx: ctx['gnatemu']['version']),
+    ('gnatcov version', lambda ctx: ctx['gnatcov']['version']),
+    ('other tool', lambda ctx: ctx['other']))
+
+
+def consistency_errors(shard_list):
+    """Return a list of messages documenting inconsistencies between the
+    sharded runs in SHARD_LIST, empty if there are none."""
+
+    errors = []
+    ref = shard_list[0]
+
+    for shard in shard_list[1:]:
+
+        if shard.n != ref.n:
+            errors.append(
+                '  * %s: %d shards (expected %d)'
+                % (shard.root, shard.n, ref.n))
+
+        for filename in SHARED_LOGS:
+            if shard.log_lines(filename) != ref.log_lines(filename):
+                errors.append(
+                    '  * %s: %s mismatch' % (shard.root, filename))
+
+        if (shard.ctxdata is None) != (ref.ctxdata is None):
+            errors.append(
+                '  * %s: context data presence mismatch' % shard.root)
+            continue
+
+        if shard.ctxdata is None:
+            continue
+
+        for (what, item) in CTXDATA_CHECKS:
+            (new, expected) = (item(shard.ctxdata), item(ref.ctxdata))
+            if new != expected:
+                errors.append(
+                    '  * %s: %s mismatch: "%s" (expected "%s")'
+                    % (shard.root, what, new, expected))
+
+    # Each shard must show up once
+
+    ks = sorted(shard.k for shard in shard_list)
+    if len(set(ks)) != len(ks):
+        errors.append('  * shards provided more than once: %s' % ks)
+
+    return errors
+
+
+# ===========
+# == Merge ==
+# ===========
+
+def copy_if_distinct(src, dst):
+    """Copy SRC to DST, unless they are the same file."""
+
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    mkdir(os.path.dirname(dst))
+    cp(src, dst)
+
+
+def merge_into(root, shard_list, old_res):
+    """Merge the results of the runs in SHARD_LIST into testsuite dir
+    ROOT. OLD_RES is the optional reference results file for rep_gnatcov."""
+
+    output_dir = os.path.join(root, OUTPUT_DIR)
+
+    # Fetch all the contents to merge before writing anything, as the
+    # destination might be one of the shards.
+
+    logs = {
+        filename: [line for shard in shard_list
+                   for line in shard.log_lines(filename)]
+        for filename in ('results', 'comment', 'altrun')}
+
+    logs.update({
+        filename: shard_list[0].log_lines(filename)
+        for filename in SHARED_LOGS})
+
+    tests = {}
+    for shard in shard_list:
+        for (name, data) in shard.index['tests'].items():
+            exit_if(name in tests,
+                    "%s: test %s also ran in another shard"
+                    % (shard.root, name))
+            tests[name] = data
+
+    # Per test outputs, in the test directories and in the output dir for
+    # failed tests
+
+    mkdir(output_dir)
+
+    for shard in shard_list:
+        for (name, data) in shard.index['tests'].items():
+            (srcdir, dstdir) = [
+                os.path.join(base, data['dir']) for base in (shard.root, root)]
+
+            for f in ([data['filename'] + ext
+                       for ext in ('.out', '.log', '.err')]
+                      + list(TEST_DUMPS)):
+                if os.path.exists(os.path.join(srcdir, f)):
+                    copy_if_distinct(
+                        os.path.join(srcdir, f), os.path.join(dstdir, f))
+
+            outfile = name + '.out'
+            if os.path.exists(os.path.join(shard.output_dir, outfile)):
+                copy_if_distinct(
+                    os.path.join(shard.output_dir, outfile),
+                    os.path.join(output_dir, outfile))
+
+    # GAIA logs, the tests index and context data, then the final report
+
+    for (filename, lines) in logs.items():
+        with open(os.path.join(output_dir, filename), 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+    shards.dump_tests_index(
+        shards.tests_index_in(output_dir), shard=None, tests=tests)
+
+    ctxdata = shard_list[0].ctxdata
+    if ctxdata is not None:
+        mkdir(os.path.join(root, QSTRBOX_DIR))
+        jdump_to(os.path.join(root, CTXDATA_FILE), ctxdata)
+
+    # Record the merged results as a run of their own in the results
+    # database, then produce the report from there
+
+    ref_run = shard_list[0].run
+
+    db = resultsdb.ResultsDB(resultsdb.results_db_in(output_dir))
+    run = db.start_run(
+        discriminants=(ref_run['discriminants'] or '').split(),
+        context=(json.loads(ref_run['context'])
+                 if ref_run['context'] else None),
+        cmdline=" ".join(sys.argv))
+
+    for shard in shard_list:
+        db.add_results(run, shard.results)
+
+    if old_res:
+        db.attach_baseline(old_res)
+    db.write_report(os.path.join(root, 'rep_gnatcov'), run)
+    db.close()
+
+    return tests
+
+
+# ======================
+# == main entry point ==
+# ======================
+
+if __name__ == "__main__":
+
+    op = optparse.OptionParser(usage=__doc__.split('\n')[0])
+
+    op.add_option(
+        "--root", dest="root", default=".",
+        help="Testsuite dir where the results are merged.")
+    op.add_option(
+        "--old-res", dest="old_res", default=None,
+        help="Old results to compare against, as for testsuite.py")
+    op.add_option(
+        "--force", dest="force", default=False, action="store_true",
+        help="Merge even if the shard runs are inconsistent.")
+
+    (options, args) = op.parse_args()
+
+    if not args:
+        op.error("no shard to merge")
+
+    shard_list = sorted(
+        [Shard(os.path.abspath(root)) for root in args],
+        key=lambda shard: shard.k)
+
+    errors = consistency_errors(shard_list)
+    if errors:
+        print '\n'.join(["Inconsistent shard runs:"] + errors)
+        exit_if(not options.force, "Use --force to merge nevertheless")
+
+    missing = sorted(
+        set(range(1, shard_list[0].n + 1))
+        - set(shard.k for shard in shard_list))
+    if missing:
+        print "Warning: missing shards %s" % ", ".join(
+            "%d/%d" % (k, shard_list[0].n) for k in missing)
+
+    tests = merge_into(
+        os.path.abspath(options.root), shard_list, options.old_res)
+
+    print "Merged %d tests from %d shards" % (len(tests), len(shard_list))
+    sys.exit(0)
@@ -20,14 +20,16 @@ from gnatpython.main import Main
 from gnatpython.mainloop import (MainLoop, add_mainloop_options,
                                  SKIP_EXECUTION)
 from gnatpython.optfileparser import OptFileParse
-from gnatpython.reports import ReportDiff
 
-from glob import glob
+from multiprocessing.pool import ThreadPool
 
 import time
+import fnmatch
 import logging
+import multiprocessing
 import os
 import re
+import shutil
 import sys
 
 import SUITE.cutils as cutils
@@ -35,7 +37,6 @@ import SUITE.cutils as cutils
 from SUITE.cutils import strip_prefix, contents_of, FatalError, exit_if
 from SUITE.cutils import version
 
-from SUITE.dutils import pdump_to, pload_from
 from SUITE.dutils import jdump_to, jload_from
 from SUITE.dutils import time_string_from, host_string_from
 
@@ -43,6 +44,7 @@ from SUITE.qdata import stdf_in, qdaf_in, treeref_at
 from SUITE.qdata import QLANGUAGES, QROOTDIR
 from SUITE.qdata import QSTRBOX_DIR, CTXDATA_FILE
 from SUITE.qdata import SUITE_context, TC_status, TOOL_info, OPT_info_from
+from SUITE.qdata import qdump_to, qload_from
 
 import SUITE.control as control
 
@@ -52,6 +54,20 @@ from SUITE.control import cargs_opt_for, cargs_attr_for
 
 from SUITE.vtree import DirTree
 
+import SUITE.callgrind as callgrind
+import SUITE.resultsdb as resultsdb
+import SUITE.shards as shards
+
+from SUITE.admission import AdmissionControl
+from SUITE.bootstrap import BootstrapCoverage
+from SUITE.ckptreduce import CheckpointReductionError, DEFAULT_FANIN
+from SUITE.admission import ADMISSION_LOG_FILE, RSS_HISTORY_FILE
+
+# Name of the file, in the testsuite output dir, where the tool identity
+# cache is persisted
+
+TOOL_IDENTITY_FILE = "tool_identity.json"
+
 DEFAULT_TIMEOUT = 600
 """
 Default timeout to use (in seconds) to run testcases. Users can override this
@@ -448,11 +464,21 @@ class TestSuite(object):
         if not test.has_previously_run():
             return False
 
-        # Make sure that the testing environment has not changed
-        # since this previous run.  Otherwise, it's not safe to re-use
-        # those results.
-        errors = self.__check_consistency_with_previous_runs(test.ctxf())
-        if errors is not None:
+        # Make sure that the testing environment and the test itself have
+        # not changed since this previous run, and that it passed then.
+        # Otherwise, it's not safe to re-use those results. Resort to the
+        # context data dumped in the test dir for tests run before we
+        # recorded results in the database.
+
+        previous = self.results.latest_result(test.rname(), before=self.run_id)
+        if previous is not None:
+            errors = resultsdb.reuse_errors(
+                previous, context=self.run_context,
+                fingerprint=test.fingerprint())
+        else:
+            errors = self.__check_consistency_with_previous_runs(test.ctxf())
+
+        if errors:
             # Log of the reasons why the testcase results could not
             # be reused. This may help future investigations.
             logging.debug("Cannot re-use the previous run's results:")
@@ -460,8 +486,27 @@ class TestSuite(object):
                 logging.debug(e)
             return False
 
-        tcs = test.latched_status()
-        return tcs.status in ('OK', 'UOK')
+        return (previous is not None
+                or test.latched_status().status in ('OK', 'UOK'))
+
+    def __run_context(self):
+        """Dictionary of the execution context items which must match for
+        the results of a previous run to be reusable, as checked by
+        __check_consistency_with_previous_runs."""
+
+        context = {
+            'host platform': self.env.host.platform,
+            'target platform': self.env.target.platform,
+            'gnatpro version': TOOL_info(self.tool("gcc")).version,
+            'gnatemu version': TOOL_info(self.tool("gnatemu")).version,
+            'gnatcov version': TOOL_info("gnatcov").version,
+            '--cargs option': self.options.cargs}
+
+        for lang in control.KNOWN_LANGUAGES:
+            context['--cargs:%s option' % lang] = getattr(
+                self.options, cargs_attr_for(lang))
+
+        return context
 
     # ------------------------
     # -- Object constructor --
@@ -487,10 +532,32 @@ class TestSuite(object):
         # convey whether tests should be run under valgrind control:
 
         self.options = self.__parse_options()
+
+        # Probe the identity of the tools we use at most once for the whole
+        # run, in this process and in the testcases alike:
+
+        cutils.setup_tool_identity_cache(
+            self.__logpath(TOOL_IDENTITY_FILE),
+            hash_contents=self.options.hash_tools)
         self.enable_valgrind = (
             None if self.options.bootstrap_scos else
             self.options.enable_valgrind)
 
+        # Where the callgrind profiles of all the tests are gathered, if we
+        # are to produce them
+
+        self.callgrind_dir = os.path.join(self.log_dir, 'callgrind')
+        if self.enable_valgrind == 'callgrind':
+            rm(self.callgrind_dir, recursive=True)
+
+        exit_if(
+            self.options.wdir_root and sys.platform == 'win32',
+            "--wdir-root relies on symbolic links, unavailable on this host")
+
+        # Setup the selection of tests for this shard, if any:
+
+        self.shard = self.__shard_setup()
+
         # Add current directory in PYTHONPATH, allowing TestCases to find the
         # SUITE and SCOV packages:
 
@@ -586,6 +653,38 @@ class TestSuite(object):
 
         self.n_consecutive_failures = 0
 
+    # --------------
+    # -- Sharding --
+    # --------------
+
+    def __shard_setup(self):
+        """Return the (K, N) shard specification for this run if we have
+        one, None otherwise. Setup the assignment of tests to shards in the
+        former case."""
+
+        if not self.options.shard:
+            return None
+
+        try:
+            (k, n) = shards.parse_shard(self.options.shard)
+        except ValueError as e:
+            exit_if(True, "--shard: %s" % e)
+
+        durations = (
+            shards.durations_from(
+                shards.load_tests_index(self.options.shard_weights))
+            if self.options.shard_weights else None)
+
+        self.shard_assignment = shards.ShardAssignment(n, durations)
+        return (k, n)
+
+    def __in_shard(self, test):
+        """Whether TEST belongs to the shard we are to run, if any."""
+
+        return (self.shard is None
+                or self.shard_assignment.shard_of(test.rname())
+                == self.shard[0] - 1)
+
     # -----------------------------------
     # -- Early comments about this run --
     # -----------------------------------
@@ -742,7 +841,9 @@ class TestSuite(object):
 
         group_py_path = os.path.join(dirname, group_py)
         p = Run(
-            [sys.executable, group_py_path],
+            [sys.executable, group_py_path]
+            + (['--minimal-vectors=%s' % self.options.expgen_minimal_vectors]
+               if self.options.expgen_minimal_vectors else []),
             timeout=20)
 
         if p.status != 0:
@@ -856,13 +957,18 @@ class TestSuite(object):
                         pattern=self.tc_filter, string=dirname)):
                 continue
 
-            # Otherwise, instantiate a Testcase object and proceed:
+            # Otherwise, instantiate a Testcase object and proceed, unless
+            # the test belongs to another shard:
 
             tc = TestCase(
                 diro=diro,
                 filename=dirname + test_py,
                 trace_dir=self.trace_dir
                 )
+
+            if not self.__in_shard(tc):
+                continue
+
             tc.parseopt(suite_discriminants=self.discriminants)
 
             if tc.killcmd:
@@ -902,6 +1008,7 @@ class TestSuite(object):
         self.run_list = []
         self.dead_list = []
         self.tally = {}
+        self.tests_index = {}
 
         # Setup the regular expression used to filter the testcases to run. If
         # it is a path for an existing directory, we'll start the testcase
@@ -919,6 +1026,54 @@ class TestSuite(object):
                 QLEVEL_INFO[self.options.qualif_level].subtrees)
             )
 
+        # Setup the background removal of test artifacts for post-run
+        # cleanups, and the list of (test, removal result) pairs for which we
+        # haven't logged results yet.
+
+        self.trash = (
+            TrashCan(os.path.join(self.log_dir, 'trash'),
+                     jobs=self.options.cleanup_jobs)
+            if self.options.do_post_run_cleanups else None)
+        self.pending_cleanups = []
+
+        # Setup the adaptive admission of tests, if requested. This is only
+        # of interest when we may run several tests at once.
+
+        self.admission = (
+            AdmissionControl(
+                max_load=self.options.max_load or multiprocessing.cpu_count(),
+                mem_ceiling=self.options.mem_ceiling,
+                history_file=(
+                    self.options.rss_history
+                    or os.path.join(self.log_dir, RSS_HISTORY_FILE)),
+                log_file=os.path.join(self.log_dir, ADMISSION_LOG_FILE))
+            if self.options.adaptive_jobs and self.options.mainloop_jobs > 1
+            else None)
+
+        # Setup the results database and register this run there. Results
+        # are recorded as tests complete, for reuse in later runs, results
+        # comparisons and reports.
+
+        self.results = resultsdb.ResultsDB(
+            resultsdb.results_db_in(self.log_dir))
+        self.run_context = self.__run_context()
+        self.run_id = self.results.start_run(
+            shard=self.options.shard, discriminants=self.discriminants,
+            context=self.run_context, cmdline=" ".join(sys.argv))
+
+        # Setup the incremental processing of bootstrap traces, if requested
+
+        self.bootstrap = (
+            BootstrapCoverage(
+                trace_dir=self.trace_dir,
+                scos=self.options.bootstrap_scos,
+                gnatcov=which(
+                    xcov_pgm(self.options.auto_arch, for_target=False)),
+                jobs=self.options.mainloop_jobs,
+                fanin=self.options.ckpt_fanin or DEFAULT_FANIN)
+            if self.options.bootstrap_scos is not None
+            else None)
+
         try:
             MainLoop(
                 self.__next_testcase(),
@@ -934,9 +1089,28 @@ class TestSuite(object):
                 ["!!! MAINLOOP STOPPED ON EXCEPTION !!!", e.__str__()]
                 )
 
-        ReportDiff(
-            self.log_dir, self.options.old_res
-            ).txt_image('rep_gnatcov')
+        # Wait for the pending cleanups to complete, so that the results we
+        # report account for removal failures.
+
+        self.__complete_cleanups(wait=True)
+
+        if self.trash:
+            self.trash.close()
+
+        if self.admission:
+            self.admission.close()
+
+        if self.options.old_res:
+            self.results.attach_baseline(self.options.old_res)
+        self.results.write_report('rep_gnatcov', self.run_id)
+        self.results.close()
+
+        # Record what we know about the tests we ran, for result merges and
+        # duration based sharding of later runs
+
+        shards.dump_tests_index(
+            shards.tests_index_in(self.log_dir),
+            shard=self.options.shard, tests=self.tests_index)
 
         # Report all dead tests
         self.__push_results(
@@ -963,20 +1137,30 @@ class TestSuite(object):
               ", ".join(["%d %s" % (count, status)
                          for (status, count) in self.tally.items()]))
 
-        # Generate bootstrap results
-        if self.options.bootstrap_scos is not None:
+        # Merge the callgrind profiles of all the gnatcov executions
+
+        if self.enable_valgrind == 'callgrind':
+            (count, errors) = callgrind.aggregate(
+                [self.callgrind_dir], output_dir=self.log_dir,
+                jobs=self.options.mainloop_jobs)
+            logging.info(
+                "%d callgrind profiles merged, see %s" % (
+                    count - len(errors),
+                    self.__logpath(callgrind.REPORT_FILE)))
+            [logging.warning("callgrind: %s" % e) for e in errors]
+
+        # Generate bootstrap results, out of the checkpoints produced as
+        # tests completed
 
-            # Generate trace list file
-            trace_list = glob(self.trace_dir + '/*/*.trace')
-            with open(self.trace_dir + '/trace.list', 'w') as file:
-                file.write("\n".join(trace_list))
+        if self.bootstrap:
+            try:
+                errors = self.bootstrap.close(
+                    html_dir=self.trace_dir,
+                    log=os.path.join(self.log_dir, 'bootstrap.out'))
+            except CheckpointReductionError as e:
+                errors = [str(e)]
 
-            pgm = xcov_pgm(self.options.auto_arch, for_target=False)
-            Run(['time', which(pgm), 'coverage', '--level=stmt',
-                 '--scos=@' + self.options.bootstrap_scos, '--annotate=html',
-                 '@' + self.trace_dir + '/trace.list',
-                 '--output-dir=' + self.trace_dir],
-                output=os.path.join(self.log_dir, 'bootstrap.out'))
+            [logging.warning("bootstrap: %s" % e) for e in errors]
 
     # ------------------------------
     # -- run_testcase and helpers --
@@ -1014,10 +1198,20 @@ class TestSuite(object):
         if self.enable_valgrind:
             testcase_cmd.append('--enable-valgrind=' + self.enable_valgrind)
         if self.trace_dir is not None:
-            test_trace_dir = os.path.join(test.trace_dir, str(test.index))
+            test_trace_dir = test.bootstrap_trace_dir()
             mkdir(test_trace_dir)
             testcase_cmd.append('--trace_dir=%s' % test_trace_dir)
 
+        # Have working directories reside under a testcase specific root
+        # if requested, starting afresh.
+
+        if self.options.wdir_root:
+            test.wdir_root = os.path.join(
+                os.path.abspath(self.options.wdir_root), str(test.index))
+            shutil.rmtree(test.wdir_root, ignore_errors=True)
+            mkdir(test.wdir_root)
+            testcase_cmd.append('--wdir-root=%s' % test.wdir_root)
+
         # Propagate our command line arguments as testcase options.
         #
         # Beware that we're not using 'is not None' on purpose, to prevent
@@ -1074,6 +1268,17 @@ class TestSuite(object):
         if mopt.consolidate:
             testcase_cmd.append('--consolidate=%s' % mopt.consolidate)
 
+        if mopt.incremental_builds:
+            testcase_cmd.append('--incremental-builds')
+
+        if mopt.ckpt_fanin:
+            testcase_cmd.append('--ckpt-fanin=%d' % mopt.ckpt_fanin)
+            testcase_cmd.append('--ckpt-jobs=%d' % mopt.ckpt_jobs)
+            testcase_cmd.append('--ckpt-workdir=%s' % mopt.ckpt_workdir)
+
+        if mopt.concurrent_reports:
+            testcase_cmd.append('--concurrent-reports')
+
         # --gnatcov_<cmd> family
 
         [testcase_cmd.append(
@@ -1106,6 +1311,12 @@ class TestSuite(object):
             test.start_time = time.time()
             return SKIP_EXECUTION
 
+        # Wait for the host to have room for this test, if we are to adapt
+        # the actual concurrency to the host resources.
+
+        if self.admission:
+            self.admission.admit(test.rname())
+
         # Compute the testcase timeout, whose default vary depending on whether
         # we use Valgrind.
         default_timeout = DEFAULT_TIMEOUT
@@ -1121,9 +1332,14 @@ class TestSuite(object):
 
         test.start_time = time.time()
 
-        return Run(
+        p = Run(
             testcase_cmd, output=test.errf(), bg=True, timeout=int(timeout))
 
+        if self.admission:
+            self.admission.started(test.rname(), p.pid)
+
+        return p
+
     # --------------------
     # -- collect_result --
     # --------------------
@@ -1154,11 +1370,24 @@ class TestSuite(object):
                     )
              ])
 
-        # 3) Log the execution status as needed on stdout. All tests are
-        # logged in !quiet mode.  Real failures are always logged.
+        # 3) Record the result in the results database
 
         dsec = test.end_time - test.start_time
 
+        self.results.add_result(
+            run=self.run_id, name=test.rname(), dir=test.rtestdir,
+            filename=test.filename, status=test.status,
+            comment=test.comment or None, start=test.start_time,
+            duration=dsec, discriminants=test.discriminants(),
+            fingerprint=test.fingerprint())
+
+        # 4) Log the execution status as needed on stdout. All tests are
+        # logged in !quiet mode.  Real failures are always logged.
+
+        self.tests_index[test.rname()] = {
+            'dir': test.rtestdir, 'filename': test.filename,
+            'duration': dsec}
+
         if (not self.options.quiet) or (not test.passed and not test.xfail):
             logging.info(
                 "%-68s %s - %s %s" % (
@@ -1201,8 +1430,17 @@ class TestSuite(object):
 
         test.end_time = time.time()
 
+        if self.admission:
+            self.admission.finished(test.rname())
+
         test.compute_status()
 
+        # Start turning the bootstrap traces of the test into a checkpoint,
+        # in the background:
+
+        if self.bootstrap:
+            self.bootstrap.add(test.bootstrap_trace_dir())
+
         # Execute a post-testcase action if requested so, before the test
         # artifacts might be cleared by a post-run cleanup:
 
@@ -1210,18 +1448,88 @@ class TestSuite(object):
             self.options.post_testcase, args=[self.options.altrun],
             edir=test.atestdir)
 
+        # Save the callgrind profiles of the gnatcov executions, before the
+        # working directories where they reside are released or cleaned up:
+
+        if self.enable_valgrind == 'callgrind':
+            self.__save_callgrind_profiles(test)
+
+        # Release working directories from their remapped location, keeping
+        # the artifacts of failed tests on request:
+
+        test.release_wdirs(
+            copy_back=not test.passed and self.options.keep_failed_wdirs)
+
+        # Account for the post-run cleanups of previous tests which completed
+        # in the meantime:
+
+        self.__complete_cleanups(wait=False)
+
         # Perform post-run cleanups if requested so. Note that this may
         # alter the test execution status to make sure that unexpected cleanup
-        # failures get visibility:
+        # failures get visibility, so we only complete the results for the
+        # test once its artifacts are actually removed. This happens in the
+        # background, to let the main loop move on to the next test.
 
         if test.status != 'FAILED' and self.options.do_post_run_cleanups:
-            test.do_post_run_cleanups()
+            self.pending_cleanups.append(
+                (test, test.do_post_run_cleanups(self.trash)))
+        else:
+            self.__log_final_results_for([test])
+            self.__check_stop_after(test)
 
-        if self.options.qualif_level:
-            test.latch_status()
+    def __save_callgrind_profiles(self, test):
+        """Internal helper for collect_result. Move the callgrind profiles
+        produced by TEST into our callgrind dir, for aggregation at the end
+        of the run."""
+
+        mkdir(self.callgrind_dir)
+
+        for (dirpath, _, filenames) in os.walk(
+                test.atestdir, followlinks=True):
+            for f in fnmatch.filter(filenames, callgrind.PROFILE_PATTERN):
+                shutil.move(
+                    os.path.join(dirpath, f),
+                    os.path.join(self.callgrind_dir,
+                                 "%s.%d.%s" % (test.rname(), test.index, f)))
+
+    def __log_final_results_for(self, tests):
+        """Internal helper for collect_result, to latch and log the final
+        results of each test in TESTS."""
+
+        for test in tests:
+            if self.options.qualif_level:
+                test.latch_status()
+
+            self.__log_results_for(test)
+
+    def __complete_cleanups(self, wait):
+        """Complete the results of the tests for which post-run cleanups were
+        pending and have completed since the last call. If WAIT, wait for all
+        the pending cleanups to complete first."""
+
+        completed = [(test, result)
+                     for (test, result) in self.pending_cleanups
+                     if wait or result.ready()]
+
+        if not completed:
+            return
+
+        self.pending_cleanups = [
+            entry for entry in self.pending_cleanups
+            if entry not in completed]
 
-        self.__log_results_for(test)
-        self.__check_stop_after(test)
+        for (test, result) in completed:
+            test.note_removal_failures(result.get())
+
+        # Log all the results before checking for a stop condition, which
+        # raises an exception. We are past the main loop when we wait, so
+        # there is nothing to stop any more then.
+
+        self.__log_final_results_for([test for (test, _) in completed])
+
+        if not wait:
+            [self.__check_stop_after(test) for (test, _) in completed]
 
     def outfile_for(self, test):
         """Returns path to diff file in the suite output directory.  This file
@@ -1244,11 +1552,74 @@ class TestSuite(object):
         m.add_option('--diffs', dest='diffs', action='store_true',
                      default=False, help='show diffs on stdout')
         m.add_option("--old-res", dest="old_res", type="string",
-                     help="Old testsuite.res file")
+                     help="Old results to compare against in rep_gnatcov: "
+                          "a results database, a testsuite output dir "
+                          "holding one, or a testsuite.res file")
 
         m.add_option('--post-run-cleanups', dest='do_post_run_cleanups',
                      action='store_true', default=False,
                      help='request post-run cleanup of temporary artifacts')
+        m.add_option('--wdir-root', dest='wdir_root', metavar='DIR',
+                     default=None,
+                     help='Have the working directories of testcases reside '
+                          'under DIR, typically on a local tmpfs, instead of '
+                          'in the testcase directories. Only the testcase '
+                          'outputs and qualification data are kept in the '
+                          'testcase directories.')
+        m.add_option('--keep-failed-wdirs', dest='keep_failed_wdirs',
+                     action='store_true', default=False,
+                     help='With --wdir-root, copy the working directories of '
+                          'failed tests back into their testcase directory, '
+                          'not only the command logs they hold')
+        m.add_option('--shard', dest='shard', metavar='K/N', default=None,
+                     help='Only run the K-th of N slices of the set of '
+                          'tests, for N runs to share the work. See '
+                          'merge_shards.py to merge the results')
+        m.add_option('--shard-weights', dest='shard_weights',
+                     metavar='TESTS_INDEX', default=None,
+                     help='With --shard, balance the slices according to '
+                          'the test durations recorded in TESTS_INDEX, '
+                          'a %s file from the output dir of a previous run. '
+                          'All the slices must use the same file.'
+                          % shards.TESTS_INDEX)
+        m.add_option('--adaptive-jobs', dest='adaptive_jobs',
+                     action='store_true', default=False,
+                     help='Only start a new test while the projected host '
+                          'load and memory use stay under the --max-load and '
+                          '--mem-ceiling limits, running at most --jobs '
+                          'tests at once. Decisions are logged in '
+                          'output/%s.' % ADMISSION_LOG_FILE)
+        m.add_option('--max-load', dest='max_load', type=float,
+                     default=None, metavar='LOAD',
+                     help='With --adaptive-jobs, ceiling of the host load '
+                          'average. Defaults to the number of CPUs.')
+        m.add_option('--mem-ceiling', dest='mem_ceiling', type=float,
+                     default=0.9, metavar='FRACTION',
+                     help='With --adaptive-jobs, fraction of the host memory '
+                          'tests may use. Defaults to 0.9.')
+        m.add_option('--rss-history', dest='rss_history', default=None,
+                     metavar='FILE',
+                     help='With --adaptive-jobs, file where the peak memory '
+                          'use of tests is recorded across runs. Defaults to '
+                          'output/%s.' % RSS_HISTORY_FILE)
+        m.add_option('--hash-tools', dest='hash_tools',
+                     action='store_true', default=False,
+                     help='In the cache of tool version probes, '
+                          'output/%s, identify tool executables by a hash '
+                          'of their contents rather than by their size and '
+                          'modification time.' % TOOL_IDENTITY_FILE)
+        m.add_option('--expgen-minimal-vectors',
+                     dest='expgen_minimal_vectors', type='choice',
+                     choices=('unique-cause', 'masking'), default=None,
+                     metavar='CRITERION',
+                     help='Have the testcases generated from group.py '
+                          'scripts exercise a minimal set of truth vectors '
+                          'achieving CRITERION MC/DC ("unique-cause" or '
+                          '"masking"), instead of the hand-written drivers.')
+        m.add_option('--cleanup-jobs', dest='cleanup_jobs', type=int,
+                     default=2, metavar='N',
+                     help='Max number of concurrent background removals '
+                          'for post-run cleanups')
 
         m.add_option('--qualif-level', dest='qualif_level',
                      type="choice", choices=QLEVEL_INFO.keys(),
@@ -1261,7 +1632,12 @@ class TestSuite(object):
                      help='scos for bootstap coverage report. '
                      'Use xcov to assess coverage of its own testsuite. '
                      'Only supported on x86-linux. '
-                     'Note that it disables the use of valgrind.')
+                     'Note that it disables the use of valgrind. '
+                     'The traces of each test are turned into a checkpoint '
+                     'as it completes, and checkpoints are merged by groups '
+                     'of --ckpt-fanin. output/traces/checkpoints.list '
+                     'lists the checkpoints covering the tests processed '
+                     'so far, for partial reports.')
 
         m.add_option(
             '--other-tool-info', dest='other_tool_info',
@@ -1512,6 +1888,78 @@ class TestSuite(object):
         [install_altrun_for(p0=pgm, p1=cmd, binbase="c%s" % cmd)
          for (pgm, cmd) in control.ALTRUN_GNATCOV_PAIRS]
 
+# ==============
+# == TrashCan ==
+# ==============
+
+
+class TrashCan(object):
+    """Background removal of filesystem entries, with a bounded number of
+    concurrent removals. Entries to remove are first moved to a trash
+    directory, which is quick and makes them disappear right away from where
+    they were, then removed lazily."""
+
+    def __init__(self, trash_dir, jobs):
+        self.trash_dir = trash_dir
+        self.pool = ThreadPool(max(1, jobs))
+
+        # Prefix for the names of entries we move to the trash, unique to
+        # this run, and index of the next entry to move.
+
+        self.prefix = "%d-%d" % (os.getpid(), int(time.time()))
+        self.index = 0
+
+        # Remove leftovers from previous runs in the background, ignoring
+        # failures.
+
+        mkdir(self.trash_dir)
+        self.remove(ls(os.path.join(self.trash_dir, '*')),
+                    handle_info_for=lambda path: "")
+
+    def discard(self, path):
+        """Move PATH to the trash directory if possible, and return the path
+        under which it should be removed."""
+
+        self.index += 1
+        trashed = os.path.join(
+            self.trash_dir, "%s-%d" % (self.prefix, self.index))
+
+        # Renaming might fail, for example across filesystems or because of
+        # stray handles. Leave the entry where it is then, for the removal
+        # request to handle.
+
+        try:
+            os.rename(path, trashed)
+            return trashed
+        except OSError:
+            return path
+
+    def remove(self, paths, handle_info_for):
+        """Request the removal of the list of PATHS in the background. Return
+        the result of the request, as a multiprocessing AsyncResult. The
+        result value is the list of removal failures, as (path, handle info)
+        pairs where the handle info is computed with HANDLE_INFO_FOR."""
+
+        def remove_paths():
+            failures = []
+            for path in paths:
+                try:
+                    rm(path, recursive=True)
+                except Exception:
+                    failures.append((path, handle_info_for(path)))
+            return failures
+
+        return self.pool.apply_async(remove_paths)
+
+    def close(self):
+        """Wait for all the removal requests to complete and remove the
+        trash directory."""
+
+        self.pool.close()
+        self.pool.join()
+        rm(self.trash_dir, recursive=True)
+
+
 # ==============
 # == TestCase ==
 # ==============
@@ -1540,6 +1988,10 @@ class TestCase(object):
         self.index = TestCase.index
         TestCase.index += 1
 
+        # Root of the tree where our working directories reside, if not
+        # in our testcase directory
+        self.wdir_root = None
+
     def __lt__(self, right):
         """Use relative testdir alphabetical order"""
         return self.rtestdir < right.rtestdir
@@ -1634,7 +2086,7 @@ class TestCase(object):
         self.status = status_dict[self.passed][self.xfail]
 
     def latch_status(self):
-        pdump_to(
+        qdump_to(
             self.stdf(),
             o=TC_status(
                 passed=self.passed,
@@ -1644,7 +2096,7 @@ class TestCase(object):
             )
 
     def latched_status(self):
-        return pload_from(self.stdf())
+        return qload_from(self.stdf())
 
     def __handle_info_for(self, path):
         """Return a string describing file handle information related to
@@ -1666,11 +2118,11 @@ class TestCase(object):
 
         return Run([handle_path, '/AcceptEULA', '-a', '-u', path]).out
 
-    def do_post_run_cleanups(self):
-        """Cleanup temporary artifacts from the testcase directory. Append
-        removal failure info to the test error log."""
-
-        comments = []
+    def do_post_run_cleanups(self, trash):
+        """Cleanup temporary artifacts from the testcase directory, moving
+        them to the TRASH can for removal in the background. Return the
+        result of the removal request, to be passed to note_removal_failures
+        once ready."""
 
         # In principle, most of this is the spawned test.py responsibilty,
         # because _it_ knows what it creates etc.  We have artifacts of our
@@ -1681,22 +2133,68 @@ class TestCase(object):
         # Deal with occasional removal failures presumably caused by stray
         # handles. Expand glob patterns locally, issue separate rm requests
         # for distinct filesystem entries and turn exceptions from rm into
-        # test failures.
+        # test failures, from note_removal_failures.
 
-        for globp in ('tmp_*', 'st_*', 'dc_*', 'mc_*', 'uc_*', 'obj', 'obj_*',
-                      '[0-9]', '*.adb.*', 'test.py.log', '*.dump'):
+        paths = [path
+                 for globp in ('tmp_*', 'st_*', 'dc_*', 'mc_*', 'uc_*', 'obj',
+                               'obj_*', '[0-9]', '*.adb.*', 'test.py.log',
+                               '*.dump', 'gprbuild-*.stamp')
+                 for path in set(ls(os.path.join(self.atestdir, globp)))]
 
-            for path in set(ls(os.path.join(self.atestdir, globp))):
-                try:
-                    rm(path, recursive=True)
-                except Exception:
-                    handle_comment = self.__handle_info_for(path)
-                    self.passed = False
-                    self.status = 'RMFAILED'
+        return trash.remove(
+            [trash.discard(path) for path in paths],
+            handle_info_for=self.__handle_info_for)
+
+    def release_wdirs(self, copy_back):
+        """Remove the working directories that were remapped under our
+        wdir_root, if any, replacing them with a copy of their contents if
+        COPY_BACK, or of the command logs they hold otherwise. Then remove
+        the wdir_root tree."""
+
+        if not self.wdir_root:
+            return
+
+        for wdir in cutils.remapped_dirs_in(self.atestdir, self.wdir_root):
+            target = os.readlink(wdir)
+            os.remove(wdir)
+            if copy_back:
+                shutil.copytree(target, wdir, symlinks=True)
+            else:
+                self.__copy_command_logs(target, wdir)
+
+        # The wdir_root tree holds symbolic links to directories of the
+        # testcase tree, which we must not follow.
 
-                    comments.append(
-                        "Removal of %s failed\nHandle info follows:" % path)
-                    comments.append(handle_comment)
+        shutil.rmtree(self.wdir_root, ignore_errors=True)
+
+    def __copy_command_logs(self, wdir, dest):
+        """Copy the .out/.log/.err outputs of the commands run in working
+        directory WDIR, and its subdirectories, to the same places under
+        DEST. These are what we look at first to investigate a failure."""
+
+        for (path, _, files) in os.walk(wdir):
+            logs = [f for f in files
+                    if os.path.splitext(f)[1] in ('.out', '.log', '.err')]
+            if logs:
+                dpath = os.path.join(dest, os.path.relpath(path, wdir))
+                mkdir(dpath)
+                for f in logs:
+                    shutil.copy2(os.path.join(path, f), dpath)
+
+    def note_removal_failures(self, failures):
+        """Account for the list of FAILURES from a removal request issued
+        by do_post_run_cleanups, as (path, handle info) pairs. Append removal
+        failure info to the test error log."""
+
+        comments = []
+
+        for (path, handle_comment) in failures:
+            self.passed = False
+            self.status = 'RMFAILED'
+
+            comments.append(
+                "Removal of %s failed\nHandle info follows:" % path)
+            comments.append(handle_comment)
 
         with open(self.errf(), 'a') as f:
             f.write('\n'.join(comments))
@@ -1751,6 +2249,19 @@ class TestCase(object):
         """
         return os.path.join(self.atestdir, 'ctx.dump')
 
+    def bootstrap_trace_dir(self):
+        """The directory where the bootstrap traces of the test go, None
+        if this is not a bootstrap run."""
+        return (os.path.join(self.trace_dir, str(self.index))
+                if self.trace_dir is not None else None)
+
+    def fingerprint(self):
+        """Fingerprint of the test script and options, to tell whether the
+        test changed since a previous run."""
+        return resultsdb.test_fingerprint(
+            [os.path.join(self.atestdir, f)
+             for f in (self.filename, 'test.opt')])
+
     def has_previously_run(self):
         """Return True iff this testcase looks like it's been run before.
 
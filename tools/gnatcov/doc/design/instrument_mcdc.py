@@ -78,12 +78,13 @@ class Expression(object):
 class Condition(Expression):
     """Condition in a decision expression.
 
-    Conditions are identified by a single letter (its "symbol") and each letter
-    must appear only one in a valid decision expression tree.
+    Conditions are identified by a name (its "symbol"), usually a single
+    letter, and each name must appear only once in a valid decision expression
+    tree.
     """
 
     def __init__(self, symbol):
-        assert isinstance(symbol, str) and len(symbol) == 1
+        assert isinstance(symbol, str) and symbol
         self.symbol = symbol
 
     def __repr__(self):
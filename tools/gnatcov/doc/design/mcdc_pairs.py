@@ -0,0 +1,401 @@
+"""Offline MC/DC analysis of source trace path bits.
+
+Instrumented programs record, for each decision, which of its evaluation paths
+were taken, as bits in the MC/DC buffer of each unit (see the "mcdc_buffer" of
+source trace entries in testsuite/SUITE/srctracelib.py). Each decision owns a
+contiguous range of bits starting at its "path bits base", and the path index
+in this range is computed as in the IndexedBDD class of instrument_mcdc.py:
+following the BDD from the entry condition, add the number of paths through
+the "false" edge whenever a condition evaluates to true.
+
+This script turns these bits back into MC/DC verdicts. For each decision, it
+builds the IndexedBDD from the decision expression, enumerates the evaluation
+vectors for all the paths, and precomputes for each condition and each path
+the set of paths that form an independence pair with it, as a bitset. Checking
+a condition for a set of observed paths then boils down to a few bitwise
+operations. These precomputations only depend on the shape of the decision, so
+they are shared by all the decisions with the same shape, and so are verdicts
+for identical sets of observed paths: this keeps the analysis of thousands of
+decisions cheap.
+
+Pairs are determined as in MC_DC.Is_MC_DC_Pair: two evaluations with
+different outcomes show the independent influence of a condition if it is
+the only condition evaluated in both with different values (unique cause), or
+the last such condition (masking).
+
+Decisions are described in a text file, one per line:
+
+    UNIT PATH_BITS_BASE LABEL DECISION
+
+where UNIT is the unit name as it appears in trace entries, LABEL is a free
+form identifier for reports (typically the decision sloc) and DECISION is an
+Ada-like expression: identifiers for conditions, combined with "and then",
+"or else", "not" and parentheses ("and"/"or" are accepted as well). Empty
+lines and lines starting with "#" are ignored.
+
+The report has one section per decision, with one line per condition, in the
+spirit of the "gnatcov coverage" notices and violations so that both can be
+cross-checked.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import re
+import sys
+
+from instrument_mcdc import (
+    AndThen, BDD, Condition, Expression, IndexedBDD, Not, OrElse
+)
+
+
+UNIQUE_CAUSE = 'unique-cause'
+MASKING = 'masking'
+
+
+def parse_decision(text):
+    """Parse the "text" decision expression and return the corresponding
+    Expression tree.
+    """
+    tokens = re.findall(r'\(|\)|[A-Za-z_][A-Za-z0-9_.]*', text)
+    if ''.join(tokens) != re.sub(r'\s', '', text):
+        raise ValueError('invalid decision expression: {}'.format(text))
+
+    # Glue "and then" and "or else" as single operators
+    glued = []
+    for token in tokens:
+        low = token.lower()
+        if glued and (glued[-1], low) in (('and', 'then'), ('or', 'else')):
+            continue
+        glued.append(low if low in ('and', 'or', 'not') else token)
+    tokens = glued
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else None
+
+    def take(expected=None):
+        token = peek()
+        if token is None or (expected and token != expected):
+            raise ValueError('unexpected {} in decision expression: {}'.format(
+                'end' if token is None else repr(token), text
+            ))
+        pos[0] += 1
+        return token
+
+    def parse_primary():
+        token = take()
+        if token == 'not':
+            return Not(parse_primary())
+        elif token == '(':
+            result = parse_binary()
+            take(')')
+            return result
+        elif token in ('and', 'or', ')'):
+            raise ValueError('unexpected {} in decision expression: {}'
+                             .format(repr(token), text))
+        return Condition(token)
+
+    def parse_binary():
+        # As in Ada, mixing "and then" and "or else" requires parentheses
+        result = parse_primary()
+        operator = None
+        while peek() in ('and', 'or'):
+            if operator and peek() != operator:
+                raise ValueError('mixed operators without parentheses in'
+                                 ' decision expression: {}'.format(text))
+            operator = take()
+            rhs = parse_primary()
+            result = (AndThen if operator == 'and' else OrElse)(result, rhs)
+        return result
+
+    result = parse_binary()
+    if peek() is not None:
+        raise ValueError('unexpected {} in decision expression: {}'.format(
+            repr(peek()), text
+        ))
+    return result
+
+
+def conditions_of(expr):
+    """Return the list of conditions in "expr", in textual order, which is
+    also the order of condition indexes.
+    """
+    if isinstance(expr, Condition):
+        return [expr]
+    return [c for operand in expr.operands for c in conditions_of(operand)]
+
+
+def shape_key(expr):
+    """Return a key for the shape of "expr": decisions with the same key
+    only differ in the names of their conditions.
+    """
+    if isinstance(expr, Condition):
+        return 'c'
+    elif isinstance(expr, Not):
+        return 'not {}'.format(shape_key(expr.expr))
+    else:
+        return '({} {} {})'.format(
+            shape_key(expr.lhs),
+            'and' if isinstance(expr, AndThen) else 'or',
+            shape_key(expr.rhs)
+        )
+
+
+class Path(object):
+    """Evaluation path through a decision."""
+
+    def __init__(self, values, outcome):
+        self.values = values
+        """Value for each condition (by index), None if not evaluated."""
+
+        self.outcome = outcome
+        """Decision outcome for this path."""
+
+    def image(self):
+        """Return the image of this evaluation, as in gnatcov reports."""
+        # Trailing conditions not evaluated are masked ("-") as well
+        return '{} -> {}'.format(
+            ''.join('-' if v is None else 'T' if v else 'F'
+                    for v in self.values),
+            'TRUE' if self.outcome else 'FALSE'
+        )
+
+
+class DecisionShape(object):
+    """Evaluation paths and independence pairs for a decision shape."""
+
+    def __init__(self, expr):
+        assert isinstance(expr, Expression)
+        self.ibdd = IndexedBDD(BDD(expr))
+        self.conditions = self.ibdd.conditions
+        index_of = {cond: i for i, cond in enumerate(self.conditions)}
+
+        # Enumerate paths in index order: the IndexedBDD offsets are such
+        # that a depth-first traversal that explores "false" edges first
+        # visits paths by increasing index.
+        self.paths = []
+
+        def enumerate_paths(node, values):
+            if isinstance(node, bool):
+                self.paths.append(Path(tuple(values), node))
+                return
+            edge = self.ibdd.edges[node]
+            i = index_of[node]
+            for value, dest in ((False, edge.for_false),
+                                (True, edge.for_true)):
+                values[i] = value
+                enumerate_paths(dest, values)
+            values[i] = None
+
+        enumerate_paths(self.ibdd.entry_condition,
+                        [None] * len(self.conditions))
+
+        assert len(self.paths) == (
+            self.ibdd.edges[self.ibdd.entry_condition].path_count)
+
+        self.outcome_masks = {False: 0, True: 0}
+        for i, path in enumerate(self.paths):
+            self.outcome_masks[path.outcome] |= 1 << i
+
+        # partners[criterion][c][i] is the bitset of paths that form an
+        # independence pair for condition c with path i.
+        self.partners = {
+            criterion: [[0] * len(self.paths) for _ in self.conditions]
+            for criterion in (UNIQUE_CAUSE, MASKING)
+        }
+        for i, p1 in enumerate(self.paths):
+            for j, p2 in enumerate(self.paths):
+                if j <= i or p1.outcome == p2.outcome:
+                    continue
+                differing = [
+                    c for c, (v1, v2) in enumerate(zip(p1.values, p2.values))
+                    if v1 is not None and v2 is not None and v1 != v2
+                ]
+                influent = {MASKING: differing[-1]}
+                if len(differing) == 1:
+                    influent[UNIQUE_CAUSE] = differing[0]
+                for criterion, c in influent.items():
+                    self.partners[criterion][c][i] |= 1 << j
+                    self.partners[criterion][c][j] |= 1 << i
+
+    @property
+    def path_count(self):
+        return len(self.paths)
+
+    def pairs(self, observed, criterion):
+        """Return, for each condition, the first (i, j) pair of paths in the
+        "observed" bitset that shows its independent influence according to
+        "criterion", or None if there is none.
+        """
+        result = []
+        for partners in self.partners[criterion]:
+            pair = None
+            remaining = observed
+            while remaining and pair is None:
+                i = (remaining & -remaining).bit_length() - 1
+                remaining &= remaining - 1
+                matches = partners[i] & observed
+                if matches:
+                    j = (matches & -matches).bit_length() - 1
+                    pair = (min(i, j), max(i, j))
+            result.append(pair)
+        return result
+
+
+class Decision(object):
+    """Decision to analyze."""
+
+    def __init__(self, unit, path_bits_base, label, expr):
+        self.unit = unit
+        self.path_bits_base = path_bits_base
+        self.label = label
+        self.expr = expr
+
+
+def read_decisions(filename):
+    """Read the list of decisions in "filename"."""
+    result = []
+    with open(filename) as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                unit, base, label, expr = line.split(None, 3)
+                result.append(Decision(unit, int(base), label,
+                                       parse_decision(expr)))
+            except ValueError as exc:
+                raise ValueError('{}:{}: {}'.format(filename, lineno, exc))
+    return result
+
+
+def bitset(bits, first, count):
+    """Return the "count" bits in the "bits" list of booleans from index
+    "first", as an integer bitset.
+    """
+    result = 0
+    for i, bit in enumerate(bits[first:first + count]):
+        if bit:
+            result |= 1 << i
+    return result
+
+
+class Analyzer(object):
+    """MC/DC analyzer for sets of decisions."""
+
+    def __init__(self, criterion=UNIQUE_CAUSE):
+        self.criterion = criterion
+        self.shapes = {}
+        self.verdicts = {}
+
+    def shape_for(self, expr):
+        key = shape_key(expr)
+        try:
+            return self.shapes[key]
+        except KeyError:
+            result = self.shapes[key] = DecisionShape(expr)
+            return result
+
+    def analyze(self, decision, mcdc_bits):
+        """Analyze "decision" given the "mcdc_bits" list of booleans for its
+        unit. Return a (shape, observed bitset, list of pairs) tuple, the
+        list of pairs being as returned by DecisionShape.pairs.
+        """
+        shape = self.shape_for(decision.expr)
+        observed = bitset(mcdc_bits, decision.path_bits_base, shape.path_count)
+
+        key = (id(shape), observed)
+        try:
+            pairs = self.verdicts[key]
+        except KeyError:
+            pairs = self.verdicts[key] = shape.pairs(observed, self.criterion)
+        return shape, observed, pairs
+
+    def report(self, decisions, mcdc_bits_for, f):
+        """Write the MC/DC report for "decisions" to the "f" file.
+        "mcdc_bits_for" maps unit names to the lists of MC/DC buffer bits.
+        Return the number of conditions without independence pair.
+        """
+        violations = 0
+        for decision in decisions:
+            bits = mcdc_bits_for.get(decision.unit)
+            print('{}: {}'.format(decision.label, decision.expr), file=f)
+            if bits is None:
+                print('  no trace data for unit {}'.format(decision.unit),
+                      file=f)
+                continue
+
+            shape, observed, pairs = self.analyze(decision, bits)
+
+            # As in gnatcov, MC/DC is analyzed only for decisions with both
+            # outcomes exercised.
+            missing = [outcome for outcome in (False, True)
+                       if not observed & shape.outcome_masks[outcome]]
+            if missing:
+                violations += len(shape.conditions)
+                for outcome in missing:
+                    print('  outcome {} never exercised'.format(
+                        'TRUE' if outcome else 'FALSE'
+                    ), file=f)
+                continue
+
+            for c, (cond, pair) in enumerate(
+                    zip(conditions_of(decision.expr), pairs)):
+                if pair:
+                    i, j = pair
+                    print('  C{} {}: independent influence shown by eval'
+                          ' pair: {} / {}'.format(
+                              c, cond, shape.paths[i].image(),
+                              shape.paths[j].image()), file=f)
+                else:
+                    violations += 1
+                    print('  C{} {}: has no independent influence pair,'
+                          ' MC/DC not achieved'.format(c, cond), file=f)
+        return violations
+
+
+def mcdc_bits_from_traces(filenames):
+    """Return a mapping from unit names to MC/DC buffer bits, merged for all
+    the "filenames" source trace files.
+    """
+    # srctracelib lives in the testsuite tree
+    sys.path.append(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        '..', '..', '..', '..', 'testsuite', 'SUITE'
+    ))
+    import srctracelib
+
+    result = {}
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            tf = srctracelib.SrcTraceFile.read(
+                srctracelib.ByteStreamDecoder(f, False)
+            )
+        for entry in tf.entries:
+            bits = entry.mcdc_buffer.bits
+            merged = result.setdefault(entry.unit_name, [False] * len(bits))
+            for i, bit in enumerate(bits):
+                merged[i] = merged[i] or bit
+    return result
+
+
+parser = argparse.ArgumentParser(
+    description='Compute MC/DC verdicts from source trace MC/DC buffers')
+parser.add_argument('--masking', action='store_true',
+                    help='Use masking MC/DC instead of unique-cause MC/DC')
+parser.add_argument('--output', '-o', type=argparse.FileType('w'),
+                    default=sys.stdout,
+                    help='Report file (standard output by default)')
+parser.add_argument('decisions', help='Decisions description file')
+parser.add_argument('srctraces', nargs='+', help='Source trace files')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    analyzer = Analyzer(MASKING if args.masking else UNIQUE_CAUSE)
+    violations = analyzer.report(read_decisions(args.decisions),
+                                 mcdc_bits_from_traces(args.srctraces),
+                                 args.output)
+    sys.exit(1 if violations else 0)
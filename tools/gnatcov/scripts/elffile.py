@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+"""Minimal ELF32/ELF64 reader, after elf_common.ads, elf32.ads and elf64.ads.
+
+This only decodes what the scripts in this directory need (file header,
+section headers and symbol tables) directly from a memory mapping of the
+file, so that analysis hosts need no binutils for the target.
+"""
+
+import collections
+import mmap
+import struct
+
+
+class ElfError(Exception):
+    """Raised when a file cannot be decoded as an ELF file."""
+    pass
+
+
+ELF_MAGIC = b'\x7fELF'
+
+# e_ident[EI_CLASS]
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+
+# e_ident[EI_DATA]
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+# e_type
+ET_REL = 1
+ET_EXEC = 2
+ET_DYN = 3
+
+# e_machine values we need to special-case
+EM_ARM = 40
+
+# Special section indexes
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+SHN_XINDEX = 0xffff
+
+# sh_type
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+
+# sh_flags
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+
+# ELF_ST_TYPE (st_info)
+STT_NOTYPE = 0
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_SECTION = 3
+STT_FILE = 4
+
+# Layouts for each ELF class, without the byte order prefix. The file header
+# layout starts after e_ident.
+LAYOUTS = {
+    ELFCLASS32: {
+        'ehdr': 'HHIIIIIHHHHHH',
+        'shdr': 'IIIIIIIIII',
+        'sym': 'IIIBBH',
+    },
+    ELFCLASS64: {
+        'ehdr': 'HHIQQQIHHHHHH',
+        'shdr': 'IIQQQQIIQQ',
+        'sym': 'IBBHQQ',
+    },
+}
+
+EI_NIDENT = 16
+
+Section = collections.namedtuple(
+    'Section',
+    'index name type flags addr offset size link info addralign entsize'
+)
+ElfSymbol = collections.namedtuple(
+    'ElfSymbol',
+    'name value size type bind other shndx'
+)
+
+
+class ElfFile(object):
+    """Read-only view on an ELF file.
+
+    Use it as a context manager, or call `close` when done, to release the
+    memory mapping.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError) as exc:
+                raise ElfError('{}: cannot map file: {}'.format(
+                    filename, exc
+                ))
+
+        try:
+            self._read_headers()
+        except (ElfError, struct.error) as exc:
+            self.close()
+            raise ElfError('{}: {}'.format(filename, exc))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def _read_headers(self):
+        ident = self.data[:EI_NIDENT]
+        if ident[:4] != ELF_MAGIC:
+            raise ElfError('not an ELF file')
+
+        self.elf_class = bytearray(ident)[4]
+        encoding = bytearray(ident)[5]
+        if self.elf_class not in LAYOUTS:
+            raise ElfError('invalid ELF class {}'.format(self.elf_class))
+        if encoding not in (ELFDATA2LSB, ELFDATA2MSB):
+            raise ElfError('invalid data encoding {}'.format(encoding))
+
+        self.big_endian = encoding == ELFDATA2MSB
+        layouts = LAYOUTS[self.elf_class]
+        prefix = '>' if self.big_endian else '<'
+        self.ehdr_struct, self.shdr_struct, self.sym_struct = [
+            struct.Struct(prefix + layouts[kind])
+            for kind in ('ehdr', 'shdr', 'sym')
+        ]
+
+        (self.e_type, self.e_machine, _, self.e_entry, _, e_shoff, _, _, _, _,
+         e_shentsize, e_shnum, e_shstrndx) = self.ehdr_struct.unpack_from(
+            self.data, EI_NIDENT
+        )
+
+        if e_shoff == 0:
+            self.sections = []
+            return
+        if e_shentsize != self.shdr_struct.size:
+            raise ElfError('unexpected section header size {}'.format(
+                e_shentsize
+            ))
+
+        def shdr_at(index):
+            return self.shdr_struct.unpack_from(
+                self.data, e_shoff + index * e_shentsize
+            )
+
+        # Section counts and string table indexes too large for the file
+        # header are stored in the initial section header.
+        if e_shnum == 0 or e_shstrndx == SHN_XINDEX:
+            first = shdr_at(0)
+            if e_shnum == 0:
+                e_shnum = first[5]
+            if e_shstrndx == SHN_XINDEX:
+                e_shstrndx = first[6]
+
+        headers = [shdr_at(i) for i in range(e_shnum)]
+        if e_shstrndx >= e_shnum:
+            raise ElfError('invalid section names index {}'.format(
+                e_shstrndx
+            ))
+
+        shstrtab = headers[e_shstrndx]
+        self.sections = [
+            Section(i, self.string_at(shstrtab[4], hdr[0]), *hdr[1:])
+            for i, hdr in enumerate(headers)
+        ]
+
+    def string_at(self, strtab_offset, index):
+        """Return the null-terminated string at `index` in the string table
+        that starts at `strtab_offset` in the file.
+        """
+        start = strtab_offset + index
+        end = self.data.find(b'\x00', start)
+        if end < 0:
+            raise ElfError('unterminated string at {:#x}'.format(start))
+        return self.data[start:end]
+
+    def section_by_name(self, name):
+        """Return the first section called `name`, or None if there is no
+        such section.
+        """
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    def section_data(self, section):
+        """Return the contents of `section`, as a byte string."""
+        if section.type == SHT_NOBITS:
+            return b''
+        return self.data[section.offset:section.offset + section.size]
+
+    def symbols(self, section):
+        """Yield the ElfSymbol entries in `section`, a SHT_SYMTAB or
+        SHT_DYNSYM section, skipping the initial null symbol.
+        """
+        strtab = self.sections[section.link]
+        sym_struct = self.sym_struct
+        entsize = section.entsize or sym_struct.size
+        is_64 = self.elf_class == ELFCLASS64
+
+        for offset in range(
+            section.offset + entsize,
+            section.offset + section.size - sym_struct.size + 1,
+            entsize
+        ):
+            fields = sym_struct.unpack_from(self.data, offset)
+            if is_64:
+                st_name, st_info, st_other, st_shndx, st_value, st_size = (
+                    fields
+                )
+            else:
+                st_name, st_value, st_size, st_info, st_other, st_shndx = (
+                    fields
+                )
+            yield ElfSymbol(
+                self.string_at(strtab.offset, st_name),
+                st_value, st_size,
+                st_info & 0xf, st_info >> 4, st_other, st_shndx
+            )
+
+    def symbol_table(self):
+        """Return the section holding the symbol table: .symtab, or .dynsym
+        for stripped files. Return None if there is neither.
+        """
+        for sh_type in (SHT_SYMTAB, SHT_DYNSYM):
+            for section in self.sections:
+                if section.type == sh_type:
+                    return section
+        return None
+
+    def code_symbols(self):
+        """Yield (pc, size, name) tuples for all function symbols with a
+        non-null size and defined in an executable section.
+        """
+        symtab = self.symbol_table()
+        if symtab is None:
+            return
+
+        exec_sections = set(
+            section.index for section in self.sections
+            if section.flags & SHF_EXECINSTR
+        )
+
+        # As in binutils, the low bit of ARM function symbols only flags
+        # Thumb code.
+        pc_mask = ~1 if self.e_machine == EM_ARM else ~0
+
+        for sym in self.symbols(symtab):
+            if (
+                sym.type == STT_FUNC and
+                sym.size and
+                sym.shndx in exec_sections
+            ):
+                yield (sym.value & pc_mask, sym.size, sym.name)
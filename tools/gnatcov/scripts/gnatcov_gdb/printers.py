@@ -1,15 +1,102 @@
 """
 Collection of pretty-printers for types in gnatcov.
+
+Containers in gnatcov can hold a lot of elements, so their pretty-printers
+only yield a page of children at a time, and can display a mere summary
+instead. See the "gnatcov-page-limit", "gnatcov-page-offset" and
+"gnatcov-summary" GDB parameters.
 """
 
 import gdb
 import gdb.printing
 
 from gnatdbg.records import decoded_record
-from gnatdbg.sets import OrderedSetPrinter
+from gnatdbg.sets import OrderedSetPrinter as GNATOrderedSetPrinter
 from gnatdbg.strings import StringAccess
 
 
+class PageLimitParameter(gdb.Parameter):
+    """
+    Maximum number of elements to display for gnatcov containers.
+    """
+
+    set_doc = 'Set the maximum number of elements to display for gnatcov ' \
+              'containers.'
+    show_doc = 'Show the maximum number of elements to display for gnatcov ' \
+               'containers.'
+
+    def __init__(self):
+        super(PageLimitParameter, self).__init__(
+            'gnatcov-page-limit', gdb.COMMAND_DATA,
+            gdb.PARAM_ZUINTEGER_UNLIMITED
+        )
+        self.value = 200
+
+    def get_set_string(self):
+        return ''
+
+    def get_show_string(self, svalue):
+        return 'Page limit for gnatcov containers is {}.'.format(svalue)
+
+    @property
+    def limit(self):
+        """
+        Page limit, or None if unlimited.
+        """
+        # Depending on the GDB version, "unlimited" is either -1 or None
+        return None if self.value is None or self.value < 0 else self.value
+
+
+class PageOffsetParameter(gdb.Parameter):
+    """
+    Index of the first element to display for gnatcov containers.
+    """
+
+    set_doc = 'Set the index of the first element to display for gnatcov ' \
+              'containers.'
+    show_doc = 'Show the index of the first element to display for gnatcov ' \
+               'containers.'
+
+    def __init__(self):
+        super(PageOffsetParameter, self).__init__(
+            'gnatcov-page-offset', gdb.COMMAND_DATA, gdb.PARAM_ZUINTEGER
+        )
+        self.value = 0
+
+    def get_set_string(self):
+        return ''
+
+    def get_show_string(self, svalue):
+        return 'Page offset for gnatcov containers is {}.'.format(svalue)
+
+
+class SummaryParameter(gdb.Parameter):
+    """
+    Whether to only display a summary for gnatcov containers.
+    """
+
+    set_doc = 'Set whether to only display a summary for gnatcov containers.'
+    show_doc = 'Show whether to only display a summary for gnatcov ' \
+               'containers.'
+
+    def __init__(self):
+        super(SummaryParameter, self).__init__(
+            'gnatcov-summary', gdb.COMMAND_DATA, gdb.PARAM_BOOLEAN
+        )
+        self.value = False
+
+    def get_set_string(self):
+        return ''
+
+    def get_show_string(self, svalue):
+        return 'Summary mode for gnatcov containers is {}.'.format(svalue)
+
+
+page_limit = PageLimitParameter()
+page_offset = PageOffsetParameter()
+summary = SummaryParameter()
+
+
 class SubPrettyPrinter(gdb.printing.SubPrettyPrinter):
     """
     Base class for all type-specific pretty-printers.
@@ -22,9 +109,13 @@ class SubPrettyPrinter(gdb.printing.SubPrettyPrinter):
     Fully-qualified name for the type this pretty-printer handles.
     """
 
+    _type_name = None
+
     @classmethod
     def type_name(cls):
-        return cls.name.replace('.', '__').lower()
+        if cls._type_name is None:
+            cls._type_name = cls.name.replace('.', '__').lower()
+        return cls._type_name
 
     @classmethod
     def matches(cls, value):
@@ -136,22 +227,75 @@ class AddressInfo(SubPrettyPrinter):
         return '{} => {}'.format(prefix, suffix)
 
 
-class InsnSetRangesPrinter(SubPrettyPrinter):
+class OrderedSetPrinter(SubPrettyPrinter):
     """
-    Pretty-printer for Elf_Disassemblers.Insn_Set_Ranges.
+    Base class for pretty-printers of Ada.Containers.Ordered_Sets instances.
+
+    Children are yielded lazily, one page at a time, and only a summary is
+    displayed in summary mode.
     """
 
-    name = 'Elf_Disassemblers.Insn_Set_Ranges'
+    def set_value(self):
+        """
+        Return the Ordered_Sets.Set value to display.
+        """
+        return self.value
 
     @property
     def set_pp(self):
-        return OrderedSetPrinter(self.value['_parent'])
+        return GNATOrderedSetPrinter(self.set_value())
+
+    def summary(self):
+        """
+        Return the (first, last) elements in the set, or None if it is
+        empty.
+        """
+        tree = self.set_value()['tree']
+        if not tree['first']:
+            return None
+        return (tree['first'].dereference()['element'],
+                tree['last'].dereference()['element'])
 
     def to_string(self):
-        return self.set_pp.to_string()
+        result = self.set_pp.to_string()
+        if summary.value:
+            bounds = self.summary()
+            if bounds is not None:
+                result += ', first: {}, last: {}'.format(*bounds)
+        return result
 
     def children(self):
-        return self.set_pp.children()
+        if summary.value:
+            return
+
+        offset = page_offset.value
+        limit = page_limit.limit
+        for i, child in enumerate(self.set_pp.children()):
+            if i < offset:
+                continue
+            elif limit is not None and i >= offset + limit:
+                yield ('...', 'more elements, see "set gnatcov-page-offset"')
+                return
+            yield child
+
+
+class AddressInfoSetPrinter(OrderedSetPrinter):
+    """
+    Pretty-printer for Traces_Elf.Address_Info_Sets.Set.
+    """
+
+    name = 'Traces_Elf.Address_Info_Sets.Set'
+
+
+class InsnSetRangesPrinter(OrderedSetPrinter):
+    """
+    Pretty-printer for Elf_Disassemblers.Insn_Set_Ranges.
+    """
+
+    name = 'Elf_Disassemblers.Insn_Set_Ranges'
+
+    def set_value(self):
+        return self.value['_parent']
 
 
 class InsnSetRangePrinter(SubPrettyPrinter):
@@ -169,10 +313,31 @@ class InsnSetRangePrinter(SubPrettyPrinter):
 
 
 class PrettyPrinter(gdb.printing.PrettyPrinter):
+    """
+    Pretty-printer for the gnatcov types in one objfile.
+
+    As there is one instance per objfile, we can cache the subprinter that
+    matches each type name, so that each value costs a single lookup.
+    """
+
+    def __init__(self, name, subprinters):
+        super(PrettyPrinter, self).__init__(name, subprinters)
+        self.by_type_name = {}
+
     def __call__(self, value):
-        for p in self.subprinters:
-            if p.enabled and p.matches(value):
-                return p(value)
+        type_name = value.type.name
+        try:
+            p = self.by_type_name[type_name]
+        except KeyError:
+            p = None
+            for sp in self.subprinters:
+                if sp.matches(value):
+                    p = sp
+                    break
+            self.by_type_name[type_name] = p
+
+        if p is not None and p.enabled:
+            return p(value)
 
 
 def register_printers(objfile):
@@ -183,6 +348,7 @@ def register_printers(objfile):
         LocalSlocPrinter,
         SCOId,
         AddressInfo,
+        AddressInfoSetPrinter,
         InsnSetRangesPrinter,
         InsnSetRangePrinter,
     ]))
@@ -126,6 +126,36 @@ class IntervalMap(object):
         self.values[interval.start] = value
 
 
+    @classmethod
+    def from_items(cls, items):
+        """Build an interval map from an iterable of `(start, stop, value)`
+        tuples.
+
+        This is much faster than inserting intervals one at a time for large
+        sets. Intervals are considered in increasing order, and the ones that
+        overlap with previously considered intervals are left out. Return the
+        interval map and the list of left out items.
+        """
+        result = cls()
+        rejected = []
+        last_stop = None
+
+        for item in sorted(items, key=lambda item: (item[0], item[1])):
+            start, stop, value = item
+            if start >= stop:
+                continue
+            elif last_stop is not None and start < last_stop:
+                rejected.append(item)
+                continue
+
+            if last_stop != start:
+                result.bounds.append(start)
+            result.bounds.append(stop)
+            result.values[start] = value
+            last_stop = stop
+
+        return result, rejected
+
     def __getitem__(self, key):
         """Return the value associated to the interval that contains `key`.
 
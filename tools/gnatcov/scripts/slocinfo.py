@@ -3,8 +3,10 @@
 import collections
 import os.path
 import re
+import struct
 import subprocess
 
+import elffile
 import intervalmap
 
 
@@ -34,13 +36,49 @@ def format_sloc(sloc, basename=False):
     )
 
 
-def get_sloc_info(exe_filename):
+def get_sloc_info(exe_filename, use_gnatcov=False):
     """Parse sloc info in `exe_filename` and return it as an interval map.
 
     The result maps from program counter to lists of `Sloc` objects.
+
+    The DWARF line tables are decoded directly from the ELF file, unless
+    `use_gnatcov` is true or the file cannot be handled this way (relocatable
+    objects, unsupported DWARF versions), in which case gnatcov dump-lines is
+    used instead. Line table sequences that read_line_rows cannot decode the
+    way gnatcov does are taken from gnatcov dump-lines as well.
     """
+    if not use_gnatcov:
+        try:
+            with elffile.ElfFile(exe_filename) as elf:
+                if elf.e_type != elffile.ET_REL:
+                    ambiguous = []
+                    rows = list(read_line_rows(elf, ambiguous))
+                    if ambiguous:
+                        rows.extend(gnatcov_line_rows_in(
+                            exe_filename, ambiguous
+                        ))
+                    return build_sloc_info(rows)
+        except (elffile.ElfError, DwarfError):
+            pass
+
+    return get_sloc_info_from_gnatcov(exe_filename)
+
+
+def get_sloc_info_from_gnatcov(exe_filename):
+    """Like get_sloc_info, using gnatcov dump-lines to read line tables."""
     sloc_info = intervalmap.IntervalMap()
+    for pc_start, pc_stop, sloc in gnatcov_line_rows(exe_filename):
+        try:
+            sloc_info[pc_start:pc_stop] = [sloc]
+        except ValueError:
+            sloc_info[pc_start].append(sloc)
+    return sloc_info
+
 
+def gnatcov_line_rows(exe_filename):
+    """Yield `(pc_start, pc_stop, sloc)` rows for the line tables in
+    `exe_filename`, as decoded by gnatcov dump-lines.
+    """
     # Let gnatcov parse ELF and DWARF for us.
     proc = subprocess.Popen(
         ['gnatcov', 'dump-lines', exe_filename], stdout=subprocess.PIPE
@@ -67,17 +105,533 @@ def get_sloc_info(exe_filename):
     for line in outs.split(b'\n'):
         m = SLOC_INFO_LINE.match(line)
         if m:
-            pc_start = int(m.group('pc_start'), 16)
-            pc_stop = int(m.group('pc_stop'), 16) + 1
-            sloc = Sloc(
-                uniq_string(m.group('src_file')),
-                int_or_none(m.group('line')),
-                int_or_none(m.group('column')),
-                int_or_none(m.group('discriminator')),
+            yield (
+                int(m.group('pc_start'), 16),
+                int(m.group('pc_stop'), 16) + 1,
+                Sloc(
+                    uniq_string(m.group('src_file')),
+                    int_or_none(m.group('line')),
+                    int_or_none(m.group('column')),
+                    int_or_none(m.group('discriminator')),
+                )
             )
-            try:
-                sloc_info[pc_start:pc_stop] = [sloc]
-            except ValueError:
-                sloc_info[pc_start].append(sloc)
+
+
+def gnatcov_line_rows_in(exe_filename, spans):
+    """Return the gnatcov dump-lines rows for `exe_filename` that start in
+    one of the `(pc_start, pc_stop)` address `spans`.
+    """
+    span_map, _ = intervalmap.IntervalMap.from_items(
+        (pc_start, pc_stop, True) for pc_start, pc_stop in spans
+    )
+    return [row for row in gnatcov_line_rows(exe_filename)
+            if span_map.get(row[0], False)]
+
+
+def compare_sloc_info(exe_filename):
+    """Compare the sloc info get_sloc_info computes for `exe_filename` with
+    the one gnatcov dump-lines yields.
+
+    Return a list of `(pc_start, pc_stop, slocs, gnatcov_slocs)` tuples for
+    the address ranges where they differ. Either list of slocs is None when
+    the range is missing on this side.
+    """
+    def ranges(sloc_info):
+        return collections.OrderedDict(sloc_info.items())
+
+    native = ranges(get_sloc_info(exe_filename))
+    gnatcov = ranges(get_sloc_info(exe_filename, use_gnatcov=True))
+
+    result = []
+    for pc_range in sorted(set(native) | set(gnatcov)):
+        slocs = native.get(pc_range)
+        gnatcov_slocs = gnatcov.get(pc_range)
+        if slocs != gnatcov_slocs:
+            result.append(pc_range + (slocs, gnatcov_slocs))
+    return result
+
+
+def build_sloc_info(rows):
+    """Build the result of get_sloc_info from an iterable of `(pc_start,
+    pc_stop, sloc)` rows.
+    """
+    # Group slocs for the same address range, in the order of rows
+    slocs_for = collections.OrderedDict()
+    for pc_start, pc_stop, sloc in rows:
+        slocs = slocs_for.setdefault((pc_start, pc_stop), [])
+        if sloc not in slocs:
+            slocs.append(sloc)
+
+    sloc_info, overlapping = intervalmap.IntervalMap.from_items(
+        (pc_start, pc_stop, slocs)
+        for (pc_start, pc_stop), slocs in slocs_for.items()
+    )
+
+    # As for gnatcov dump-lines output, slocs for ranges that overlap with
+    # others are attached to the range that contains their first address.
+    for pc_start, _, slocs in overlapping:
+        existing = sloc_info.get(pc_start)
+        if existing is not None:
+            existing.extend(s for s in slocs if s not in existing)
 
     return sloc_info
+
+
+class DwarfError(Exception):
+    """Raised when DWARF debug info cannot be decoded."""
+    pass
+
+
+# See dwarf.ads
+
+DW_AT_stmt_list = 0x10
+DW_AT_comp_dir = 0x1b
+
+DW_FORM_addr = 0x01
+DW_FORM_block2 = 0x03
+DW_FORM_block4 = 0x04
+DW_FORM_data2 = 0x05
+DW_FORM_data4 = 0x06
+DW_FORM_data8 = 0x07
+DW_FORM_string = 0x08
+DW_FORM_block = 0x09
+DW_FORM_block1 = 0x0a
+DW_FORM_data1 = 0x0b
+DW_FORM_flag = 0x0c
+DW_FORM_sdata = 0x0d
+DW_FORM_strp = 0x0e
+DW_FORM_udata = 0x0f
+DW_FORM_ref_addr = 0x10
+DW_FORM_ref1 = 0x11
+DW_FORM_ref2 = 0x12
+DW_FORM_ref4 = 0x13
+DW_FORM_ref8 = 0x14
+DW_FORM_ref_udata = 0x15
+DW_FORM_indirect = 0x16
+DW_FORM_sec_offset = 0x17
+DW_FORM_exprloc = 0x18
+DW_FORM_flag_present = 0x19
+DW_FORM_ref_sig8 = 0x20
+DW_FORM_GNU_ref_alt = 0x1f20
+DW_FORM_GNU_strp_alt = 0x1f21
+
+DW_LNS_copy = 1
+DW_LNS_advance_pc = 2
+DW_LNS_advance_line = 3
+DW_LNS_set_file = 4
+DW_LNS_set_column = 5
+DW_LNS_negate_stmt = 6
+DW_LNS_set_basic_block = 7
+DW_LNS_const_add_pc = 8
+DW_LNS_fixed_advance_pc = 9
+
+DW_LNE_end_sequence = 1
+DW_LNE_set_address = 2
+DW_LNE_define_file = 3
+DW_LNE_set_discriminator = 4
+
+
+class DwarfReader(object):
+    """Sequential reader for the contents of a DWARF section."""
+
+    def __init__(self, data, big_endian, offset=0):
+        self.data = bytearray(data)
+        self.prefix = '>' if big_endian else '<'
+        self.offset = offset
+
+    def u8(self):
+        self.offset += 1
+        return self.data[self.offset - 1]
+
+    def fixed(self, size):
+        """Read an unsigned integer of `size` bytes."""
+        fmt = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}[size]
+        result, = struct.unpack_from(self.prefix + fmt, self.data, self.offset)
+        self.offset += size
+        return result
+
+    def uleb128(self):
+        data = self.data
+        result = shift = 0
+        while True:
+            b = data[self.offset]
+            self.offset += 1
+            result |= (b & 0x7f) << shift
+            shift += 7
+            if b < 0x80:
+                return result
+
+    def sleb128(self):
+        data = self.data
+        result = shift = 0
+        while True:
+            b = data[self.offset]
+            self.offset += 1
+            result |= (b & 0x7f) << shift
+            shift += 7
+            if b < 0x80:
+                if b & 0x40:
+                    result -= 1 << shift
+                return result
+
+    def cstring(self):
+        end = self.data.index(b'\x00', self.offset)
+        result = bytes(self.data[self.offset:end])
+        self.offset = end + 1
+        return result
+
+    def unit_length(self):
+        """Read an initial length field. Return the length and the size of
+        section offsets in the unit (4 or 8).
+        """
+        length = self.fixed(4)
+        if length == 0xffffffff:
+            return self.fixed(8), 8
+        elif length >= 0xfffffff0:
+            raise DwarfError('invalid unit length {:#x}'.format(length))
+        return length, 4
+
+
+def read_abbrevs(reader):
+    """Read the abbreviation table at the current position of `reader`.
+    Return a mapping from abbreviation codes to lists of (attribute, form)
+    pairs.
+    """
+    result = {}
+    while True:
+        code = reader.uleb128()
+        if code == 0:
+            return result
+        reader.uleb128()   # Tag
+        reader.u8()        # Children
+        attrs = []
+        while True:
+            attr, form = reader.uleb128(), reader.uleb128()
+            if attr == 0 and form == 0:
+                break
+            attrs.append((attr, form))
+        result[code] = attrs
+
+
+def read_form(reader, form, version, addr_size, offset_size, str_data):
+    """Read an attribute value of the given `form`. Return the value for
+    constants, section offsets and strings, None otherwise.
+    """
+    if form == DW_FORM_indirect:
+        form = reader.uleb128()
+
+    fixed_sizes = {
+        DW_FORM_addr: addr_size,
+        DW_FORM_data1: 1, DW_FORM_ref1: 1, DW_FORM_flag: 1,
+        DW_FORM_data2: 2, DW_FORM_ref2: 2,
+        DW_FORM_data4: 4, DW_FORM_ref4: 4,
+        DW_FORM_data8: 8, DW_FORM_ref8: 8, DW_FORM_ref_sig8: 8,
+        DW_FORM_sec_offset: offset_size, DW_FORM_strp: offset_size,
+        DW_FORM_GNU_ref_alt: offset_size, DW_FORM_GNU_strp_alt: offset_size,
+        DW_FORM_ref_addr: addr_size if version <= 2 else offset_size,
+        DW_FORM_flag_present: 0,
+    }
+    block_sizes = {
+        DW_FORM_block1: 1, DW_FORM_block2: 2, DW_FORM_block4: 4,
+    }
+
+    if form in fixed_sizes:
+        size = fixed_sizes[form]
+        value = reader.fixed(size) if size else True
+        if form == DW_FORM_strp:
+            end = str_data.index(b'\x00', value)
+            return bytes(str_data[value:end])
+        return value if form != DW_FORM_GNU_strp_alt else None
+
+    elif form == DW_FORM_string:
+        return reader.cstring()
+
+    elif form in (DW_FORM_udata, DW_FORM_ref_udata):
+        return reader.uleb128()
+
+    elif form == DW_FORM_sdata:
+        return reader.sleb128()
+
+    elif form in block_sizes or form in (DW_FORM_block, DW_FORM_exprloc):
+        size = (reader.fixed(block_sizes[form]) if form in block_sizes
+                else reader.uleb128())
+        reader.offset += size
+        return None
+
+    else:
+        raise DwarfError('unsupported attribute form {:#x}'.format(form))
+
+
+def read_comp_dirs(elf):
+    """Return a mapping from .debug_line offsets to compilation directories,
+    from the compilation units in .debug_info.
+    """
+    info = elf.section_by_name(b'.debug_info')
+    abbrev = elf.section_by_name(b'.debug_abbrev')
+    if info is None or abbrev is None:
+        return {}
+
+    str_section = elf.section_by_name(b'.debug_str')
+    str_data = (bytearray(elf.section_data(str_section))
+                if str_section else bytearray())
+    abbrev_data = elf.section_data(abbrev)
+
+    reader = DwarfReader(elf.section_data(info), elf.big_endian)
+    result = {}
+    abbrevs_cache = {}
+
+    while reader.offset < len(reader.data):
+        length, offset_size = reader.unit_length()
+        next_unit = reader.offset + length
+
+        version = reader.fixed(2)
+        if not 2 <= version <= 4:
+            raise DwarfError('unsupported DWARF version {}'.format(version))
+        abbrev_offset = reader.fixed(offset_size)
+        addr_size = reader.u8()
+
+        if abbrev_offset not in abbrevs_cache:
+            abbrevs_cache[abbrev_offset] = read_abbrevs(
+                DwarfReader(abbrev_data, elf.big_endian, abbrev_offset)
+            )
+        abbrevs = abbrevs_cache[abbrev_offset]
+
+        # Only look at the attributes of the compilation unit DIE
+        stmt_list = comp_dir = None
+        code = reader.uleb128()
+        for attr, form in abbrevs.get(code, []):
+            value = read_form(
+                reader, form, version, addr_size, offset_size, str_data
+            )
+            if attr == DW_AT_stmt_list:
+                stmt_list = value
+            elif attr == DW_AT_comp_dir:
+                comp_dir = value
+
+        if stmt_list is not None and comp_dir is not None:
+            result[stmt_list] = comp_dir
+        reader.offset = next_unit
+
+    return result
+
+
+def is_absolute_path(path):
+    """Likewise Files_Table.Is_Absolute_Path."""
+    return (
+        path.startswith(b'/') or
+        (len(path) >= 3 and path[1:3] == b':\\' and path[:1].isalpha())
+    )
+
+
+def canonicalize_filename(filename):
+    """Likewise Files_Table.Canonicalize_Filename."""
+    if len(filename) > 2 and filename[1:2] == b':':
+        return (filename[:1].upper() +
+                filename[1:].lower().replace(b'/', b'\\'))
+    return filename
+
+
+def read_line_rows(elf, ambiguous=None):
+    """Yield `(pc_start, pc_stop, sloc)` rows for all the line tables in the
+    .debug_line section of `elf`, running the DWARF line number state machine
+    as Traces_Elf.Read_Debug_Lines does.
+
+    Line table entries for address 0 are discarded: they correspond to code
+    removed with --gc-sections.
+
+    When several rows of a sequence start at the same address, gnatcov
+    restricts all but the last one to the first instruction and splits the
+    range of the last one accordingly. We have no disassembler here, so no
+    rows are yielded for such sequences: if `ambiguous` is not None, their
+    `(pc_start, pc_stop)` address spans are appended to it instead, so that
+    the caller can get these rows from gnatcov dump-lines.
+    """
+    section = elf.section_by_name(b'.debug_line')
+    if section is None:
+        return
+
+    comp_dirs = read_comp_dirs(elf)
+
+    # Used to store only one Sloc per distinct value, and thus one string per
+    # filename (reducing memory consumption).
+    slocs = {}
+
+    reader = DwarfReader(elf.section_data(section), elf.big_endian)
+    data = reader.data
+
+    while reader.offset < len(data):
+        unit_offset = reader.offset
+        length, offset_size = reader.unit_length()
+        unit_end = reader.offset + length
+
+        version = reader.fixed(2)
+        if not 2 <= version <= 4:
+            raise DwarfError('unsupported line table version {}'.format(
+                version
+            ))
+        header_length = reader.fixed(offset_size)
+        program_start = reader.offset + header_length
+
+        min_insn_length = reader.u8()
+        if version >= 4:
+            reader.u8()    # Maximum operations per instruction
+        reader.u8()        # Default is_stmt
+        line_base = reader.u8()
+        if line_base >= 0x80:
+            line_base -= 0x100
+        line_range = reader.u8()
+        opcode_base = reader.u8()
+        opcode_lengths = [0] + [reader.u8() for _ in range(opcode_base - 1)]
+
+        dirnames = []
+        while data[reader.offset] != 0:
+            dirnames.append(reader.cstring())
+        reader.offset += 1
+
+        comp_dir = comp_dirs.get(unit_offset)
+
+        def make_filename(name, dir_index):
+            if 0 < dir_index <= len(dirnames):
+                dirname = dirnames[dir_index - 1]
+            elif comp_dir is not None and not is_absolute_path(name):
+                dirname = comp_dir
+            else:
+                dirname = None
+            return canonicalize_filename(
+                dirname + b'/' + name if dirname else name
+            )
+
+        # Filenames, 1-based
+        filenames = [None]
+        while data[reader.offset] != 0:
+            name = reader.cstring()
+            dir_index = reader.uleb128()
+            reader.uleb128()   # Modification time
+            reader.uleb128()   # Length
+            filenames.append(make_filename(name, dir_index))
+
+        # Run the line number program. Rows for a sequence are accumulated
+        # as (address, sloc) pairs until its end address is known.
+        reader.offset = program_start
+        const_add_pc = ((255 - opcode_base) // line_range) * min_insn_length
+
+        def reset():
+            return 0, 0, 1, 1, 0, 0
+
+        base_pc, pc, file_index, line, column, disc = reset()
+        rows = []
+
+        def add_row():
+            if base_pc == 0 or not 0 < file_index < len(filenames):
+                return
+            sloc = Sloc(filenames[file_index], line,
+                        column or None, disc or None)
+            rows.append((pc, slocs.setdefault(sloc, sloc)))
+
+        while reader.offset < unit_end:
+            opcode = data[reader.offset]
+            reader.offset += 1
+
+            if opcode >= opcode_base:
+                # Special opcode
+                adjusted = opcode - opcode_base
+                pc += (adjusted // line_range) * min_insn_length
+                line += line_base + adjusted % line_range
+                add_row()
+                disc = 0
+
+            elif opcode == 0:
+                # Extended opcode
+                ext_length = reader.uleb128()
+                ext_end = reader.offset + ext_length
+                ext_opcode = reader.u8()
+
+                if ext_opcode == DW_LNE_end_sequence:
+                    if len(set(row_pc for row_pc, _ in rows)) < len(rows):
+                        if ambiguous is not None:
+                            ambiguous.append((base_pc, pc))
+                    else:
+                        for row in sequence_ranges(rows, pc):
+                            yield row
+                    base_pc, pc, file_index, line, column, disc = reset()
+                    rows = []
+
+                elif ext_opcode == DW_LNE_set_address:
+                    pc = base_pc = reader.fixed(ext_length - 1)
+
+                elif ext_opcode == DW_LNE_define_file:
+                    name = reader.cstring()
+                    dir_index = reader.uleb128()
+                    filenames.append(make_filename(name, dir_index))
+
+                elif ext_opcode == DW_LNE_set_discriminator:
+                    disc = reader.uleb128()
+
+                reader.offset = ext_end
+
+            elif opcode == DW_LNS_copy:
+                add_row()
+                disc = 0
+
+            elif opcode == DW_LNS_advance_pc:
+                pc += reader.uleb128() * min_insn_length
+
+            elif opcode == DW_LNS_advance_line:
+                line += reader.sleb128()
+
+            elif opcode == DW_LNS_set_file:
+                file_index = reader.uleb128()
+
+            elif opcode == DW_LNS_set_column:
+                column = reader.uleb128()
+
+            elif opcode == DW_LNS_const_add_pc:
+                pc += const_add_pc
+
+            elif opcode == DW_LNS_fixed_advance_pc:
+                pc += reader.fixed(2)
+
+            else:
+                # Other standard opcodes do not change the rows we produce:
+                # skip their operands.
+                for _ in range(opcode_lengths[opcode]):
+                    reader.uleb128()
+
+        reader.offset = unit_end
+
+
+def sequence_ranges(rows, end_pc):
+    """Return the list of `(pc_start, pc_stop, sloc)` rows for the `(address,
+    sloc)` rows of a line table sequence that ends at `end_pc`.
+    """
+    # Each row extends up to the next row with a greater address
+    result = []
+    next_pc = end_pc
+    for i in range(len(rows) - 1, -1, -1):
+        pc, sloc = rows[i]
+        if i + 1 < len(rows) and rows[i + 1][0] > pc:
+            next_pc = rows[i + 1][0]
+        if pc < next_pc:
+            result.append((pc, next_pc, sloc))
+    result.reverse()
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Check that decoding line tables directly gives the same result as gnatcov
+    # dump-lines on the given executables.
+    status = 0
+    for exe_filename in sys.argv[1:]:
+        for pc_start, pc_stop, slocs, gnatcov_slocs in compare_sloc_info(
+            exe_filename
+        ):
+            status = 1
+            print('{}: {:#x}-{:#x}:'.format(exe_filename, pc_start, pc_stop))
+            for label, value in (('native', slocs),
+                                 ('gnatcov', gnatcov_slocs)):
+                print('  {:<8} {}'.format(label + ':', '; '.join(
+                    format_sloc(sloc) for sloc in value or [None]
+                )))
+    sys.exit(status)
@@ -5,6 +5,7 @@ import collections
 import re
 import subprocess
 
+import elffile
 import intervalmap
 
 
@@ -37,13 +38,34 @@ def debug_interval(intval):
         print '-> {:x}'.format(unseen), intval.values[unseen]
     print '---'
 
-def get_sym_info(exe_filename):
+def get_sym_info(exe_filename, use_nm=False):
     """Parse symbol info in `exe_filename` and return it as an interval map,
     and the symbols could not be inserted in the interval map because of
     address overlapping.
 
     The result maps from program counter to a symbol.
+
+    The symbol table is read directly from the ELF file, unless `use_nm` is
+    true or the file cannot be decoded, in which case nm is used instead.
     """
+    if not use_nm:
+        try:
+            with elffile.ElfFile(exe_filename) as elf:
+                symbols = [Symbol(*sym) for sym in elf.code_symbols()]
+        except elffile.ElfError:
+            pass
+        else:
+            sym_info, overlap = intervalmap.IntervalMap.from_items(
+                (symbol.pc, symbol.pc + symbol.size, symbol)
+                for symbol in symbols
+            )
+            return sym_info, [symbol for _, _, symbol in overlap]
+
+    return get_sym_info_from_nm(exe_filename)
+
+
+def get_sym_info_from_nm(exe_filename):
+    """Like get_sym_info, using nm to read the symbol table."""
     sym_info = intervalmap.IntervalMap()
     overlap_syms = []
 
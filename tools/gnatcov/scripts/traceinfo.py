@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import collections
+import os
 import re
 import subprocess
+import sys
 
 import intervalmap
 
@@ -27,20 +29,134 @@ def merge_flags(f1, f2):
     ))
 
 
-def get_trace_info(traces):
-    """Parse trace info from `traces`. Return an interval map whose covered
-    elements are executed instructions addresses.
+# Trace entry operation bits, see Trace_Op_* in qemu_traces.ads
+TRACE_OP_BLOCK = 0x10
+TRACE_OP_FAULT = 0x20
+TRACE_OP_SPECIAL = 0x80
+
+# Special trace entry kinds, see Trace_Special_* in qemu_traces.ads
+TRACE_SPECIAL_LOADADDR = 1
+TRACE_SPECIAL_LOAD_SHARED_OBJECT = 2
+TRACE_SPECIAL_UNLOAD_SHARED_OBJECT = 3
+
+
+def import_tracelib():
+    """Return the tracelib module from the testsuite support library in the
+    source tree, or None if it is not available.
+    """
+    suite_dir = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        '..', '..', '..', 'testsuite', 'SUITE'
+    )
+    if suite_dir not in sys.path:
+        sys.path.append(suite_dir)
+    try:
+        import tracelib
+    except ImportError:
+        return None
+    return tracelib
+
+
+def dumped_trace_entries(traces):
+    """Yield (first PC, last PC, op) for the trace entries in the raw
+    `traces` file, as "gnatcov dump-trace" reports them.
     """
-    # Let gnatcov parse the traces for us.
     proc = subprocess.Popen(
         ['gnatcov', 'dump-trace', traces], stdout=subprocess.PIPE
     )
-
     outs, errs = proc.communicate()
+
     if proc.returncode != 0:
         raise RuntimeError('gnatcov dump-trace returned an error')
 
-    # Parse its output and collect information.
+    for line in outs.split(b'\n'):
+        m = TRACE_LINE.match(line)
+        if m:
+            op = TRACE_OP_BLOCK
+            for bit, flag in enumerate(
+                ('branch', 'fallthrough', 'fault', 'special')
+            ):
+                if m.group(flag) == 't':
+                    op |= 1 << bit
+            yield (int(m.group('start'), 16), int(m.group('end'), 16), op)
+
+
+def decoded_trace_entries(tracelib, traces):
+    """Yield (first PC, last PC, op) for the trace entries in the `traces`
+    file, decoded with `tracelib`, which handles compressed traces.
+
+    This mimics what "gnatcov dump-trace" reports, see Read_Trace_File_Gen in
+    traces_files.adb: entries before the "loadaddr" one are skipped for
+    traces with a kernel, and entries are relocated relatively to the
+    kernel load address or to the shared object they belong to.
+    """
+    with open(traces, 'rb') as fp:
+        stream = tracelib.TraceStream(fp)
+        entries = stream.entries()
+
+        offset = 0
+        kernel = stream.infos.infos.get(tracelib.InfoKind.Kernel_File_Name)
+        if kernel and kernel.data:
+            for e in entries:
+                if (e.op == TRACE_OP_SPECIAL
+                        and e.size == TRACE_SPECIAL_LOADADDR):
+                    offset = e.pc
+                    break
+            else:
+                raise RuntimeError(
+                    "{}: no 'loadaddr' special trace entry".format(traces)
+                )
+
+        # Mapping: first PC -> last PC of the loaded shared objects
+        shared_objects = {}
+
+        for e in entries:
+            if e.op == TRACE_OP_SPECIAL:
+                if e.size == TRACE_SPECIAL_LOAD_SHARED_OBJECT:
+                    info = e.infos.infos.get(tracelib.InfoKind.ExecCodeSize)
+                    code_size = int(info.data) if info else 0
+                    shared_objects[e.pc] = e.pc + code_size - 1
+                elif e.size == TRACE_SPECIAL_UNLOAD_SHARED_OBJECT:
+                    shared_objects.pop(e.pc, None)
+                else:
+                    raise RuntimeError(
+                        '{}: unexpected special trace entry: 0x{:x}'.format(
+                            traces, e.size
+                        )
+                    )
+                continue
+
+            if offset and e.pc < offset:
+                continue
+
+            entry_offset = offset
+            for first, last in shared_objects.items():
+                if first <= e.pc <= last:
+                    entry_offset = first
+                    break
+
+            first_pc = e.pc - entry_offset
+            yield (first_pc, first_pc + e.size - 1, e.op)
+
+
+def get_trace_info(traces):
+    """Parse trace info from `traces`, which may be compressed with gzip or
+    zlib. Return an interval map whose covered elements are executed
+    instructions addresses.
+    """
+    # Let gnatcov parse raw traces for us. It reads trace files with
+    # fixed-size reads only, so we decode compressed ones on our own rather
+    # than feeding it a pipe.
+    tracelib = import_tracelib()
+    with open(traces, 'rb') as f:
+        head = f.read(2)
+    if tracelib and tracelib.Compression.detect(head):
+        entries = decoded_trace_entries(tracelib, traces)
+    else:
+        entries = dumped_trace_entries(traces)
+
+    # Collect information from the block entries, as "gnatcov dump-trace"
+    # reports them without fault.
 
     # Mapping: end PC -> LeaveFlags
     leave_flags = {}
@@ -49,36 +165,38 @@ def get_trace_info(traces):
 
     # First collect all traces ranges, unifying ranges that start at the same
     # address.
-    for line in outs.split(b'\n'):
-        m = TRACE_LINE.match(line)
-        if m:
-            pc_start = int(m.group('start'), 16)
-            # For gnatcov, the end address is executed, but for our interval
-            # map, the end bound is not covered.
-            pc_end = int(m.group('end'), 16) + 1
-
-            flags = LeaveFlags(
-                m.group('special') == 't',
-                m.group('fault') == 't',
-                True,
-                m.group('fallthrough') == 't',
-                m.group('branch') == 't',
-            )
-
-            # If pc_start is already in the range, just take the longest trace.
-            try:
-                old_end = ranges[pc_start]
-            except KeyError:
-                ranges[pc_start] = pc_end
-            else:
-                ranges[pc_start] = max(pc_end, old_end)
+    for first_pc, last_pc, op in entries:
+        if op & (TRACE_OP_BLOCK | TRACE_OP_FAULT) != TRACE_OP_BLOCK:
+            continue
+
+        pc_start = first_pc
+        # For gnatcov, the end address is executed, but for our interval map,
+        # the end bound is not covered.
+        pc_end = last_pc + 1
+
+        # Same as the four low order bits "gnatcov dump-trace" displays
+        flags = LeaveFlags(
+            bool(op & 0x08),
+            bool(op & 0x04),
+            True,
+            bool(op & 0x02),
+            bool(op & 0x01),
+        )
+
+        # If pc_start is already in the range, just take the longest trace.
+        try:
+            old_end = ranges[pc_start]
+        except KeyError:
+            ranges[pc_start] = pc_end
+        else:
+            ranges[pc_start] = max(pc_end, old_end)
 
-            try:
-                old_flags = leave_flags[pc_end]
-            except KeyError:
-                leave_flags[pc_end] = flags
-            else:
-                leave_flags[pc_end] = merge_flags(old_flags, flags)
+        try:
+            old_flags = leave_flags[pc_end]
+        except KeyError:
+            leave_flags[pc_end] = flags
+        else:
+            leave_flags[pc_end] = merge_flags(old_flags, flags)
 
     # Then flatten the mapping to an interval map, for fast access. These two
     # steps are needed since IntervalMap objects do not handle overlapping